@@ -1,45 +1,48 @@
 #   Authors: Christian Komo, Niels Bidault
-#   If given NotImplementedError and module ID 64 not found, enter 'mode COM3' in command line
+#   Timeouts and NotImplementedError / module ID 64 not found are recovered by reopening the port (fluke_session.py)
+#   If it never recovers, enter 'mode COM3' in command line
 #   If not, go to fluke3000.py, in line 229 change range to (2,7), run main, and change back to (1,7) and run main again
 
 
-#   ToDo: Fix NotImplementedEra and module ID 64 bug
 #   Todo: double check any code from AI and for matplotlib that's redundant (ex. update_scroll func, is fig.canvas.draw_idle() needed?) useful for optimizing program's memory and speed
 #   Todo: Add error handling
 #   Todo: Don't hard code, use constants instead
-#   Todo: graph scrolling too laggy right now\
 #   Todo: when you use zoom in feature, after a few sec it should also go back to following scroll bar at regular size
-#   Todo: if timeout or serial connection, try have python script reset the port again automatically
 #   Todo: When mouse hovers above the plotted line should return a data point
 #   Moving average
 #   Remove redundant timecnt value
-#   Make timestamp and data of csv and chart be consistent
-import instruments as ik
-import re
-from itertools import count
+from fluke3000reader.readings import FlukeReader, open_fluke3000
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
-from matplotlib.ticker import MaxNLocator
+from matplotlib.ticker import FuncFormatter, MaxNLocator
 from matplotlib.widgets import Slider
 import threading
-import datetime
-import csv
+from fluke3000reader.csv_writer import BufferedCsvWriter
+from fluke3000reader.timestamps import format_time
+from fluke3000reader.ringbuffer import RingBuffer
+import numpy as np
 
 CsvWrite = False    # Csv file writing on/off
+SIMULATE = False    # Read a simulated meter (simulated.py) instead of the serial port
 
 INTERVAL = 30       # Amount of seconds you want in interval window (multiplied by 2)
 DELAY = 1000        # Number of milliseconds between measurements
 BAUD = 115200
 SCROLL_HOLD = 5
 PORT = "\\\\.\\COM3"
-
-FILENAME = "voltage_data-" + datetime.datetime.now().strftime('%Y-%m-%d') + "_" + datetime.datetime.now().strftime('%H_%M_%S') +".csv"
-xval = []
-yval = []
-timeval = []
-for i in range(INTERVAL):
-    timeval.append(" ")
-timesec = count()
+FLUKE_MODE = 'voltage_dc'   # Fluke3000.Mode name, readings are converted to SI (V, A, Hz, Ohm, K, F)
+HISTORY_LENGTH = 8 * 3600   # Samples kept for plotting and scrolling (8 h at 1 s), older ones are overwritten
+BLIT = True         # Redraw only the line each frame, axes and labels only when the view window changes
+YLIM_MARGIN = 0.1   # Headroom added when the y range has to grow, as a fraction of the data range
+
+FILENAME_PREFIX = "voltage_data"        # Files are named <prefix>-<start time>.csv
+CSV_FLUSH_ROWS = 1000                   # Rows buffered in memory before they are written
+CSV_FLUSH_INTERVAL = 5                  # Seconds, upper bound on how far the file lags behind
+CSV_ROTATE_BYTES = 100 * 1024 * 1024    # Start a new file past this size, None to disable
+CSV_ROTATE_DAILY = True                 # Start a new file every day
+CSV_COMPRESS = False                    # gzip files once they are closed
+
+live_data = RingBuffer(HISTORY_LENGTH)  # Timestamps and voltages, x axis is the running sample number
 timecnt = 0
 scroll_status = False
 
@@ -47,61 +50,93 @@ def pointFollow():
     global scroll_status
     scroll_status = False
 
-# Replace xaxis values with timestamps  
-def add_time_labels(ax, timeval):
-    xLabels = ax.get_xticks().tolist()
-    newLabels = []
-    for i in xLabels:
-        newLabels.append(timeval[int(i)])    
-    ax.set_xticklabels(newLabels,rotation=45,ha='right')
+# Replace xaxis values with timestamps, the locator keeps choosing the ticks as the view moves
+def time_label(x, pos=None):
+    times = live_data.latest()[0]
+    index = int(round(x)) - live_data.first_index
+    if 0 <= index < len(times):
+        return format_time(times[index], date=False)
+    return " "
 
 # Connect to the device's serial port, create plot and axes
-mult = ik.fluke.Fluke3000.open_serial(PORT, BAUD)
+mult = open_fluke3000(PORT, BAUD, simulate=SIMULATE)
+fluke = FlukeReader(mult, FLUKE_MODE)
 fig, ax = plt.subplots()
 plt.gca().xaxis.set_major_locator(MaxNLocator(integer=True))
-
-# Function to write data to csv file with timestamps
-def CsvWriteData(name, data, time):
-    with open(name, 'a', newline='') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        if csvfile.tell() == 0:
-            csvwriter.writerow(['Time', 'Voltage'])
-        now = datetime.datetime.now()
-        dateStamp = now.strftime('%Y-%m-%d') + " " + time
-        csvwriter.writerow([dateStamp, data])
+ax.xaxis.set_major_formatter(FuncFormatter(time_label))     # Sample index to time of that sample
+line, = ax.plot([], [], color = 'blue')      # Single line artist, updated in place every frame
+
+# One writer for the whole run, rows are batched and files rotated by BufferedCsvWriter
+csv_writer = BufferedCsvWriter(FILENAME_PREFIX, flush_rows=CSV_FLUSH_ROWS, flush_interval=CSV_FLUSH_INTERVAL,
+                               rotate_bytes=CSV_ROTATE_BYTES, rotate_daily=CSV_ROTATE_DAILY,
+                               compress=CSV_COMPRESS, epoch_times=True) if CsvWrite else None
+
+# Samples of the visible x range as copies, so a frame costs the same after hours of data
+def visible_series(xmin, xmax):
+    times, values = live_data.latest()
+    first = live_data.first_index
+    lo = min(max(int(xmin) - first, 0), len(times))
+    hi = min(max(int(xmax) + 2 - first, 0), len(times))
+    return np.arange(first + lo, first + hi), values[0, lo:hi].copy()
+
+# Full redraw of axes, ticks and labels, only when the view window has changed
+def redraw_view():
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')     # The formatter's time labels, slanted to fit
+    if BLIT:
+        fig.canvas.draw()           # Draws everything but the animated line, the animation then caches it
+    else:
+        fig.canvas.draw_idle()
+
+# Grow the y range when new data falls outside it, never shrink it every frame
+def fit_ylim(yval):
+    if len(yval) == 0:
+        return False
+    ymin, ymax = ax.get_ylim()
+    lo, hi = float(np.min(yval)), float(np.max(yval))
+    if lo >= ymin and hi <= ymax:
+        return False
+    margin = max((hi - lo) * YLIM_MARGIN, abs(hi) * YLIM_MARGIN, 1e-6)
+    ax.set_ylim(min(lo, ymin) - margin if lo < ymin else ymin, max(hi, ymax) + margin if hi > ymax else ymax)
+    return True
 
 # Animation function for graph. Updates graph and csv file with new voltage readings when called
 def animate(i):
     global timecnt
-    volt = ''
-    timecnt = next(timesec)
-    xval.append(timecnt)
-    time = datetime.datetime.now().time().strftime("%H:%M:%S.%f")[:-4]
-    timeval.insert(len(timeval)-INTERVAL,datetime.datetime.now().time().strftime("%H:%M:%S.%f")[:-4])
-    
-    data = mult.measure(mult.Mode.voltage_dc)   # Measures the DC voltage
+    timecnt = live_data.total
 
-    # Append voltage data into yval list
-    if str(data) != '0.0 V':
-        value = re.findall(r'-?\d+\.\d+', str(data))
-        volt = value[0]
-        yval.append(float(volt))
-    else:
-        volt = 0
-        yval.append(volt)
+    try:
+        sample = fluke.read_block()     # Measures in FLUKE_MODE, SI float stamped when the read completed
+    except Exception as e:
+        # The session reopens the port on the next frames, this one is skipped
+        print(f"Read failed: {e!r}")
+        return line,
+    # After a reconnect the block starts with a NaN at the start of the outage, which breaks the line
+    live_data.extend(sample.timestamps, sample.values)
 
     # Write to csv file if allowed
     if CsvWrite:
-        CsvWriteData(FILENAME, str(volt), time)
-
-    # Plot and update the new values onto the plot
-    plt.subplots_adjust(bottom=0.25)
-    plt.plot(xval,yval, color = 'blue')
-    if (scroll_status != True) and (len(yval) > INTERVAL):
-        ax.set_xlim(xval[len(xval)-1] - (INTERVAL*0.8), xval[len(xval)-1]+(INTERVAL*0.2))
-    add_time_labels(ax, timeval)
+        csv_writer.write_rows([t, str(value)] for t, value in zip(sample.timestamps.tolist(), sample.values[0].tolist()))
+
+    # Following the newest point, the window jumps ahead by a page instead of moving every frame
+    view_changed = False
+    xmin, xmax = ax.get_xlim()
+    if not scroll_status and timecnt >= xmax:
+        xmin = timecnt - INTERVAL * 0.2
+        xmax = xmin + INTERVAL
+        ax.set_xlim(xmin, xmax)
+        view_changed = True
+
+    # One persistent line, only the visible samples are handed to it
+    xval, yval = visible_series(xmin, xmax)
+    line.set_data(xval, yval)
+    view_changed = fit_ylim(yval) or view_changed
+    if view_changed:
+        redraw_view()
+    return line,
     
 # Create scroll bar
+plt.tight_layout()                                      # Formatting, done once instead of every frame
+plt.subplots_adjust(bottom=0.25)
 scrollax = plt.axes([0.1,0.02,0.8,0.06], facecolor = 'lightgoldenrodyellow')
 scrollbar = Slider(scrollax, 'scroll', 0, 100, valinit = 0, valstep=1)
 scrollTimer = threading.Timer(SCROLL_HOLD, pointFollow)
@@ -116,18 +151,29 @@ def update_scroll(val):
     scrollTimer = threading.Timer(SCROLL_HOLD, pointFollow)
     scrollTimer.start()
     pos = scrollbar.val
-    ax.set_xlim((pos/100)*timecnt, ((pos/100)*timecnt) + INTERVAL)
-    add_time_labels(ax, timeval)
-    fig.canvas.draw_idle()
+    start = live_data.first_index + (pos/100)*len(live_data)
+    ax.set_xlim(start, start + INTERVAL)
+    xval, yval = visible_series(start, start + INTERVAL)
+    line.set_data(xval, yval)
+    fit_ylim(yval)
+    redraw_view()
+    if BLIT:
+        # The animated line is left out of full draws, put it back until the next frame
+        ax.draw_artist(line)
+        fig.canvas.blit(ax.bbox)
 
 scrollbar.on_changed(update_scroll)                     # Scroll function
 ax.set_xlim(0,INTERVAL)                                 # Initial window view with starting x values
 plt.sca(ax)                                             # Set the main axes to animate line on
 plt.tick_params(labelsize = 9)
-ani = FuncAnimation(plt.gcf(), animate, interval=DELAY) # FuncAnimation object to update graph as time goes on
-plt.tight_layout()                                      # Formatting
+# FuncAnimation object to update graph as time goes on, with blitting only the line is redrawn each frame
+ani = FuncAnimation(plt.gcf(), animate, interval=DELAY, blit=BLIT, cache_frame_data=False)
 plt.show()
 
+# Write out buffered csv rows
+if csv_writer:
+    csv_writer.close()
+
 # Flush out the cache system
 mult.reset()
 mult.flush()
@@ -0,0 +1,294 @@
+# Pipeline benchmark
+#
+# Runs the config driven Logger (read, alarms, filter, pressure, buffers,
+# statistics, CSV, recording) against the simulated HAT, the same pipeline
+# `fluke3000reader run --simulate` starts, and times every stage separately
+# while Plotly figures are built from its live buffers the way Dash does.
+# Results are printed and can be written as JSON, and a previous JSON file can
+# be given to flag regressions.
+#
+#   python benchmark.py --rate 10000 --channels 4 --duration 60 --json run.json
+#   python benchmark.py --rate 10000 --channels 4 --compare run.json
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+from fluke3000reader.config import load_config, fluke_sections
+from fluke3000reader.instrumentation import PipelineMetrics
+from fluke3000reader.live_plot import buffer_series, live_figure, extend_since
+from fluke3000reader.logger import Logger
+
+
+# read and alarms run in the source thread, streams (filter, pressure, buffers,
+# statistics), csv and recording in the merge thread, figure in the main one
+STAGES = ('read', 'alarms', 'streams', 'csv', 'recording', 'figure')
+PERCENTILES = (50, 90, 99, 99.9)
+# Never reached by the simulated gauges, so the rule is evaluated on every block without firing
+ALARM_ABOVE = 1e3
+
+
+def rss_bytes():
+    # Resident set size, /proc on Linux, peak RSS elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class StageTimer:
+    """Collects per-call durations of each pipeline stage, in nanoseconds."""
+
+    def __init__(self, stages):
+        self.durations = {stage: [] for stage in stages}
+        self.lock = threading.Lock()     # Stages report from the source, merge and main threads
+
+    def add(self, stage, ns):
+        with self.lock:
+            self.durations[stage].append(ns)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter_ns() - start)
+
+    def summary(self):
+        result = {}
+        with self.lock:
+            durations = {stage: list(values) for stage, values in self.durations.items()}
+        for stage, values in durations.items():
+            if not values:
+                continue
+            us = np.array(values, dtype=np.float64) / 1e3
+            result[stage] = {'calls': len(us), 'mean_us': float(us.mean()), 'max_us': float(us.max()),
+                             'total_s': float(us.sum() / 1e6),
+                             **{f'p{p:g}_us': float(np.percentile(us, p)) for p in PERCENTILES}}
+        return result
+
+
+class ReadTimes:
+    """Stands in for the read_seconds histogram, every observation goes to the timer's read stage."""
+
+    def __init__(self, timer):
+        self.timer = timer
+
+    def labels(self, **labels):
+        return self
+
+    def observe(self, seconds):
+        self.timer.add('read', int(seconds * 1e9))
+
+
+class TimedMetrics(PipelineMetrics):
+    """PipelineMetrics that keep every read and stage duration, for percentiles instead of buckets."""
+
+    def __init__(self, timer):
+        super().__init__()
+        self.timer = timer
+        self.read_seconds = ReadTimes(timer)
+
+    def stage(self, name):
+        return self.timer.time(name)
+
+
+# =========================
+# Pipeline
+# =========================
+def bench_config(rate, channels, directory, config_path=None, csv=True, recording=True, alarm=True,
+                 filter_kind=None, despike=None, pushgateway=None):
+    # The logger config of the run: simulated MCC128 only, outputs in a scratch directory
+    config = load_config(config_path)
+    for section in fluke_sections(config):
+        config.remove_section(section)
+    config['acquisition']['simulate'] = 'true'
+    mcc128 = config['mcc128']
+    mcc128['enable'] = 'true'
+    mcc128['channels'] = ', '.join(str(channel) for channel in range(channels))
+    mcc128['scan_rate'] = str(rate)
+    if filter_kind is not None:
+        mcc128['filter'] = filter_kind
+    if despike is not None:
+        mcc128['despike'] = str(despike)
+    for section, enable in (('csv', csv), ('recording', recording)):
+        config[section]['enable'] = str(enable).lower()
+        config[section]['directory'] = directory
+        config[section]['prefix'] = 'bench'
+    if alarm and not any(section.startswith('alarm:') for section in config.sections()):
+        config['alarm:bench'] = {'type': 'threshold', 'quantity': 'pressure', 'above': str(ALARM_ABOVE)}
+    config['prometheus']['enable'] = 'true' if pushgateway else 'false'
+    if pushgateway:
+        config['prometheus']['pushgateway'] = pushgateway
+    config['instrumentation']['profiler'] = ''
+    return config
+
+
+def counter_value(metrics, name, source):
+    return metrics.registry.get_sample_value(f'{name}_total', {'source': source}) or 0.0
+
+
+def run(rate, channels, duration, config_path=None, csv=True, recording=True, alarm=True, filter_kind=None,
+        despike=None, pushgateway=None, figure_period=1.0, memory_interval=5.0):
+    workdir = tempfile.TemporaryDirectory(prefix='fluke-bench-')
+    config = bench_config(rate, channels, workdir.name, config_path, csv=csv, recording=recording, alarm=alarm,
+                          filter_kind=filter_kind, despike=despike, pushgateway=pushgateway)
+    timer = StageTimer(STAGES)
+    metrics = TimedMetrics(timer)
+    logger = Logger(config, metrics=metrics)
+
+    memory = [(0.0, rss_bytes())]
+    start = time.monotonic()
+    logger.start()
+    stream = next(iter(logger.streams.values()))
+    last_sent = 0
+    next_figure = start + figure_period
+    next_memory = start + memory_interval
+    try:
+        while time.monotonic() - start < duration and logger.is_alive():
+            time.sleep(max(min(next_figure, next_memory, start + duration) - time.monotonic(), 0))
+            if figure_period and time.monotonic() >= next_figure:
+                # What the live graph callbacks do for the first channel, serialized the way Dash sends it
+                with timer.time('figure'):
+                    with logger.lock:
+                        payload, last_sent = extend_since(stream.live_data, last_sent)
+                        x, y = buffer_series(stream.live_data, n=logger.settings['plot_window'])
+                    json.dumps([payload, live_figure(x, y, 'Benchmark', 'Time', 'Voltage (V)')],
+                               cls=PlotlyJSONEncoder)
+                next_figure += figure_period
+            if time.monotonic() >= next_memory:
+                memory.append((time.monotonic() - start, rss_bytes()))
+                next_memory += memory_interval
+    finally:
+        elapsed = time.monotonic() - start
+        logger.stop()
+        workdir.cleanup()
+
+    memory.append((elapsed, rss_bytes()))
+    busy = sum(sum(values) for values in timer.durations.values()) / 1e9
+    samples = stream.live_data.total
+    overruns = counter_value(metrics, 'scan_overruns', 'mcc128')
+    growth = memory[-1][1] - memory[0][1]
+    # Buffers fill their preallocated pages during the first minute, the second half of a long run shows real leaks
+    half = [(t, rss) for t, rss in memory if t >= elapsed / 2] or memory[-1:]
+    late_growth = (memory[-1][1] - half[0][1]) / (elapsed - half[0][0]) * 3600 if elapsed > half[0][0] else 0.0
+    mcc128 = config['mcc128']
+    return {
+        'config': {'rate': rate, 'channels': channels, 'duration': duration, 'config': config_path,
+                   'csv': csv, 'recording': recording, 'alarm': alarm, 'filter': mcc128.get('filter'),
+                   'despike': mcc128.getint('despike'), 'pushgateway': pushgateway, 'figure_period': figure_period},
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'platform': platform.platform(), 'revision': git_revision()},
+        'elapsed_s': elapsed,
+        'blocks': logger.stats().get('mcc128', {}).get('samples', 0),
+        'samples_per_channel': samples,
+        'samples_per_second': samples * channels / elapsed if elapsed else 0.0,
+        'target_samples_per_second': rate * channels,
+        'overrun': overruns > 0,
+        'overruns': int(overruns),
+        'dropped_samples': int(counter_value(metrics, 'dropped_samples', 'mcc128')),
+        'utilization': busy / elapsed if elapsed else 0.0,     # Stage time over wall time, summed over threads
+        'stages': timer.summary(),
+        'memory': {'start_bytes': memory[0][1], 'end_bytes': memory[-1][1], 'growth_bytes': growth,
+                   'growth_bytes_per_hour': growth / elapsed * 3600 if elapsed else 0.0,
+                   'second_half_growth_bytes_per_hour': late_growth,
+                   'samples': [[round(t, 3), rss] for t, rss in memory]},
+    }
+
+
+# =========================
+# Reporting
+# =========================
+def print_report(result):
+    config = result['config']
+    print(f"{config['channels']} channels x {config['rate']:g} Hz, {result['elapsed_s']:.1f} s, "
+          f"{result['blocks']} blocks"
+          + (f" ({result['overruns']} scan overruns, {result['dropped_samples']} samples dropped)"
+             if result['overrun'] else ''))
+    print(f"Sustained {result['samples_per_second']:,.0f} samples/s of {result['target_samples_per_second']:,.0f}, "
+          f"pipeline busy {100 * result['utilization']:.1f}% of the time")
+    print(f"{'stage':<10} {'calls':>7} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'p99.9':>9} {'max':>9}  (us)")
+    for stage, s in result['stages'].items():
+        print(f"{stage:<10} {s['calls']:>7} {s['mean_us']:>9.1f} {s['p50_us']:>9.1f} {s['p90_us']:>9.1f} "
+              f"{s['p99_us']:>9.1f} {s['p99.9_us']:>9.1f} {s['max_us']:>9.1f}")
+    memory = result['memory']
+    print(f"RSS {memory['start_bytes'] / 2**20:.1f} -> {memory['end_bytes'] / 2**20:.1f} MiB "
+          f"({memory['growth_bytes_per_hour'] / 2**20:+.1f} MiB/h overall, "
+          f"{memory['second_half_growth_bytes_per_hour'] / 2**20:+.1f} MiB/h over the second half)")
+
+
+def compare(result, baseline, threshold):
+    # Stages whose p50 or p90 got slower than threshold (a fraction) against the baseline run
+    regressions = []
+    for stage, s in result['stages'].items():
+        old = baseline.get('stages', {}).get(stage)
+        if not old:
+            continue
+        for key in ('p50_us', 'p90_us'):
+            if old[key] > 0 and s[key] > old[key] * (1 + threshold):
+                regressions.append(f"{stage} {key[:-3]}: {old[key]:.1f} -> {s[key]:.1f} us "
+                                   f"({100 * (s[key] / old[key] - 1):+.0f}%)")
+    old_rate = baseline.get('samples_per_second', 0)
+    if old_rate and result['samples_per_second'] < old_rate * (1 - threshold):
+        regressions.append(f"throughput: {old_rate:,.0f} -> {result['samples_per_second']:,.0f} samples/s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition pipeline against a simulated MCC128.")
+    parser.add_argument('--rate', type=float, default=1000.0, help="scan rate per channel in Hz")
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to run")
+    parser.add_argument('-c', '--config', help="logger config to start from, its Fluke3000 sections are dropped")
+    parser.add_argument('--filter', help="filter kind of the MCC128 channels, overrides the config")
+    parser.add_argument('--despike', type=int, help="despike window of the MCC128 channels, overrides the config")
+    parser.add_argument('--no-csv', action='store_true')
+    parser.add_argument('--no-recording', action='store_true')
+    parser.add_argument('--no-alarm', action='store_true', help="leave out the threshold rule added when the config has none")
+    parser.add_argument('--pushgateway', help="publish to this Pushgateway, Prometheus stays off without it")
+    parser.add_argument('--figure-period', type=float, default=1.0, help="seconds between figures, 0 for never")
+    parser.add_argument('--memory-interval', type=float, default=5.0, help="seconds between RSS samples")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="baseline JSON file from an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    result = run(args.rate, args.channels, args.duration, args.config, csv=not args.no_csv,
+                 recording=not args.no_recording, alarm=not args.no_alarm, filter_kind=args.filter,
+                 despike=args.despike, pushgateway=args.pushgateway, figure_period=args.figure_period,
+                 memory_interval=args.memory_interval)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+# Fluke3000 and MCC128 ion pump logger
+#
+# Submodules are not imported here: a headless logger only loads what its
+# config enables, Dash, Plotly, SciPy and prometheus_client stay unloaded
+# until a feature needs them.
+
+__version__ = '1.0.0'
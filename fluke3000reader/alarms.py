@@ -0,0 +1,213 @@
+# Alarms
+#
+# Rules are checked in the acquisition thread on every SampleBlock, before the
+# block is buffered, written or published, so an excursion is acted on within
+# milliseconds of the sample that caused it rather than after the next
+# Prometheus push and scrape. Each rule is evaluated on a whole block at once:
+# the raise and clear conditions are computed as arrays and the alarm state of
+# every sample follows from the last condition met before it (hysteresis).
+#
+#   alarms = AlarmEngine([ThresholdRule('pressure_high', above=1e-6, clear=5e-7),
+#                         RateRule('pressure_burst', above=0.5, window=1.0, log=True)])
+#   alarms.check(sample_block, pressures)
+
+from collections import namedtuple
+import json
+import queue
+import threading
+import urllib.request
+import numpy as np
+from .timestamps import now, format_time
+
+
+# One state change of one rule on one channel. time is the stamp of the sample
+# that caused it, value what the rule compared, detected when the engine saw it.
+AlarmEvent = namedtuple('AlarmEvent', ['rule', 'source', 'channel', 'state', 'time', 'value', 'unit', 'detected'])
+
+RAISED = 'raised'
+CLEARED = 'cleared'
+
+
+# =========================
+# Rules
+# =========================
+class ThresholdRule:
+    """Raised while the value is above `above` (or below `below`), cleared once it is back past `clear`."""
+
+    def __init__(self, name, quantity='pressure', above=None, below=None, clear=None, source=None, channels=None,
+                 actions=None):
+        if (above is None) == (below is None):
+            raise ValueError(f"Rule {name} needs exactly one of above or below")
+        if quantity not in ('pressure', 'voltage'):
+            raise ValueError(f"Rule {name}: quantity is 'pressure' (Torr) or 'voltage' (V), not {quantity}")
+        self.name = name
+        self.quantity = quantity
+        self.above = above
+        self.below = below
+        self.clear = clear if clear is not None else (above if above is not None else below)
+        if above is not None and self.clear > above or below is not None and self.clear < below:
+            raise ValueError(f"Rule {name}: the clear level has to be on the safe side of the threshold")
+        self.source = source        # Only blocks from this source, None for all
+        self.channels = channels    # Only these channel names ('CH0', 'voltage_dc', ...), None for all
+        self.actions = actions      # None for the engine's actions
+
+    @property
+    def unit(self):
+        return 'Torr' if self.quantity == 'pressure' else 'V'
+
+    def applies_to(self, source, channel):
+        return ((self.source is None or self.source == source)
+                and (self.channels is None or channel in self.channels))
+
+    def signal(self, memory, timestamps, values):
+        # The series the thresholds are compared with, the values themselves here
+        return values
+
+    def states(self, active, signal):
+        # Alarm state after every sample, given the state before the block
+        if self.above is not None:
+            events = (signal > self.above).astype(np.int8) - (signal < self.clear)
+        else:
+            events = (signal < self.below).astype(np.int8) - (signal > self.clear)
+        # Between the raise and clear levels (or on NaN) the last state holds
+        last = np.maximum.accumulate(np.where(events != 0, np.arange(len(events)), -1))
+        return np.where(last >= 0, events[np.maximum(last, 0)] > 0, active)
+
+
+class RateRule(ThresholdRule):
+    """Threshold on the rate of change over the last `window` seconds, per second (decades per second with log)."""
+
+    def __init__(self, name, quantity='pressure', above=None, below=None, clear=None, window=1.0, log=False,
+                 source=None, channels=None, actions=None):
+        super().__init__(name, quantity, above, below, clear, source, channels, actions)
+        self.window = window
+        self.log = log      # Rate of log10(value), pressure bursts span decades
+
+    @property
+    def unit(self):
+        return 'decades/s' if self.log else super().unit + '/s'
+
+    def signal(self, memory, timestamps, values):
+        values = np.log10(np.maximum(values, 1e-300)) if self.log else np.asarray(values, dtype=np.float64)
+        # Samples of the previous blocks still within the window are the reference for the first ones
+        past_times, past_values = memory.get('tail', (np.empty(0), np.empty(0)))
+        times = np.concatenate((past_times, timestamps))
+        series = np.concatenate((past_values, values))
+        reference = np.maximum(np.searchsorted(times, timestamps - self.window, 'right') - 1, 0)
+        elapsed = timestamps - times[reference]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(elapsed > 0, (values - series[reference]) / elapsed, np.nan)
+        keep = max(int(np.searchsorted(times, timestamps[-1] - self.window, 'right')) - 1, 0)
+        memory['tail'] = (times[keep:], series[keep:])
+        return rate
+
+
+# =========================
+# Actions
+# =========================
+def log_action(event):
+    print(f"[alarm] {format_time(event.time)} {event.rule} {event.state} on {event.source}/{event.channel}: "
+          f"{event.value:.3g} {event.unit} ({(event.detected - event.time) * 1000:.1f} ms after the sample)")
+
+
+class WebhookAction:
+    """POSTs every event as JSON from its own thread, so a slow endpoint never holds up acquisition."""
+
+    def __init__(self, url, timeout=2.0, max_queue=100):
+        self.url = url
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name='alarm-webhook', daemon=True)
+        self._thread.start()
+
+    def __call__(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            body = json.dumps(event._asdict(), default=float).encode('utf-8')
+            request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+                self.sent += 1
+            except OSError as e:
+                self.failed += 1
+                print(f"[alarm] Webhook {self.url} failed: {e!r}")
+
+
+# =========================
+# Engine
+# =========================
+class AlarmEngine:
+    """Checks SampleBlocks against the rules and calls the actions on every raise and clear."""
+
+    def __init__(self, rules, actions=(log_action,)):
+        names = [rule.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Alarm rule names have to be unique")
+        self.rules = list(rules)
+        self.actions = list(actions)    # For rules without actions of their own
+        self.active = {}                # (rule, source, channel) -> AlarmEvent that raised it
+        self.events = 0
+        self.action_errors = 0
+        self.max_latency = 0.0          # Seconds from an offending sample to its actions being called
+        self._memory = {}               # (rule, source, channel) -> state carried from block to block
+        self._lock = threading.Lock()
+
+    @property
+    def needs_pressure(self):
+        return any(rule.quantity == 'pressure' for rule in self.rules)
+
+    def check(self, sample_block, pressures=None):
+        # pressures (channels, samples) in Torr, in the block's channel order, needed for pressure rules
+        if not len(sample_block.timestamps):
+            return []
+        fired = []
+        with self._lock:
+            for rule in self.rules:
+                values = pressures if rule.quantity == 'pressure' else sample_block.values
+                if values is None:
+                    continue
+                for row, channel in enumerate(sample_block.channels):
+                    if rule.applies_to(sample_block.source, channel):
+                        fired.extend(self._evaluate(rule, sample_block.source, channel, sample_block.timestamps,
+                                                    np.asarray(values[row], dtype=np.float64)))
+        detected = now()
+        events = []
+        for rule, event in fired:
+            event = event._replace(detected=detected)
+            events.append(event)
+            self.max_latency = max(self.max_latency, detected - event.time)
+            for action in rule.actions if rule.actions is not None else self.actions:
+                try:
+                    action(event)
+                except Exception as e:
+                    self.action_errors += 1
+                    print(f"[alarm] Action for {rule.name} failed: {e!r}")
+        return events
+
+    def _evaluate(self, rule, source, channel, timestamps, values):
+        key = (rule.name, source, channel)
+        memory = self._memory.setdefault(key, {})
+        was_active = key in self.active
+        signal = rule.signal(memory, timestamps, values)
+        states = rule.states(was_active, signal)
+        changes = np.flatnonzero(states != np.concatenate(([was_active], states[:-1])))
+        fired = []
+        for index in changes:
+            event = AlarmEvent(rule.name, source, channel, RAISED if states[index] else CLEARED,
+                               float(timestamps[index]), float(signal[index]), rule.unit, None)
+            if states[index]:
+                self.active[key] = event
+            else:
+                self.active.pop(key, None)
+            self.events += 1
+            fired.append((rule, event))
+        return fired
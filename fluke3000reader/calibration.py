@@ -0,0 +1,133 @@
+# Ion pump calibration curves (controller output voltage -> pressure)
+#
+# Each curve is fitted once, on first use, and cached by name, so converting a
+# reading (or a whole NumPy block of readings) is a single spline evaluation.
+# Extra gauges can be registered from CSV files with a voltage_mV,pressure_Torr
+# column layout.
+
+import csv
+import os
+import numpy as np
+
+
+TORR_TO_MBAR = 1.33322  # Conversion factor from Torr to mbar
+PRESSURE_UNITS = ('Torr', 'mbar')
+DEFAULT_CALIBRATION = 'varian_921_0062'
+
+# Provided by VARIAN Ion Pump controller 921-0062
+VARIAN_921_0062_MV = np.array([5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0, 50.0,
+                               55.0, 60.0, 65.0, 70.0, 75.0, 80.0, 85.0, 90.0, 95.0])
+VARIAN_921_0062_TORR = np.array([1e-8, 1.5e-8, 2.4e-8,
+                                 3.7e-8, 6.0e-8, 1.0e-7,
+                                 1.7e-7, 3.0e-7, 5.5e-7,
+                                 1.0e-6, 1.6e-6, 2.8e-6,
+                                 5.0e-6, 8.0e-6, 1.5e-5,
+                                 2.6e-5, 4.0e-5, 6.0e-5,
+                                 1.0e-4])
+
+
+# =========================
+# Calibration Curve
+# =========================
+class CalibrationCurve:
+    """Voltage (mV) to pressure conversion built once from a calibration table."""
+
+    def __init__(self, name, voltage_mV, pressure_Torr, kind='cubic'):
+        voltage_mV = np.asarray(voltage_mV, dtype=float)
+        pressure_Torr = np.asarray(pressure_Torr, dtype=float)
+        if voltage_mV.ndim != 1 or voltage_mV.shape != pressure_Torr.shape:
+            raise ValueError(f"Calibration '{name}' needs two columns of equal length")
+
+        order = np.argsort(voltage_mV)
+        self.name = name
+        self.kind = kind
+        self.voltage_mV = voltage_mV[order]
+        self.pressure_Torr = pressure_Torr[order]
+
+        self._interpolator = None
+
+    def _fit(self):
+        # Interpolation with extrapolation for values outside of the table. Fitted on
+        # first use, so SciPy is only imported once a pressure is actually needed.
+        from scipy.interpolate import interp1d
+        return interp1d(self.voltage_mV, self.pressure_Torr, kind=self.kind,
+                        fill_value='extrapolate', assume_sorted=True)
+
+    def pressure(self, voltage_mV, unit='Torr'):
+        # Accepts a scalar or any array shape, returns the same shape
+        if self._interpolator is None:
+            self._interpolator = self._fit()
+        pressure_Torr = self._interpolator(np.asarray(voltage_mV, dtype=float))
+        return convert_pressure(pressure_Torr, unit)
+
+    def pressure_from_volts(self, voltage_V, unit='Torr'):
+        return self.pressure(np.asarray(voltage_V, dtype=float) * 1000.0, unit)
+
+    def __repr__(self):
+        return f"CalibrationCurve({self.name!r}, points={len(self.voltage_mV)}, kind={self.kind!r})"
+
+
+def convert_pressure(pressure_Torr, unit='Torr'):
+    if unit == 'Torr':
+        return pressure_Torr
+    if unit == 'mbar':
+        return pressure_Torr * TORR_TO_MBAR
+    raise ValueError(f"Unknown pressure unit '{unit}', expected one of {PRESSURE_UNITS}")
+
+
+# =========================
+# Calibration Registry
+# =========================
+_calibrations = {}
+
+def register_calibration(name, voltage_mV, pressure_Torr, kind='cubic'):
+    curve = CalibrationCurve(name, voltage_mV, pressure_Torr, kind=kind)
+    _calibrations[name] = curve
+    return curve
+
+def load_calibration(path, name=None, kind='cubic'):
+    # CSV file with voltage_mV,pressure_Torr rows, an optional header line is skipped
+    voltage_mV = []
+    pressure_Torr = []
+    with open(path, newline='') as csvfile:
+        for row_number, row in enumerate(csv.reader(csvfile)):
+            if not row or row[0].lstrip().startswith('#'):
+                continue
+            try:
+                voltage, pressure = float(row[0]), float(row[1])
+            except (ValueError, IndexError):
+                if row_number == 0:
+                    continue
+                raise ValueError(f"{path}: malformed calibration row {row_number + 1}: {row}")
+            voltage_mV.append(voltage)
+            pressure_Torr.append(pressure)
+
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+    return register_calibration(name, voltage_mV, pressure_Torr, kind=kind)
+
+def load_calibration_dir(directory, kind='cubic'):
+    # Registers every *.csv table in a directory under its file name, nothing for an empty setting.
+    # Called once at startup, the fitted tables are reused for every sample
+    curves = []
+    if not directory:
+        return curves
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith('.csv'):
+            curves.append(load_calibration(os.path.join(directory, filename), kind=kind))
+    return curves
+
+def get_calibration(name=DEFAULT_CALIBRATION):
+    try:
+        return _calibrations[name]
+    except KeyError:
+        raise KeyError(f"Calibration '{name}' is not loaded, available: {sorted(_calibrations)}") from None
+
+def available_calibrations():
+    return sorted(_calibrations)
+
+def get_pressure(voltage_mV, unit='Torr', calibration=DEFAULT_CALIBRATION):
+    return get_calibration(calibration).pressure(voltage_mV, unit)
+
+
+register_calibration(DEFAULT_CALIBRATION, VARIAN_921_0062_MV, VARIAN_921_0062_TORR)
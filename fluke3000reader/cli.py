@@ -0,0 +1,84 @@
+# Command line
+#
+#   fluke3000reader run -c logger.ini          log, publish and serve as configured
+#   fluke3000reader run --simulate --dash      try it without hardware
+#   fluke3000reader run -c logger.ini --processes   one process per part, sharing memory
+#   fluke3000reader config > logger.ini        the default config, to edit
+#   fluke3000reader history /data/ionpump      browse earlier CSV files
+
+import argparse
+import sys
+from .config import DEFAULT_CONFIG, load_config
+
+
+def run(args):
+    config = load_config(args.config)
+    if args.simulate:
+        config['acquisition']['simulate'] = 'true'
+    if args.dash:
+        config['dash']['enable'] = 'true'
+    if args.processes:
+        config['acquisition']['processes'] = 'true'
+    run_config(config)
+
+def run_config(config):
+    # Logs, publishes and serves as configured until the sources finish or Ctrl+C
+    from .logger import Logger
+    if config['acquisition'].getboolean('processes'):
+        from .processes import run_processes
+        run_processes(config)
+        return
+    logger = Logger(config)
+    logger.start()
+    try:
+        settings = config['dash']
+        if settings.getboolean('enable'):
+            from .dashboard import create_app
+            app = create_app(logger, refresh=settings.getfloat('refresh'), plot_window=settings.getint('plot_window'),
+                             archive_directory=settings.get('archive').strip() or None, metrics=logger.metrics,
+                             stream=settings.getboolean('stream'))
+            app.run(host=settings.get('host'), port=settings.getint('port'), debug=False)
+        else:
+            while logger.is_alive():
+                logger.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    logger.stop()
+    print(f"Data acquisition stopped. {logger.stats()}")
+
+def print_config(args):
+    sys.stdout.write(DEFAULT_CONFIG.lstrip())
+
+def history(args):
+    from .dashboard import create_history_app
+    app = create_history_app(args.directory, args.pattern, args.channel, args.cache)
+    app.run(host=args.host, port=args.port, debug=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='fluke3000reader', description="Ion pump voltage and pressure logger")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('run', help="Acquire from the configured sources")
+    command.add_argument('-c', '--config', help="INI file, see `fluke3000reader config` for the keys")
+    command.add_argument('--simulate', action='store_true', help="Simulated meters and HAT instead of the hardware")
+    command.add_argument('--dash', action='store_true', help="Serve the live graphs whatever the config says")
+    command.add_argument('--processes', action='store_true',
+                         help="Acquisition, recorder, metrics and Dash in separate processes")
+    command.set_defaults(handler=run)
+
+    command = commands.add_parser('config', help="Print the default config")
+    command.set_defaults(handler=print_config)
+
+    command = commands.add_parser('history', help="Browse a directory of voltage CSV files")
+    command.add_argument('directory', help="Directory holding the CSV files")
+    command.add_argument('--pattern', default=None, help="File name pattern within the directory")
+    command.add_argument('--channel', type=lambda text: int(text) if text.isdigit() else text, default=0,
+                         help="Series to plot: its name (Voltage, mcc128/CH0) or its number, 0 is the first")
+    command.add_argument('--cache', default=None, help="Cache directory (default <directory>/.history)")
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=8050)
+    command.set_defaults(handler=history)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
@@ -0,0 +1,182 @@
+# Configuration
+#
+# Everything the scripts set through module constants, read from an INI file
+# instead. Missing keys fall back to DEFAULT_CONFIG, so a config only has to
+# list what differs. Each Fluke3000 is a [fluke:<name>] section and each alarm
+# rule an [alarm:<name>] section.
+#
+#   fluke3000reader config > logger.ini
+#   fluke3000reader run -c logger.ini
+
+import configparser
+
+
+DEFAULT_CONFIG = r"""
+[acquisition]
+# Simulated meters and HAT (simulated.py) instead of the hardware
+simulate = false
+# Acquisition, recorder, metrics and Dash in separate processes sharing the samples through shared memory
+processes = false
+# Seconds a block may wait for slower sources before it is passed on
+max_lateness = 2.0
+# Seconds of every stream kept in memory
+history_seconds = 600
+rolling_average = 10
+# Extra rolling and exponential pressure averages, name:seconds
+pressure_windows = 1min:60, 1h:3600
+pressure_emas = ema_1min:60
+
+[calibration]
+# Optional directory of voltage_mV,pressure_Torr CSV tables, one per gauge
+directory =
+
+[fluke:ion_pump_1]
+enable = true
+port = \\.\COM6
+baud = 115200
+mode = voltage_dc
+period = 1
+calibration = varian_921_0062
+
+[mcc128]
+enable = false
+channels = 0, 1, 2, 3
+scan_rate = 1000
+# Initial scan buffer, the read period adapts to it and it doubles after an overrun
+buffer_seconds = 2.0
+# Overruns survived by restarting the scan, empty for no limit
+max_restarts =
+# channel:calibration pairs, the others use varian_921_0062
+calibrations =
+# Filter ahead of the pressure, rolling averages and Prometheus: boxcar, cic or fir, empty for every
+# raw sample. Live graphs, CSV, recordings and alarms still get the raw samples
+filter =
+# Rate of the filtered series in Hz, independent of scan_rate
+output_rate = 10
+# Running median window in samples that replaces single-sample glitches, 0 to disable
+despike = 0
+
+[csv]
+enable = false
+directory = .
+prefix = multi_voltage_data
+flush_rows = 1000
+flush_interval = 5
+rotate_bytes = 104857600
+rotate_daily = true
+compress = false
+time_decimals = 4
+
+[recording]
+enable = false
+directory = .
+prefix = voltage_data
+
+[prometheus]
+enable = false
+# Every stream is pushed as its own group, gauge=<source>/<channel>
+pushgateway = localhost:9091
+interval = 15
+queue_size = 1000
+
+[dash]
+enable = false
+host = 127.0.0.1
+port = 8050
+refresh = 1
+plot_window = 5000
+# Push new samples to every page over one Server-Sent Events stream, false to
+# have each page poll every `refresh` seconds instead
+stream = true
+# Directory of earlier CSV files browsed below the live graphs, empty to disable
+archive =
+
+[instrumentation]
+# Read latency, loop jitter, stage and callback times and drop counters, pushed
+# with the first stream's metrics when Prometheus is enabled
+pipeline_metrics = true
+# sampling (every thread, collapsed stacks) or cprofile (every merged block), empty to disable
+profiler =
+# Written on exit, and on SIGUSR1 while running
+profile_file = profile.txt
+
+[alarms]
+# URL every raise and clear is POSTed to as JSON, empty to disable
+webhook =
+
+# [alarm:pressure_high]
+# type = threshold
+# quantity = pressure
+# above = 1e-6
+# clear = 5e-7
+# channels = CH0, voltage_dc
+"""
+
+
+def load_config(path=None):
+    # Defaults, overridden by the file when one is given
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_string(DEFAULT_CONFIG)
+    if path is not None:
+        with open(path) as f:
+            text = f.read()
+        if any(line.strip().startswith('[fluke:') for line in text.splitlines()):
+            # A config that lists its own meters replaces the example one
+            for section in fluke_sections(config):
+                config.remove_section(section)
+        config.read_string(text, source=path)
+    return config
+
+def fluke_sections(config):
+    return [section for section in config.sections() if section.startswith('fluke:')]
+
+def optional(value, convert=str):
+    # Empty settings mean "off"
+    return convert(value) if value.strip() else None
+
+def name_values(value, convert=float):
+    # 'a:1, b:2' -> {'a': 1.0, 'b': 2.0}
+    pairs = {}
+    for item in value.split(','):
+        if item.strip():
+            name, _, number = item.partition(':')
+            pairs[name.strip()] = convert(number.strip())
+    return pairs
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def fluke_sources(config):
+    # [fluke:<name>] sections -> source dicts, the multiReader FLUKE_SOURCES layout
+    sources = []
+    for section in fluke_sections(config):
+        s = config[section]
+        if not s.getboolean('enable', True):
+            continue
+        sources.append({'name': section.split(':', 1)[1], 'port': s.get('port'), 'baud': s.getint('baud', 115200),
+                        'mode': s.get('mode', 'voltage_dc'), 'period': s.getfloat('period', 1.0),
+                        'calibration': s.get('calibration', 'varian_921_0062')})
+    return sources
+
+def alarm_rules(config):
+    # [alarm:<name>] sections -> ThresholdRule / RateRule
+    from .alarms import ThresholdRule, RateRule
+    rules = []
+    for section in config.sections():
+        if not section.startswith('alarm:'):
+            continue
+        s = config[section]
+        kwargs = dict(quantity=s.get('quantity', 'pressure'),
+                      above=optional(s.get('above', ''), float), below=optional(s.get('below', ''), float),
+                      clear=optional(s.get('clear', ''), float), source=optional(s.get('source', '')),
+                      channels=[c.strip() for c in s['channels'].split(',')] if s.get('channels', '').strip() else None)
+        kind = s.get('type', 'threshold')
+        if kind == 'threshold':
+            rules.append(ThresholdRule(section.split(':', 1)[1], **kwargs))
+        elif kind == 'rate':
+            rules.append(RateRule(section.split(':', 1)[1], window=s.getfloat('window', 1.0),
+                                  log=s.getboolean('log', False), **kwargs))
+        else:
+            raise ValueError(f"[{section}] type is 'threshold' or 'rate', not {kind}")
+    return rules
@@ -0,0 +1,165 @@
+# Buffered CSV logging
+#
+# One writer lives for the whole run. Rows are collected in memory and written
+# in batches, files are rotated by size or date and closed segments can be
+# gzipped in the background. A timer thread writes rows older than
+# flush_interval when no new row comes to trigger it. close() (also run at
+# exit) flushes what is left.
+# With epoch_times the first column is given as epoch seconds and only turned
+# into a local time string when the batch is written.
+
+import atexit
+import csv
+import datetime
+import gzip
+import os
+import shutil
+import threading
+import time
+from .timestamps import format_local_times
+
+
+def _gzip_file(path):
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+
+
+class BufferedCsvWriter:
+    """Appends rows to <prefix>-<start time>.csv files, flushing on a row count or time threshold."""
+
+    def __init__(self, prefix='voltage_data', directory='.', header=('Time', 'Voltage'),
+                 flush_rows=1000, flush_interval=5.0, rotate_bytes=None, rotate_daily=False,
+                 compress=False, epoch_times=False, time_decimals=2):
+        self.prefix = prefix
+        self.directory = directory
+        self.header = list(header)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self.epoch_times = epoch_times
+        self.time_decimals = time_decimals
+
+        self.path = None
+        self.rows_written = 0
+        self._rows = []
+        self._file = None
+        self._writer = None
+        self._opened_on = None
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._compressors = []
+        self._closed = False
+        self._stop_event = threading.Event()
+        self._timer = None
+        if flush_interval:
+            self._timer = threading.Thread(target=self._flush_loop, name='csv-flush', daemon=True)
+            self._timer.start()
+        atexit.register(self.close)
+
+    # =========================
+    # Writing
+    # =========================
+    def write_row(self, row):
+        with self._lock:
+            self._rows.append(row)
+            if self._flush_due():
+                self._flush()
+
+    def write_rows(self, rows):
+        with self._lock:
+            self._rows.extend(rows)
+            if self._flush_due():
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self._stop_event.set()
+        with self._lock:
+            if self._closed:
+                return
+            self._flush()
+            self._close_segment()
+            self._closed = True
+        if self._timer is not None and self._timer is not threading.current_thread():
+            self._timer.join()
+        for compressor in self._compressors:
+            compressor.join()
+        atexit.unregister(self.close)
+
+    def _flush_loop(self):
+        # Rows left in the buffer when the source goes quiet still reach the file within flush_interval
+        while not self._stop_event.wait(self.flush_interval / 2):
+            with self._lock:
+                if self._closed:
+                    return
+                if not self._rows or time.monotonic() - self._last_flush < self.flush_interval:
+                    continue
+                try:
+                    self._flush()
+                except OSError as e:
+                    print(f"[csv] Flush failed: {e!r}")
+
+    def _flush_due(self):
+        return (len(self._rows) >= self.flush_rows
+                or time.monotonic() - self._last_flush >= self.flush_interval)
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._rows:
+            return
+        if self._closed:
+            raise ValueError("BufferedCsvWriter is closed")
+        if self._file is None or self._rotation_due():
+            self._open_segment()
+        if self.epoch_times:
+            # One vectorized conversion for the whole batch
+            times = format_local_times([row[0] for row in self._rows], self.time_decimals)
+            self._writer.writerows([time_text, *row[1:]] for time_text, row in zip(times.tolist(), self._rows))
+        else:
+            self._writer.writerows(self._rows)
+        self._file.flush()
+        self.rows_written += len(self._rows)
+        self._rows = []
+
+    # =========================
+    # Rotation
+    # =========================
+    def _rotation_due(self):
+        if self.rotate_bytes and self._file.tell() >= self.rotate_bytes:
+            return True
+        return self.rotate_daily and datetime.date.today() != self._opened_on
+
+    def _open_segment(self):
+        self._close_segment()
+        os.makedirs(self.directory, exist_ok=True)
+        now = datetime.datetime.now()
+        name = f"{self.prefix}-{now.strftime('%Y-%m-%d_%H_%M_%S')}"
+        path = os.path.join(self.directory, name + '.csv')
+        suffix = 1
+        while os.path.exists(path) or os.path.exists(path + '.gz'):
+            path = os.path.join(self.directory, f"{name}_{suffix}.csv")
+            suffix += 1
+
+        self.path = path
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        self._opened_on = now.date()
+        if self._file.tell() == 0:
+            self._writer.writerow(self.header)
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._writer = None
+        if self.compress:
+            compressor = threading.Thread(target=_gzip_file, args=(self.path,), name='csv-gzip')
+            compressor.start()
+            self._compressors = [c for c in self._compressors if c.is_alive()] + [compressor]
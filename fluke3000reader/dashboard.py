@@ -0,0 +1,94 @@
+# Dash app for a running Logger
+#
+# One graph per stream, drawn once from a downsampled snapshot and then only
+# extended with the samples each browser has not seen yet, pushed over one
+# shared LiveStream or, with stream=False, polled every `refresh` seconds.
+# Imported only when the dashboard is enabled, so headless loggers never load
+# Dash or Plotly.
+
+import dash
+from dash import dcc, html
+from dash.dependencies import Input, Output, State, ALL, MATCH
+from .history import HistoryArchive, history_layout, register_history_callbacks
+from .instrumentation import render_timer
+from .live_plot import buffer_series, range_series, live_figure, extend_all, is_xaxis_change, relayout_range
+from .live_stream import LiveStream, CLIENT_SCRIPT_URL, live_stream_layout
+
+
+def create_app(logger, refresh=1.0, plot_window=5000, archive_directory=None, metrics=None, stream=True):
+    app = dash.Dash(__name__, external_scripts=[CLIENT_SCRIPT_URL] if stream else [])
+    archive = HistoryArchive(archive_directory) if archive_directory else None
+    live_stream = None
+    if stream:
+        # Frames every `refresh` seconds, shared by every open page
+        live_stream = LiveStream(logger.lock, interval=refresh, metrics=metrics)
+        for i, logger_stream in enumerate(logger.streams.values()):
+            live_stream.add({'type': 'stream-graph', 'index': i}, logger_stream.live_data)
+        live_stream.register(app.server)
+
+    def stream_figure(stream, x_range=None):
+        # x is the sample time
+        with logger.lock:
+            if x_range is None:
+                xval, yval = buffer_series(stream.live_data, n=plot_window)
+            else:
+                xval, yval = range_series(stream.live_data, *x_range)
+        return live_figure(xval, yval, stream.name, 'Time', 'Voltage (V)', x_range)
+
+    def serve_layout():
+        # Built on every page load so a new tab starts from the current buffer contents
+        streams = list(logger.streams.values())
+        with render_timer(metrics, 'serve_layout'):
+            with logger.lock:
+                last_sent = [stream.live_data.total for stream in streams]
+            updates = [live_stream_layout(last_sent)] if live_stream else \
+                [dcc.Interval(id='interval-component', interval=refresh * 1000, n_intervals=0),
+                 dcc.Store(id='last-sent', data=last_sent)]
+            return html.Div(
+                [dcc.Graph(id={'type': 'stream-graph', 'index': i}, figure=stream_figure(stream))
+                 for i, stream in enumerate(streams)] + updates +
+                ([history_layout(archive)] if archive else []))
+
+    app.layout = serve_layout
+
+    if live_stream:
+        live_stream.start()
+    else:
+        @app.callback(
+            [Output({'type': 'stream-graph', 'index': ALL}, 'extendData'),
+             Output('last-sent', 'data')],
+            [Input('interval-component', 'n_intervals')],
+            [State('last-sent', 'data')]
+        )
+        def update_graphs(n, last_sent):
+            with render_timer(metrics, 'update_graphs'), logger.lock:
+                extends, sent = extend_all([(stream.live_data, 0) for stream in logger.streams.values()], last_sent)
+            return [extend or dash.no_update for extend in extends], sent
+
+    @app.callback(
+        Output({'type': 'stream-graph', 'index': MATCH}, 'figure'),
+        [Input({'type': 'stream-graph', 'index': MATCH}, 'relayoutData')],
+        [State({'type': 'stream-graph', 'index': MATCH}, 'id')],
+        prevent_initial_call=True
+    )
+    def zoom_graph(relayout_data, graph_id):
+        if not is_xaxis_change(relayout_data):
+            return dash.no_update
+        with render_timer(metrics, 'zoom_graph'):
+            return stream_figure(list(logger.streams.values())[graph_id['index']], relayout_range(relayout_data))
+
+    if archive:
+        register_history_callbacks(app, archive)
+        archive.start()
+    return app
+
+
+def create_history_app(directory, pattern=None, channel=0, cache_directory=None):
+    # The archive on its own, for `fluke3000reader history`
+    archive = HistoryArchive(directory, **({'pattern': pattern} if pattern else {}), cache_directory=cache_directory)
+    archive.refresh()
+    archive.start()
+    app = dash.Dash(__name__)
+    app.layout = lambda: history_layout(archive, channel)
+    register_history_callbacks(app, archive, channel)
+    return app
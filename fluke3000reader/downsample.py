@@ -0,0 +1,59 @@
+# Shape-preserving downsampling for plotting
+#
+# The browser only needs about one point per horizontal pixel. These reduce a
+# long series to a fixed number of points while keeping peaks and steps visible.
+
+import numpy as np
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, for each
+    # bucket in between, the point forming the largest triangle with its neighbours
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket is the third corner of the triangle
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        keep[bucket + 1] = previous
+    return x[keep], y[keep]
+
+def minmax_decimate(x, y, n_buckets):
+    # Min and max of each bucket in time order, 2 * n_buckets points at most.
+    # Cheaper than LTTB and never hides a spike.
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if 2 * n_buckets >= n or n_buckets < 1:
+        return x, y
+
+    bucket_size = n // n_buckets
+    used = bucket_size * n_buckets
+    buckets = y[:used].reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets) * bucket_size
+    low = offsets + buckets.argmin(axis=1)
+    high = offsets + buckets.argmax(axis=1)
+    keep = np.unique(np.concatenate((low, high, np.arange(used, n))))
+    return x[keep], y[keep]
+
+def downsample(x, y, n_out, method='lttb'):
+    if method == 'lttb':
+        return lttb(x, y, n_out)
+    if method == 'minmax':
+        return minmax_decimate(x, y, n_out // 2)
+    raise ValueError(f"Unknown downsampling method '{method}'")
@@ -0,0 +1,143 @@
+# Filtering and decimation of block input
+#
+# The MCC128 scans far faster than a pressure needs to be reported. Picking one
+# raw sample per output period aliases all the noise above the output rate
+# into the result; averaging or low-pass filtering before decimating removes it
+# instead. Every stage works on (channels, samples) blocks and carries its
+# state from one block to the next, so the output does not depend on where
+# a_in_scan_read happened to cut the scan.
+#
+#   median despiking   robust against single-sample glitches, keeps the rate
+#   boxcar             mean of each group of `factor` samples (CIC of order 1)
+#   cic                boxcar cascaded `order` times, deeper stopband nulls
+#   fir                windowed-sinc low-pass at 40% of the output rate
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+FILTER_KINDS = ('boxcar', 'cic', 'fir')
+MCC128_LSB = 20.0 / 2 ** 16     # V, one code of the 16-bit ADC on the +/-10 V range
+
+
+def decimation_factor(sample_rate, output_rate):
+    # Whole input samples per output sample, the output rate is rounded to match
+    return max(int(round(sample_rate / output_rate)), 1)
+
+def boxcar_taps(factor):
+    return np.full(factor, 1.0 / factor)
+
+def cic_taps(factor, order=3):
+    # Impulse response of `order` cascaded boxcars, normalized to unit DC gain
+    taps = np.ones(1)
+    for _ in range(order):
+        taps = np.convolve(taps, np.ones(factor))
+    return taps / taps.sum()
+
+def lowpass_taps(factor, numtaps=None):
+    from scipy.signal import firwin
+    # 16 taps per decimated sample keep the transition band within the output Nyquist band
+    numtaps = numtaps or 16 * factor + 1
+    return firwin(numtaps, 0.8 / factor)
+
+
+# =========================
+# Stages
+# =========================
+class Decimator:
+    """FIR filter evaluated only at the kept samples, one output every `factor` inputs."""
+
+    def __init__(self, taps, factor, sample_rate, num_channels=1):
+        self.taps = np.asarray(taps, dtype=np.float64)
+        self.factor = int(factor)
+        self.num_channels = int(num_channels)
+        self.output_rate = sample_rate / self.factor
+        # Linear-phase taps delay the output by half their length
+        self.delay = (len(self.taps) - 1) / 2 / sample_rate
+        self._reversed = self.taps[::-1].copy()
+        self._history = None    # The last len(taps) - 1 inputs of every channel
+        self._count = 0         # Inputs seen, sets the decimation phase of the next block
+
+    def process(self, timestamps, values):
+        values = np.asarray(values, dtype=np.float64).reshape(self.num_channels, -1)
+        samples = values.shape[1]
+        if samples == 0:
+            return timestamps[:0], values
+        if self._history is None:
+            # Start as if the first value had been there forever, no ramp from zero
+            self._history = np.repeat(values[:, :1], len(self.taps) - 1, axis=1)
+        data = np.concatenate((self._history, values), axis=1)
+        first = (self.factor - 1 - self._count) % self.factor
+        # Window i ends on input sample i, only every factor-th one is computed
+        windows = sliding_window_view(data, len(self.taps), axis=1)[:, first::self.factor]
+        output = windows @ self._reversed
+        self._history = data[:, data.shape[1] - (len(self.taps) - 1):]
+        self._count += samples
+        return timestamps[first::self.factor] - self.delay, output
+
+
+class MedianDespiker:
+    """Replaces samples further than `threshold` robust deviations from the running median of the last `window`."""
+
+    def __init__(self, window, threshold=5.0, num_channels=1, min_sigma=MCC128_LSB):
+        if window < 3:
+            raise ValueError("MedianDespiker window must be at least 3 samples")
+        self.window = int(window)
+        self.threshold = threshold
+        self.min_sigma = min_sigma      # Floor of the noise level, flat or quantized data has a MAD of 0
+        self.num_channels = int(num_channels)
+        self.replaced = 0
+        self._history = None
+
+    def process(self, timestamps, values):
+        values = np.asarray(values, dtype=np.float64).reshape(self.num_channels, -1)
+        if values.shape[1] == 0:
+            return timestamps, values
+        if self._history is None:
+            self._history = np.repeat(values[:, :1], self.window - 1, axis=1)
+        data = np.concatenate((self._history, values), axis=1)
+        median = np.median(sliding_window_view(data, self.window, axis=1), axis=2)
+        # Noise level of the block, median absolute deviation scaled to a Gaussian standard deviation
+        deviation = np.abs(values - median)
+        sigma = np.maximum(1.4826 * np.median(deviation, axis=1, keepdims=True), self.min_sigma)
+        spikes = deviation > self.threshold * sigma
+        self.replaced += int(np.count_nonzero(spikes))
+        self._history = data[:, -(self.window - 1):]
+        return timestamps, np.where(spikes, median, values)
+
+
+class FilterChain:
+    """Stages applied in order to the samples of every SampleBlock of one source."""
+
+    def __init__(self, stages, sample_rate):
+        self.stages = list(stages)
+        self.output_rate = sample_rate
+        for stage in self.stages:
+            self.output_rate = getattr(stage, 'output_rate', self.output_rate)
+
+    def apply(self, timestamps, values):
+        for stage in self.stages:
+            timestamps, values = stage.process(timestamps, values)
+        return timestamps, values
+
+    def process(self, sample_block):
+        timestamps, values = self.apply(sample_block.timestamps, sample_block.values)
+        monotonic = sample_block.monotonic
+        if monotonic is not None and len(monotonic):
+            # Stages only shift and thin out the times, the epoch-to-monotonic offset carries over
+            monotonic = timestamps - (sample_block.timestamps[-1] - monotonic[-1])
+        return sample_block._replace(timestamps=timestamps, values=values, monotonic=monotonic)
+
+
+def make_filter(kind, sample_rate, output_rate, despike=0, num_channels=1, order=3, min_sigma=MCC128_LSB):
+    # FilterChain for the settings, None when there is nothing to apply
+    stages = []
+    if despike:
+        stages.append(MedianDespiker(despike, num_channels=num_channels, min_sigma=min_sigma))
+    if kind:
+        if kind not in FILTER_KINDS:
+            raise ValueError(f"Unknown filter {kind!r}, expected one of {', '.join(FILTER_KINDS)}")
+        factor = decimation_factor(sample_rate, output_rate)
+        taps = {'boxcar': boxcar_taps, 'cic': lambda f: cic_taps(f, order), 'fir': lowpass_taps}[kind](factor)
+        stages.append(Decimator(taps, factor, sample_rate, num_channels))
+    return FilterChain(stages, sample_rate) if stages else None
@@ -0,0 +1,169 @@
+# Self-healing Fluke3000 connection
+#
+# A timed-out reply or the PC3000 dongle losing its modules ("module ID 64 not
+# found") used to end the run until someone reset the port by hand. FlukeSession
+# stands in for the instrument: measure() reads through the current connection,
+# and once reads keep failing the port is closed and reopened on the next reads,
+# spaced by a backoff that doubles up to `max_backoff`. The module positions
+# found by the first discovery are reused when reopening, so a reconnect takes
+# one serial open instead of a full module scan; a discovery error drops them
+# and the next open scans again. Every outage ends up in `gaps`, and FlukeReader
+# marks it in the stream with a NaN sample.
+#
+#   session = FlukeSession(PORT, BAUD)
+#   reader = FlukeReader(session, 'voltage_dc')
+
+import threading
+import time
+from .timestamps import now
+
+
+# Raised by a failed or missing module discovery, reopening right away is the only fix
+DISCOVERY_ERRORS = (NotImplementedError, ValueError, KeyError)
+
+
+class SessionDown(OSError):
+    """The port is closed and the next reconnect attempt is not due yet."""
+
+
+def fluke3000_class(simulate=False):
+    if simulate:
+        from .simulated import SimulatedFluke3000
+        return SimulatedFluke3000
+    import instruments as ik
+    return ik.fluke.Fluke3000
+
+def _cached_discovery(instrument, positions):
+    # Subclass whose connect() restores the known module positions instead of scanning
+    class CachedFluke3000(instrument):
+        def connect(self):
+            self.positions = dict(positions)
+    CachedFluke3000.__name__ = instrument.__name__
+    return CachedFluke3000
+
+
+class FlukeSession:
+    """A Fluke3000 on one serial port that reopens itself after timeouts and failed module discovery."""
+
+    def __init__(self, port, baud=115200, simulate=False, instrument=None, max_failures=3, min_backoff=1.0,
+                 max_backoff=30.0, metrics=None):
+        self.port = port
+        self.baud = baud
+        self.instrument = instrument if instrument is not None else fluke3000_class(simulate)
+        self.Mode = self.instrument.Mode
+        self.max_failures = max_failures    # Read errors in a row before the port is reopened
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics              # Optional instrumentation.PipelineMetrics
+        self.mult = None
+        self.positions = None               # Module positions of the last discovery
+        self.failures = 0
+        self.reconnects = 0
+        self.down_since = None              # Epoch time of the first failed read of the current outage
+        self.gaps = []                      # (down since, back up) epoch times of every reconnect
+        self.downtime = 0.0
+        self._reopened = False
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+        self._lock = threading.Lock()
+        # The first open raises like open_serial() would: a wrong port is a configuration error
+        self.mult = self._open()
+
+    # =========================
+    # Instrument interface
+    # =========================
+    def measure(self, mode):
+        with self._lock:
+            if self.mult is None:
+                self._reopen()
+            try:
+                quantity = self.mult.measure(mode)
+            except Exception as e:
+                self._failed(e)
+                raise
+            self.failures = 0
+            self._backoff = 0.0
+            if self.down_since is not None:
+                self._recovered()
+            return quantity
+
+    def reset(self):
+        with self._lock:
+            if self.mult is not None:
+                self.mult.reset()
+
+    def flush(self):
+        with self._lock:
+            if self.mult is not None:
+                self.mult.flush()
+
+    # =========================
+    # Recovery
+    # =========================
+    def _open(self):
+        instrument = self.instrument
+        if self.positions and hasattr(instrument, 'connect'):
+            instrument = _cached_discovery(instrument, self.positions)
+        mult = instrument.open_serial(self.port, self.baud)
+        self.positions = dict(getattr(mult, 'positions', None) or {}) or None
+        return mult
+
+    def _failed(self, error):
+        self.failures += 1
+        if self.down_since is None:
+            self.down_since = now()
+        if isinstance(error, DISCOVERY_ERRORS):
+            self.positions = None
+        elif self.failures < self.max_failures:
+            return      # A single lost reply, the next read tries the same connection
+        print(f"[{self.port}] {error!r} after {self.failures} failed reads, reopening the port")
+        self._close()
+        self._schedule_retry()
+
+    def _close(self):
+        # Closing the serial port itself, a wedged instrument does not answer reset()
+        communicator = getattr(self.mult, '_file', None)
+        try:
+            if communicator is not None:
+                communicator.close()
+        except Exception:
+            pass
+        self.mult = None
+
+    def _reopen(self):
+        if time.monotonic() < self._next_attempt:
+            raise SessionDown(f"{self.port} is down, reconnecting in {self._next_attempt - time.monotonic():.1f} s")
+        try:
+            self.mult = self._open()
+        except Exception as e:
+            if isinstance(e, DISCOVERY_ERRORS):
+                self.positions = None
+            delay = self._schedule_retry()
+            print(f"[{self.port}] Reconnect failed ({e!r}), retrying in {delay:.1f} s")
+            raise
+        self._reopened = True
+        self.reconnects += 1
+        if self.metrics:
+            self.metrics.reconnects.labels(port=self.port).inc()
+
+    def _schedule_retry(self):
+        # The first reopen is immediate, each further one waits twice as long up to max_backoff
+        delay = self._backoff
+        self._next_attempt = time.monotonic() + delay
+        self._backoff = min(max(2 * self._backoff, self.min_backoff), self.max_backoff)
+        return delay
+
+    def _recovered(self):
+        up = now()
+        if self._reopened:
+            # Only an outage that needed a reconnect is a gap, a single lost reply is not
+            self.gaps.append((self.down_since, up))
+            self.downtime += up - self.down_since
+            if self.metrics:
+                self.metrics.downtime.labels(port=self.port).inc(up - self.down_since)
+            print(f"[{self.port}] Reconnected, {up - self.down_since:.1f} s without readings")
+        self.down_since = None
+        self._reopened = False
+
+    def stats(self):
+        return {'reconnects': self.reconnects, 'gaps': len(self.gaps), 'downtime': self.downtime}
@@ -0,0 +1,523 @@
+# Historical archive viewer
+#
+# Indexes a directory of CsvWriteData files (Time,Voltage or Time,<channel>...)
+# and of the logger's long format files (Time,Source,Channel,Voltage, one
+# series per source and channel), plain or gzipped, by time range. Each file is
+# parsed once, chunk by chunk, into binary recordings in a cache directory next
+# to it, together with a pyramid of min/max summaries (buckets of 16, 256,
+# 4096, ... samples). A view of any range then reads at most a few thousand
+# summary buckets, however many samples it spans. Files that are still being
+# written are picked up where the last pass stopped.
+#
+#   fluke3000reader history /data/ionpump --port 8051
+
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+import dash
+from dash import dcc, html
+from dash.dependencies import Input, Output, State
+import numpy as np
+import plotly.graph_objs as go
+from .downsample import minmax_decimate
+from .live_plot import is_xaxis_change, relayout_range
+from .recording import Recording, RecordingWriter
+from .timestamps import parse_local_times, local_milliseconds
+
+
+ARCHIVE_PATTERN = '*voltage_data-*.csv*'  # voltage_data-... of the scripts, multi_voltage_data-... of the logger
+LONG_HEADER = ['Time', 'Source', 'Channel', 'Voltage']
+CACHE_DIRECTORY = '.history'    # Created inside the archive directory
+CACHE_VERSION = 3
+# <stem>.<generation>[.<series>].flk / .levels.npz after the stem, caches of version 1 and 2 had no generation
+CACHE_FILE = re.compile(r'(?:\.(\d+))?(?:\.[A-Za-z0-9_-]+)?\.(?:flk|levels\.npz)$')
+CHUNK_BYTES = 16 * 1024 * 1024  # CSV text parsed per step
+LEVEL_BASE = 16                 # Samples per bucket of the finest summary
+LEVEL_FANOUT = 16               # Buckets of one level merged into one bucket of the next
+LEVEL_MIN_BUCKETS = 64          # No coarser level once a level is this small
+SUMMARY_CHUNK = LEVEL_BASE * 65536  # Samples read from the recording per step when summarizing
+MAX_PLOT_POINTS = 2000
+REFRESH_INTERVAL = 30           # Seconds between scans for new and grown files
+
+
+# =========================
+# Parsing
+# =========================
+def split_csv_text(text, columns):
+    # Complete lines -> str table (columns, rows)
+    text = text.replace('\r', '')
+    while '\n\n' in text:
+        text = text.replace('\n\n', '\n')
+    text = text.strip('\n')
+    if not text:
+        return np.empty((columns, 0), dtype=str)
+    # One C-level split for the whole chunk instead of a csv.reader row loop
+    fields = text.replace('\n', ',').split(',')
+    if len(fields) % columns:
+        # A malformed row somewhere, keep only the lines with the right field count
+        fields = [field for line in text.split('\n') if line.count(',') == columns - 1
+                  for field in line.split(',')]
+    return np.array(fields, dtype=str).reshape(-1, columns).T
+
+def parse_values(table):
+    return np.where(table == '', 'nan', table).astype(np.float32)
+
+def parse_csv_text(text, columns):
+    # Complete 'Time,v1,...' lines -> (epoch times, float32 values (columns - 1, rows))
+    table = split_csv_text(text, columns)
+    if not table.shape[1]:
+        return np.empty(0), np.empty((columns - 1, 0), dtype=np.float32)
+    return parse_local_times(table[0]), parse_values(table[1:])
+
+def parse_long_text(text):
+    # Complete 'Time,Source,Channel,Voltage' lines -> {'source/channel': (epoch times, float32 values (1, rows))}
+    table = split_csv_text(text, len(LONG_HEADER))
+    if not table.shape[1]:
+        return {}
+    times, values = parse_local_times(table[0]), parse_values(table[3:])
+    names = np.char.add(np.char.add(table[1], '/'), table[2])
+    unique, first = np.unique(names, return_index=True)
+    series = {}
+    for name in unique[np.argsort(first)].tolist():
+        rows = names == name
+        series[name] = times[rows], values[:, rows]
+    return series
+
+def read_csv_chunks(f, parse, chunk_bytes=CHUNK_BYTES):
+    # Yields (parse(text), bytes consumed) for whole lines, a trailing partial line is left for the next pass
+    carry = b''
+    while True:
+        data = f.read(chunk_bytes)
+        if not data:
+            return
+        data = carry + data
+        end = data.rfind(b'\n') + 1
+        carry = data[end:]
+        if end:
+            yield parse(data[:end].decode('utf-8')), end
+
+
+# =========================
+# Summaries
+# =========================
+def build_levels(recording, levels=(), done=0):
+    # [(bucket size, bucket start times, low (buckets, channels), high (buckets, channels)), ...]
+    # With the levels of the first `done` samples, only the buckets from the last complete one on are built again
+    n = len(recording)
+    if n < 2 * LEVEL_BASE:
+        return []
+    if levels and done >= n:
+        return list(levels)
+    first = min(done // LEVEL_BASE, len(levels[0][1])) if levels else 0
+    times, values = recording.times, recording.values
+    parts = []
+    for start in range(first * LEVEL_BASE, n, SUMMARY_CHUNK):
+        chunk = np.asarray(values[start:start + SUMMARY_CHUNK])
+        index = np.arange(0, len(chunk), LEVEL_BASE)
+        # fmin/fmax skip NaN (empty CSV fields) unless a whole bucket is NaN
+        parts.append((times[start + index], np.fmin.reduceat(chunk, index, axis=0),
+                      np.fmax.reduceat(chunk, index, axis=0)))
+    level = (LEVEL_BASE,) + _joined(levels[0] if levels else None, first, parts)
+    built = [level]
+    while len(level[1]) > LEVEL_MIN_BUCKETS:
+        size, bucket_times, low, high = level
+        # The next level from the bucket the first rebuilt one falls into, a level that is new from the start
+        first = first // LEVEL_FANOUT if len(built) < len(levels) else 0
+        index = np.arange(first * LEVEL_FANOUT, len(bucket_times), LEVEL_FANOUT)
+        tail = (bucket_times[index], np.fmin.reduceat(low, index, axis=0), np.fmax.reduceat(high, index, axis=0))
+        level = (size * LEVEL_FANOUT,) + _joined(levels[len(built)] if first else None, first, [tail])
+        built.append(level)
+    return built
+
+def _joined(old, first, parts):
+    # The first `first` buckets of an old level followed by the new ones
+    columns = [np.concatenate(column) for column in zip(*parts)]
+    if old is None:
+        return tuple(columns)
+    return tuple(np.concatenate((kept[:first], column)) for kept, column in zip(old[1:], columns))
+
+def save_levels(path, levels):
+    arrays = {}
+    for k, (size, times, low, high) in enumerate(levels):
+        arrays.update({f'size{k}': size, f'times{k}': times, f'low{k}': low, f'high{k}': high})
+    np.savez(path, **arrays)
+
+def load_levels(path):
+    with np.load(path) as arrays:
+        return [(int(arrays[f'size{k}']), arrays[f'times{k}'], arrays[f'low{k}'], arrays[f'high{k}'])
+                for k in range(len(arrays.files) // 4)]
+
+
+# =========================
+# Archive
+# =========================
+class ArchiveFile:
+    """One CSV file of the archive, its cached recordings and min/max levels.
+
+    A Time,<channel>... file is cached as one part holding all of its columns,
+    a long format file as one part per source/channel series.
+    """
+
+    def __init__(self, source, cache_directory):
+        self.source = source
+        # A file and its later .gz share one cache entry, the .gz is parsed again from the start
+        self.name = os.path.basename(source)[:-3] if source.endswith('.gz') else os.path.basename(source)
+        self.stem = os.path.join(cache_directory, os.path.splitext(self.name)[0])
+        self.state_path = self.stem + '.json'
+        self.views = {}         # Part -> ArchiveView of the cache as of the last update, replaced, never changed
+        self.state = {}
+
+    def paths(self, part, generation=None):
+        # Recording and levels file of a part, '' is the whole of a Time,<channel>... file
+        generation = self.state.get('generation', 0) if generation is None else generation
+        stem = f'{self.stem}.{generation}'
+        if part:
+            stem += '.' + re.sub(r'[^A-Za-z0-9_-]', '_', part)
+        return stem + '.flk', stem + '.levels.npz'
+
+    def update(self):
+        # Brings the cache up to date with the source, returns True when anything changed
+        stat = os.stat(self.source)
+        if self.state == {} and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+            if self.state.get('version') != CACHE_VERSION or not all(
+                    os.path.exists(self.paths(part)[0]) for part in self.state.get('parts', {})):
+                self.state = {}
+        if self.state.get('complete') and self.source.endswith('.gz'):
+            pass
+        elif self.state.get('size') == stat.st_size and self.state.get('mtime') == stat.st_mtime:
+            pass
+        elif self.source.endswith('.gz') or stat.st_size < self.state.get('offset', 0):
+            self._parse(0)
+        else:
+            self._parse(self.state.get('offset', 0))
+        views = {}
+        for part, samples in self.state.get('parts', {}).items():
+            view = self.views.get(part)
+            if view is None or view.recording.path != self.paths(part)[0] or samples != len(view):
+                # Opened next to the current view, readers holding that one keep using it
+                recording_path, levels_path = self.paths(part)
+                view = ArchiveView(self.name, Recording(recording_path),
+                                   load_levels(levels_path) if os.path.exists(levels_path) else [])
+            views[part] = view
+        changed = views.keys() != self.views.keys() or any(views[part] is not self.views[part] for part in views)
+        self.views = views
+        self._remove_stale()
+        return changed
+
+    def _cache_files(self):
+        # (path, generation or None) of every recording and levels file of this source
+        files = []
+        for path in glob.glob(glob.escape(self.stem) + '.*'):
+            match = CACHE_FILE.fullmatch(path[len(self.stem):])
+            if match:
+                files.append((path, int(match.group(1)) if match.group(1) else None))
+        return files
+
+    def _remove_stale(self):
+        # Files of earlier generations. Windows refuses while a view still maps one, it is tried on every update
+        for path, generation in self._cache_files():
+            if generation != self.state.get('generation'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _parse(self, offset):
+        stat = os.stat(self.source)
+        opener = gzip.open if self.source.endswith('.gz') else open
+        with opener(self.source, 'rb') as f:
+            header = f.readline().decode('utf-8').strip().split(',')
+            if header[0] != 'Time' or len(header) < 2:
+                raise ValueError(f"{self.source} is not a Time,<channel>... CSV file")
+            long_format = header == LONG_HEADER
+            parts = dict(self.state.get('parts', {}))
+            generation = self.state.get('generation', 0)
+            if offset == 0:
+                offset = f.tell()
+                parts = {}
+                # A new set of files, the current views keep mapping theirs until they are released
+                generation = max([g for _, g in self._cache_files() if g is not None] + [generation]) + 1
+            f.seek(offset)
+            parse = parse_long_text if long_format else lambda text: {'': parse_csv_text(text, len(header))}
+            writers = {}
+            try:
+                for series, consumed in read_csv_chunks(f, parse):
+                    for part, (times, values) in series.items():
+                        if part not in writers:
+                            writers[part] = RecordingWriter(self.paths(part, generation)[0],
+                                                            channels=[part] if long_format else header[1:],
+                                                            metadata={'source': os.path.basename(self.source)})
+                        writers[part].append(times, values)
+                    offset += consumed
+            finally:
+                for writer in writers.values():
+                    writer.close()
+        done = dict(parts) if generation == self.state.get('generation') else {}
+        self.state = {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'offset': offset,
+                      'complete': self.source.endswith('.gz'), 'generation': generation, 'parts': parts}
+        self._summarize(writers, done)
+
+    def _summarize(self, parts, done):
+        # done: samples per part the current levels already cover, those are extended instead of rebuilt
+        for part in parts:
+            recording_path, levels_path = self.paths(part)
+            levels = []
+            if done.get(part):
+                view = self.views.get(part)
+                if view is not None and view.recording.path == recording_path and len(view) == done[part]:
+                    levels = view.levels
+                elif os.path.exists(levels_path):
+                    levels = load_levels(levels_path)
+            recording = Recording(recording_path)
+            try:
+                save_levels(levels_path, build_levels(recording, levels, done.get(part, 0) if levels else 0))
+                self.state['parts'][part] = len(recording)
+            finally:
+                recording.close()
+        # Written last, until then the previous state and its files stay valid
+        with open(self.state_path, 'w') as f:
+            json.dump(self.state, f)
+
+
+class ArchiveView:
+    """Recording and summaries of one archive file at one point in time, safe to read from any thread."""
+
+    def __init__(self, name, recording, levels):
+        self.name = name
+        self.recording = recording
+        self.levels = levels
+        self.channels = recording.channels
+
+    @property
+    def start(self):
+        return float(self.recording.times[0])
+
+    @property
+    def end(self):
+        return float(self.recording.times[-1])
+
+    def __len__(self):
+        return len(self.recording)
+
+    def index(self, t, side='left'):
+        # searchsorted on the strided times of the memmap would copy all of them,
+        # the finest level narrows the search down to one bucket first
+        times = self.recording.times
+        if not self.levels:
+            return int(np.searchsorted(times, t, side))
+        bucket = int(np.searchsorted(self.levels[0][1], t, side))
+        low = max(bucket - 1, 0) * LEVEL_BASE
+        high = min(bucket * LEVEL_BASE + 1, len(times))
+        return low + int(np.searchsorted(times[low:high], t, side))
+
+    def count(self, t_start, t_end):
+        return self.index(t_end, 'right') - self.index(t_start, 'left')
+
+    def raw(self, t_start, t_end, channel=0):
+        span = slice(self.index(t_start, 'left'), self.index(t_end, 'right'))
+        return np.array(self.recording.times[span]), np.array(self.recording.channel(channel)[span], dtype=np.float64)
+
+    def summary(self, t_start, t_end, level, group, channel=0):
+        # Min and max of every `group` buckets of a level, as a zig-zag through low and high
+        size, times, low, high = self.levels[level]
+        first = max(int(np.searchsorted(times, t_start, 'right')) - 1, 0)
+        last = int(np.searchsorted(times, t_end, 'right'))
+        index = np.arange(0, last - first, group)
+        if not len(index):
+            return np.empty(0), np.empty(0)
+        lows = np.fmin.reduceat(low[first:last, channel], index).astype(np.float64)
+        highs = np.fmax.reduceat(high[first:last, channel], index).astype(np.float64)
+        return np.repeat(times[first + index], 2), np.column_stack((lows, highs)).ravel()
+
+
+class HistoryArchive:
+    """Time-indexed view of every archive file in a directory, kept current by a refresh thread."""
+
+    def __init__(self, directory, pattern=ARCHIVE_PATTERN, cache_directory=None):
+        self.directory = directory
+        self.pattern = pattern
+        self.cache_directory = cache_directory or os.path.join(directory, CACHE_DIRECTORY)
+        self.files = []         # ArchiveView of every file (or series of a long format file) with data, by start time
+        self.version = 0        # Bumped whenever the indexed data changes
+        self.errors = 0
+        self._known = {}
+        self._lock = threading.Lock()              # Guards files, swapped whole by refresh()
+        self._refresh_lock = threading.Lock()      # One refresh at a time, ArchiveFile is not shared
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # =========================
+    # Indexing
+    # =========================
+    def refresh(self):
+        # Parses new files and the new tail of grown ones, returns True when the index changed
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        os.makedirs(self.cache_directory, exist_ok=True)
+        sources = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, self.pattern))):
+            if path.endswith('.csv') or path.endswith('.csv.gz'):
+                name = os.path.basename(path)[:-3] if path.endswith('.gz') else os.path.basename(path)
+                # Prefer the plain file while both exist, it is the one still being written
+                if name not in sources or path.endswith('.csv'):
+                    sources[name] = path
+        changed = set(self._known) - set(sources)
+        for name, path in sources.items():
+            entry = self._known.get(name)
+            if entry is None or entry.source != path:
+                entry = ArchiveFile(path, self.cache_directory)
+                self._known[name] = entry
+            try:
+                if entry.update():
+                    changed.add(name)
+            except Exception as e:
+                self.errors += 1
+                print(f"[history] Skipping {path}: {e!r}")
+        for name in set(self._known) - set(sources):
+            del self._known[name]
+        if changed:
+            # Readers keep the views they already took, the new list replaces the old one whole
+            views = [view for entry in self._known.values() for view in entry.views.values()]
+            files = sorted((view for view in views if len(view)), key=lambda view: view.start)
+            with self._lock:
+                self.files = files
+                self.version += 1
+        return bool(changed)
+
+    def start(self, interval=REFRESH_INTERVAL):
+        # Indexes in the background, the first pass over a large archive can take a while
+        self._thread = threading.Thread(target=self._refresh_loop, args=(interval,), name='history-refresh',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _refresh_loop(self, interval):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # A failing pass must not end the thread, the next one may succeed
+                self.errors += 1
+                print(f"[history] Refresh failed: {e!r}")
+            if self._stop_event.wait(interval):
+                return
+
+    # =========================
+    # Queries
+    # =========================
+    def extent(self):
+        with self._lock:
+            if not self.files:
+                return None
+            return self.files[0].start, max(entry.end for entry in self.files)
+
+    def names(self):
+        # Every series in the archive, in order of appearance: column names and long format source/channel
+        with self._lock:
+            files = list(self.files)
+        return list(dict.fromkeys(name for entry in files for name in entry.channels))
+
+    def series_name(self, channel):
+        # A series name, or its number in names()
+        if isinstance(channel, str):
+            return channel
+        names = self.names()
+        return names[channel] if 0 <= channel < len(names) else None
+
+    def series(self, t_start=None, t_end=None, channel=0, max_points=MAX_PLOT_POINTS):
+        # (epoch times, values) of the range, raw when it fits in max_points, min/max summaries otherwise.
+        # Files are separated by a NaN so the plot does not draw a line across gaps in the archive.
+        name = self.series_name(channel)
+        with self._lock:
+            files = [entry for entry in self.files if name in entry.channels]
+        if not files:
+            return np.empty(0), np.empty(0)
+        t_start = files[0].start if t_start is None else t_start
+        t_end = max(entry.end for entry in files) if t_end is None else t_end
+        files = [entry for entry in files if entry.start <= t_end and entry.end >= t_start]
+        total = sum(entry.count(t_start, t_end) for entry in files)
+
+        # Samples each plotted low/high pair stands for, then the coarsest level at least that fine
+        per_pair = total / max(max_points // 2, 1)
+        level = int(np.log(per_pair / LEVEL_BASE) // np.log(LEVEL_FANOUT)) if per_pair >= LEVEL_BASE else None
+        xs, ys = [], []
+        for entry in files:
+            column = entry.channels.index(name)
+            if total <= max_points:
+                x, y = entry.raw(t_start, t_end, column)
+            elif level is None or level >= len(entry.levels):
+                # Fewer samples than one summary bucket per pair, or a file too short to have that level
+                x, y = entry.raw(t_start, t_end, column)
+                x, y = minmax_decimate(x, y, max(int(len(x) / per_pair), 1))
+            else:
+                group = max(int(np.ceil(per_pair / entry.levels[level][0])), 1)
+                x, y = entry.summary(t_start, t_end, level, group, column)
+            if len(x):
+                if xs:
+                    xs.append([x[0]])
+                    ys.append([np.nan])
+                xs.append(x)
+                ys.append(y)
+        if not xs:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(xs), np.concatenate(ys)
+
+
+# =========================
+# Dash
+# =========================
+def history_figure(archive, x_range=None, channel=0, max_points=MAX_PLOT_POINTS):
+    # x_range in epoch seconds, None for the whole archive; channel a series name or its number
+    name = archive.series_name(channel)
+    x, y = archive.series(*(x_range or (None, None)), channel=channel, max_points=max_points)
+    xaxis = dict(title='Time', type='date')
+    if x_range is not None:
+        xaxis['range'] = local_milliseconds(x_range).tolist()
+    return {
+        'data': [go.Scatter(x=local_milliseconds(x), y=y, mode='lines', connectgaps=False)],
+        'layout': go.Layout(
+            title=f'Archive {archive.directory}' + (f' {name}' if name else ''),
+            xaxis=xaxis,
+            yaxis=dict(title='Voltage (V)'),
+            uirevision='history'
+        )
+    }
+
+def history_layout(archive, channel=0):
+    return html.Div([
+        dcc.Graph(id='history-graph', figure=history_figure(archive, channel=channel)),
+        # Picks up files the refresh thread has indexed since the page was drawn
+        dcc.Interval(id='history-interval', interval=REFRESH_INTERVAL * 1000, n_intervals=0),
+        dcc.Store(id='history-version', data=archive.version)
+    ])
+
+def register_history_callbacks(app, archive, channel=0):
+    @app.callback(
+        [Output('history-graph', 'figure'),
+         Output('history-version', 'data')],
+        [Input('history-graph', 'relayoutData'),
+         Input('history-interval', 'n_intervals')],
+        [State('history-version', 'data')],
+        prevent_initial_call=True
+    )
+    def update_history(relayout_data, n, version):
+        triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+        if 'history-graph.relayoutData' in triggered:
+            if not is_xaxis_change(relayout_data):
+                return dash.no_update, dash.no_update
+        elif archive.version == version:
+            return dash.no_update, dash.no_update
+        # The last zoom is still in relayoutData, so new data is drawn into the range being looked at
+        return history_figure(archive, relayout_range(relayout_data), channel), archive.version
+
@@ -0,0 +1,65 @@
+# Pipeline health metrics
+#
+# Where the acquisition time goes, in the same prometheus_client registry as the
+# pressure metrics: how long each source read takes and how much it returns,
+# how late every sampler iteration starts against its schedule, how long each
+# processing stage and Dash callback takes per block, and counters for every
+# way samples get lost or arrive late. Components take an optional `metrics`
+# and skip all of it when they are given none; stage_timer and render_timer
+# do that for a `with` block and work without prometheus_client installed.
+
+from contextlib import nullcontext
+
+
+# 100 us to 10 s, serial replies take ~50-300 ms, HAT reads and stages much less
+LATENCY_BUCKETS = (1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Lateness of a loop iteration, well under a millisecond when the host keeps up
+JITTER_BUCKETS = (1e-4, 5e-4, 1e-3, 2e-3, 5e-3, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Samples per channel in one read, 1 for the Fluke up to a few seconds of scan
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+
+
+class PipelineMetrics:
+    """Histograms and counters of the acquisition loop and its consumers."""
+
+    def __init__(self, registry=None):
+        from prometheus_client import CollectorRegistry, Counter, Histogram
+        self.registry = registry if registry is not None else CollectorRegistry()
+        self.read_seconds = Histogram('source_read_seconds', 'Time taken by one source read (Fluke measure(), HAT scan read)',
+                                      ['source'], buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.read_samples = Histogram('source_read_samples', 'Samples per channel returned by one source read',
+                                      ['source'], buckets=SIZE_BUCKETS, registry=self.registry)
+        self.loop_jitter = Histogram('loop_jitter_seconds', 'How late each sampler iteration started against its schedule',
+                                     ['loop'], buckets=JITTER_BUCKETS, registry=self.registry)
+        self.stage_seconds = Histogram('stage_seconds', 'Time spent on one block by each processing stage',
+                                       ['stage'], buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.render_seconds = Histogram('render_seconds', 'Time taken by each Dash callback',
+                                        ['callback'], buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.errors = Counter('acquire_errors', 'Failed reads: serial timeouts, unparsable replies, driver errors',
+                              ['loop'], registry=self.registry)
+        self.late_slots = Counter('late_slots', 'Sampler schedule slots missed because a read ran too long',
+                                  ['loop'], registry=self.registry)
+        self.overruns = Counter('scan_overruns', 'MCC128 hardware or buffer overruns', ['source'], registry=self.registry)
+        self.dropped_samples = Counter('dropped_samples', 'Samples per channel lost, e.g. while a scan restarted',
+                                       ['source'], registry=self.registry)
+        self.late_blocks = Counter('late_blocks', 'Blocks merged after newer blocks had already been handed on',
+                                   ['source'], registry=self.registry)
+        self.reconnects = Counter('serial_reconnects', 'Fluke3000 serial ports reopened after failed reads',
+                                  ['port'], registry=self.registry)
+        self.downtime = Counter('serial_downtime_seconds', 'Time without readings until a reconnect succeeded',
+                                ['port'], registry=self.registry)
+
+    def stage(self, name):
+        # with metrics.stage('csv'): ...
+        return self.stage_seconds.labels(stage=name).time()
+
+    def render(self, name):
+        return self.render_seconds.labels(callback=name).time()
+
+
+def stage_timer(metrics, name):
+    # Stage timer that does nothing without metrics
+    return metrics.stage(name) if metrics is not None else nullcontext()
+
+def render_timer(metrics, name):
+    return metrics.render(name) if metrics is not None else nullcontext()
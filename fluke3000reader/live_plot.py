@@ -0,0 +1,96 @@
+# Dash figure helpers for the live graphs
+#
+# Graphs are drawn once from a downsampled snapshot, then only the samples that
+# arrived since the last tick are sent through extendData. Zooming asks the
+# server for a fresh downsampled view of the selected range. The x axis is a
+# date axis fed from the sample timestamps, converted to local time only here.
+
+import numpy as np
+import plotly.graph_objs as go
+from .downsample import downsample
+from .timestamps import local_milliseconds, from_local_milliseconds, parse_local_times
+
+
+MAX_PLOT_POINTS = 2000      # Points per trace sent to the browser, about one per horizontal pixel
+DOWNSAMPLE_METHOD = 'lttb'  # 'lttb' or 'minmax'
+SNAPSHOT_ATTEMPTS = 3       # Copies extend_since takes when a writer in another process keeps moving the start
+
+
+def buffer_series(buffer, channel=0, n=None):
+    # x are the epoch timestamps, y the channel values, both copies
+    times, values = buffer.latest(n)
+    return times.copy(), values[channel].copy()
+
+def range_series(buffer, t_start, t_end, channel=0):
+    # Samples stamped within [t_start, t_end], clipped to what is still buffered
+    times, values = buffer.latest()
+    start = int(np.searchsorted(times, t_start, 'left'))
+    end = int(np.searchsorted(times, t_end, 'right'))
+    return times[start:end].copy(), values[channel, start:end].copy()
+
+def live_figure(x, y, title, xaxis_title, yaxis_title, x_range=None, max_points=MAX_PLOT_POINTS):
+    # x and x_range in epoch seconds
+    x, y = downsample(x, y, max_points, DOWNSAMPLE_METHOD)
+    xaxis = dict(title=xaxis_title, type='date')
+    if x_range is not None:
+        xaxis['range'] = local_milliseconds(x_range).tolist()
+    return {
+        'data': [go.Scatter(x=local_milliseconds(x), y=y, mode='lines+markers')],
+        'layout': go.Layout(
+            title=title,
+            xaxis=xaxis,
+            yaxis=dict(title=yaxis_title),
+            xaxis_rangeslider=dict(visible=False),
+            uirevision=title     # Keep the user's zoom across updates
+        )
+    }
+
+def extend_since(buffer, last_total, channel=0, max_points=MAX_PLOT_POINTS, end=None):
+    # Returns (extendData payload or None, new last_total) for the samples added after last_total,
+    # up to the total `end` when given instead of everything buffered.
+    # Positions come from the copy itself: a shared ring's writer appends without taking our lock
+    wanted = buffer.total - last_total
+    for _ in range(SNAPSHOT_ATTEMPTS):
+        times, values, total = buffer.latest_with_total(max(wanted, 0))
+        first = total - len(times)
+        if first <= last_total or len(times) < wanted:
+            break   # Reaches back to last_total, or the older samples are gone
+        wanted = total - last_total
+    end = total if end is None else min(end, total)
+    start = max(last_total, first)
+    if end <= start:
+        return None, end
+    x = times[start - first:end - first].copy()
+    y = values[channel, start - first:end - first].copy()
+    x, y = downsample(x, y, max_points, DOWNSAMPLE_METHOD)
+    return (dict(x=[local_milliseconds(x).tolist()], y=[y.tolist()]), [0], max_points), end
+
+def extend_all(series, last_sent):
+    # Polled graphs: only the samples this browser has not seen yet go over the wire.
+    # series holds a (buffer, channel) per graph; returns one payload per graph (None when
+    # nothing is new) and the totals the page keeps for its next poll
+    extends, sent = [], []
+    for (buffer, channel), last_total in zip(series, last_sent):
+        extend, total = extend_since(buffer, last_total, channel)
+        extends.append(extend)
+        sent.append(total)
+    return extends, sent
+
+def is_xaxis_change(relayout_data):
+    # relayoutData also fires for autosize and other layout events that need no redraw
+    return bool(relayout_data) and any(key.startswith('xaxis.') for key in relayout_data)
+
+def relayout_range(relayout_data):
+    # Extracts the zoomed x range from a relayoutData event as epoch seconds, None when autoscaled
+    if not relayout_data or 'xaxis.autorange' in relayout_data:
+        return None
+    if 'xaxis.range[0]' in relayout_data:
+        x_range = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        x_range = tuple(relayout_data['xaxis.range'])
+    else:
+        return None
+    # Date axes report local time strings, ranges set from code may come back as local milliseconds
+    if isinstance(x_range[0], str):
+        return tuple(parse_local_times([text.replace('T', ' ') for text in x_range]).tolist())
+    return tuple(from_local_milliseconds(x_range).tolist())
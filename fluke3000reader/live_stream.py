@@ -0,0 +1,275 @@
+# Push updates for the live graphs
+#
+# Polling with dcc.Interval costs one Dash callback per browser per tick,
+# whether or not a sample arrived. LiveStream turns that around: one thread
+# reads the new samples of every graph once per frame, encodes them once and
+# appends the frame to a short shared log. Every browser holds a Server-Sent
+# Events connection whose handler only copies the frames it has not sent yet,
+# all pending ones coalesced into a single event. A client too slow to keep up
+# blocks only its own connection; once its next frame has left the log it gets
+# one catch-up event built from its own position and continues from there.
+#
+#   stream = LiveStream(data_lock, interval=DELAY)
+#   stream.add('live-update-graph-1', live_data)
+#   app = dash.Dash(__name__, external_scripts=[CLIENT_SCRIPT_URL])
+#   stream.register(app.server)
+#   stream.start()
+#
+# The page needs live_stream_layout(totals) with the buffer totals its figures
+# were drawn at, the browser starts the stream from there.
+
+import json
+import threading
+import time
+from collections import deque
+from .instrumentation import render_timer
+from .live_plot import MAX_PLOT_POINTS, extend_since
+
+
+STREAM_URL = '/_live/stream'
+CLIENT_SCRIPT_URL = '/_live/client.js'
+LOG_FRAMES = 60          # Frames kept for clients that fall behind, older ones get a catch-up event
+KEEPALIVE = 15.0         # Seconds between comments on an idle connection, finds closed tabs
+
+
+def dom_id(component_id):
+    # The element id Dash renders, pattern-matching ids are stringified with sorted keys
+    if isinstance(component_id, dict):
+        return json.dumps(component_id, sort_keys=True, separators=(',', ':'))
+    return component_id
+
+def _event(graphs, totals):
+    # The id is the buffer totals after the event, a reconnecting browser sends it back as Last-Event-ID
+    event_id = ','.join(str(total) for total in totals)
+    return f"id: {event_id}\ndata: {json.dumps(graphs, separators=(',', ':'))}\n\n".encode()
+
+
+class Frame:
+    """New samples of every graph between two buffer positions, encoded once for all clients."""
+
+    def __init__(self, since, totals, graphs):
+        self.since = since      # Buffer totals before this frame
+        self.totals = totals    # Buffer totals after it
+        self.graphs = graphs    # {dom id: [x, y]}
+        self.event = _event(graphs, totals)
+
+
+class LiveStream(threading.Thread):
+    """Reads the new samples of every registered graph once per frame and fans them out to all browsers."""
+
+    def __init__(self, lock, interval=1.0, max_points=MAX_PLOT_POINTS, log_frames=LOG_FRAMES, metrics=None):
+        super().__init__(name='live-stream', daemon=True)
+        self.lock = lock
+        self.interval = interval
+        self.max_points = max_points
+        self.metrics = metrics              # Frame times go to render_seconds{callback="live_stream"}
+        self.series = []                    # (dom id, buffer, channel)
+        self.frames = deque(maxlen=log_frames)
+        self.clients = 0
+        self.catch_ups = 0                  # Events built for one client instead of from the shared frames
+        self._changed = threading.Condition()
+        self._stop_event = threading.Event()
+
+    def add(self, graph_id, buffer, channel=0):
+        self.series.append((dom_id(graph_id), buffer, channel))
+
+    def totals(self):
+        # Current buffer positions, the caller holds the lock
+        return [buffer.total for _, buffer, _ in self.series]
+
+    # =========================
+    # Producer
+    # =========================
+    def run(self):
+        with self.lock:
+            last = self.totals()
+        next_frame = time.monotonic()
+        while not self._stop_event.is_set():
+            next_frame += self.interval
+            graphs, totals = {}, []
+            with render_timer(self.metrics, 'live_stream'):
+                with self.lock:
+                    for (graph, buffer, channel), since in zip(self.series, last):
+                        extend, total = extend_since(buffer, since, channel, self.max_points)
+                        if extend:
+                            graphs[graph] = [extend[0]['x'][0], extend[0]['y'][0]]
+                        totals.append(total)
+                if graphs:
+                    frame = Frame(last, totals, graphs)
+                    with self._changed:
+                        self.frames.append(frame)
+                        self._changed.notify_all()
+            last = totals
+            self._stop_event.wait(max(next_frame - time.monotonic(), 0))
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        with self._changed:
+            self._changed.notify_all()
+        if self.is_alive():
+            self.join(timeout)
+
+    # =========================
+    # Clients
+    # =========================
+    def _pending(self, totals):
+        # Frames with samples the client has not been sent, the caller holds _changed
+        return [frame for frame in self.frames if any(t > c for t, c in zip(frame.totals, totals))]
+
+    def _coalesce(self, frames, totals):
+        # One event of all pending frames, and the client's new totals
+        if frames[0].since == totals:
+            # In step with the log, the common case: the frames' own encoding
+            totals = frames[-1].totals
+            return frames[0].event if len(frames) == 1 else _event(self._merge(frames), totals), totals
+        # Joined between frames or fell out of the log: the first frame is read again from the client's position
+        graphs, totals = {}, list(totals)
+        with self.lock:
+            for frame in frames:
+                for i, (graph, buffer, channel) in enumerate(self.series):
+                    if frame.totals[i] <= totals[i]:
+                        continue
+                    if frame.since[i] == totals[i]:
+                        x, y = frame.graphs.get(graph, ([], []))
+                    else:
+                        extend, _ = extend_since(buffer, totals[i], channel, self.max_points, end=frame.totals[i])
+                        x, y = (extend[0]['x'][0], extend[0]['y'][0]) if extend else ([], [])
+                    if x:
+                        graphs.setdefault(graph, [[], []])
+                        graphs[graph][0].extend(x)
+                        graphs[graph][1].extend(y)
+                    totals[i] = frame.totals[i]
+        self.catch_ups += 1
+        return (_event(graphs, totals) if graphs else None), totals
+
+    def _merge(self, frames):
+        # Extends of consecutive frames as one, x and y appended per graph
+        graphs = {}
+        for frame in frames:
+            for graph, (x, y) in frame.graphs.items():
+                graphs.setdefault(graph, [[], []])
+                graphs[graph][0].extend(x)
+                graphs[graph][1].extend(y)
+        return graphs
+
+    def events(self, since=None):
+        # Event bytes for one client, starting after the buffer positions `since` of its page
+        if since is None or len(since) != len(self.series):
+            with self.lock:
+                since = self.totals()
+        totals = list(since)
+        with self._changed:
+            self.clients += 1
+        try:
+            yield b'retry: 2000\n\n'
+            while not self._stop_event.is_set():
+                with self._changed:
+                    frames = self._pending(totals)
+                    if not frames:
+                        self._changed.wait(KEEPALIVE)
+                        frames = self._pending(totals)
+                if not frames:
+                    # An idle connection is only noticed closed when written to
+                    yield b': keepalive\n\n'
+                    continue
+                # Everything that arrived while this client's last write blocked goes out as one event
+                event, totals = self._coalesce(frames, totals)
+                if event:
+                    yield event
+        finally:
+            with self._changed:
+                self.clients -= 1
+
+    def register(self, server):
+        # Adds the event stream and the browser script to a Flask server, e.g. app.server
+        from flask import Response, request
+
+        def stream():
+            # After a dropped connection the browser resumes from the last event it got, not from its page
+            since = request.headers.get('Last-Event-ID') or request.args.get('since')
+            try:
+                since = [int(total) for total in since.split(',')] if since else None
+            except ValueError:
+                since = None
+            return Response(self.events(since), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        def client_script():
+            return Response(CLIENT_SCRIPT, mimetype='application/javascript')
+
+        server.add_url_rule(STREAM_URL, 'live_stream', stream)
+        server.add_url_rule(CLIENT_SCRIPT_URL, 'live_stream_client', client_script)
+
+
+def live_stream_layout(totals, max_points=MAX_PLOT_POINTS):
+    # Marker read by the browser script, with the buffer totals the page's figures were drawn at
+    from dash import html
+    return html.Div(id='live-stream', style={'display': 'none'}, **{
+        'data-since': ','.join(str(total) for total in totals),
+        'data-max-points': str(max_points)})
+
+
+# Browser side: one EventSource per page, the extends of each animation frame
+# go to Plotly in one extendTraces call per graph.
+CLIENT_SCRIPT = """
+(function () {
+    var pending = {}, scheduled = false, source = null;
+
+    function graphDiv(id) {
+        var outer = document.getElementById(id);
+        return outer && outer.querySelector('.js-plotly-plot');
+    }
+
+    function flush() {
+        scheduled = false;
+        var marker = document.getElementById('live-stream');
+        var maxPoints = marker ? parseInt(marker.dataset.maxPoints, 10) : 2000;
+        Object.keys(pending).forEach(function (id) {
+            var div = graphDiv(id);
+            if (!div || !div.data || !window.Plotly) {
+                return;     // Not drawn yet, kept for the next frame
+            }
+            window.Plotly.extendTraces(div, {x: [pending[id][0]], y: [pending[id][1]]}, [0], maxPoints);
+            delete pending[id];
+        });
+        if (Object.keys(pending).length) {
+            schedule();
+        }
+    }
+
+    function schedule() {
+        if (!scheduled) {
+            scheduled = true;
+            window.requestAnimationFrame(flush);
+        }
+    }
+
+    function receive(event) {
+        var graphs = JSON.parse(event.data);
+        Object.keys(graphs).forEach(function (id) {
+            if (pending[id]) {
+                Array.prototype.push.apply(pending[id][0], graphs[id][0]);
+                Array.prototype.push.apply(pending[id][1], graphs[id][1]);
+            } else {
+                pending[id] = graphs[id];
+            }
+        });
+        schedule();
+    }
+
+    function connect() {
+        var marker = document.getElementById('live-stream');
+        if (!marker) {
+            window.setTimeout(connect, 200);    // Dash renders the layout after the page loads
+            return;
+        }
+        if (source) {
+            return;
+        }
+        source = new EventSource('%s?since=' + marker.dataset.since);
+        source.onmessage = receive;
+    }
+
+    connect();
+})();
+""" % STREAM_URL
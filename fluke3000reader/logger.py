@@ -0,0 +1,339 @@
+# Config driven logger
+#
+# The multi-source pipeline built from a config, multiReader.py builds one from
+# its settings: every Fluke3000 section and the MCC128 channels are polled by
+# their own threads, merged in timestamp order and fed to the live buffers,
+# CSV, recordings and Prometheus. Nothing is opened or started before start(),
+# and the optional parts (Prometheus, alarms, the simulated or real hardware
+# drivers) are imported only when they are enabled.
+#
+# The same pipeline runs on either side of a shared-memory ring (processes.py):
+# with a consumer the acquisition process hands each block straight from its
+# source thread to the consumer, with rings a reader process takes its blocks
+# from the rings instead of the hardware.
+
+import datetime
+import os
+import threading
+import numpy as np
+from .calibration import get_pressure, load_calibration_dir, DEFAULT_CALIBRATION
+from .config import fluke_sources, alarm_rules, optional, name_values, int_list
+from .filters import make_filter
+from .instrumentation import stage_timer
+from .profiling import make_profiler, write_on_signal
+from .ringbuffer import RingBuffer
+from .rolling_stats import StreamStats, samples_for, extend_rolling_mean
+from .scheduler import AcquisitionScheduler
+
+
+RING_POLL_PERIOD = 0.2     # Seconds between reads of a shared ring by a reader process
+
+
+class Stream:
+    """Live buffer, statistics and publisher of one channel of one source."""
+
+    def __init__(self, source, channel, sample_rate, calibration, settings, lock, filter_chain=None):
+        self.source = source
+        self.channel = channel
+        self.name = f'{source}/{channel}'
+        self.calibration = calibration
+        self.rolling_average = settings['rolling_average']
+        self.lock = lock
+        length = max(samples_for(settings['history_seconds'], sample_rate), settings['plot_window'])
+        self.live_data = RingBuffer(length)
+        self.rolling_data = RingBuffer(length)
+        # The pressure and its averages follow the filtered series when there is a filter
+        self.filter_chain = filter_chain
+        if filter_chain:
+            sample_rate = filter_chain.output_rate
+            self.filtered_data = RingBuffer(max(samples_for(settings['history_seconds'], sample_rate),
+                                                self.rolling_average))
+        else:
+            self.filtered_data = self.live_data
+        self.pressure_stats = StreamStats(
+            windows={f'{self.rolling_average}_samples': self.rolling_average,
+                     **{name: samples_for(seconds, sample_rate) for name, seconds in settings['windows'].items()}},
+            emas={name: samples_for(seconds, sample_rate) for name, seconds in settings['emas'].items()})
+        self.publisher = None
+
+    def rolling_averages(self):
+        with self.lock:
+            return {name: float(mean[0]) for name, mean in self.pressure_stats.means().items()}
+
+    def pressures(self, volts):
+        return get_pressure(volts * 1000, unit='Torr', calibration=self.calibration)
+
+    def update(self, timestamps, volts):
+        if self.filter_chain:
+            filtered_times, filtered = self.filter_chain.apply(timestamps, volts)
+            filtered = filtered[0]
+        else:
+            filtered_times, filtered = timestamps, volts
+        pressures = self.pressures(filtered)
+        with self.lock:
+            self.live_data.extend(timestamps, volts)
+            if self.filter_chain:
+                self.filtered_data.extend(filtered_times, filtered)
+            self.pressure_stats.update(pressures)
+            extend_rolling_mean(self.rolling_data, self.filtered_data, filtered_times, self.rolling_average)
+        if self.publisher and len(filtered):
+            self.publisher.submit(pressures, filtered_times[-1])
+
+
+class Logger:
+    """Opens the configured sources on start() and runs them until stop()."""
+
+    def __init__(self, config, consumer=None, rings=None, metrics=None):
+        self.config = config
+        self.consumer = consumer    # Called with every block in its source's thread, instead of the pipeline
+        self.rings = rings          # Source name -> RingTail, read instead of the hardware
+        acquisition = config['acquisition']
+        self.simulate = acquisition.getboolean('simulate')
+        self.settings = {
+            'history_seconds': acquisition.getfloat('history_seconds'),
+            'rolling_average': acquisition.getint('rolling_average'),
+            'windows': name_values(acquisition.get('pressure_windows')),
+            'emas': name_values(acquisition.get('pressure_emas')),
+            'plot_window': config['dash'].getint('plot_window'),
+        }
+        self.lock = threading.Lock()    # Taken by the merge thread and by readers of the buffers
+        self.streams = {}               # (source, channel) -> Stream, in display order
+        self.calibrations = {}          # (source, channel) -> calibration name
+        self.scheduler = None
+        self.csv_writer = None
+        self.recording_writers = {}
+        self.alarms = None
+        self.metrics = metrics  # instrumentation.PipelineMetrics, made on start() when Prometheus is enabled
+        self.metrics_pusher = None   # Pushes the metrics alone where no stream publishes them
+        self.profiler = None
+        self.started = None
+        self._connections = {}
+        self._hat_readers = []
+
+    # =========================
+    # Start and stop
+    # =========================
+    def start(self):
+        load_calibration_dir(optional(self.config['calibration'].get('directory')))
+        self.started = datetime.datetime.now().strftime('%Y-%m-%d_%H_%M_%S')
+        self._open_metrics()
+        consumer = self._handle_block if self.consumer is None else lambda block: None
+        settings = self.config['instrumentation']
+        profiler = optional(settings.get('profiler'))
+        self.profiler = make_profiler(profiler, settings.get('profile_file'), func=consumer)
+        if profiler == 'cprofile':
+            consumer = self.profiler
+        self.scheduler = AcquisitionScheduler(consumer, max_lateness=self.config['acquisition'].getfloat('max_lateness'),
+                                              metrics=self.metrics)
+        self._open_csv()
+        self._open_alarms()
+        for source in fluke_sources(self.config):
+            self._add_fluke(source)
+        if self.config['mcc128'].getboolean('enable'):
+            self._add_mcc128()
+        self._open_publishers()
+        if self.profiler:
+            self.profiler.start()
+            write_on_signal(self.profiler)
+        self.scheduler.start()
+
+    def stop(self, timeout=5):
+        if self.scheduler:
+            self.scheduler.stop(timeout=timeout)
+        for stream in self.streams.values():
+            if stream.publisher:
+                stream.publisher.stop(timeout=15)
+        if self.metrics_pusher:
+            self.metrics_pusher.stop(timeout=15)
+        if self.csv_writer:
+            self.csv_writer.close()
+        for writer in self.recording_writers.values():
+            writer.close()
+        for reader in self._hat_readers:
+            reader.stop()
+        for mult, lock in self._connections.values():
+            mult.reset()
+            mult.flush()
+        if self.profiler:
+            self.profiler.stop(timeout=timeout)
+
+    def is_alive(self):
+        return self.scheduler is not None and self.scheduler.is_alive()
+
+    def join(self, timeout=None):
+        self.scheduler.join(timeout)
+
+    def stats(self):
+        return self.scheduler.stats() if self.scheduler else {}
+
+    # =========================
+    # Sources
+    # =========================
+    def _add_stream(self, source, channel, sample_rate, calibration, filter_chain=None):
+        self.calibrations[source, channel] = calibration
+        if self.consumer is None:
+            self.streams[source, channel] = Stream(source, channel, sample_rate, calibration, self.settings, self.lock,
+                                                   filter_chain)
+
+    def _add_source(self, name, read_block, period):
+        if self.rings is not None:
+            self.scheduler.add_source(name, self.rings[name].read_block, RING_POLL_PERIOD)
+        else:
+            self.scheduler.add_source(name, self._checked(read_block), period)
+
+    def _add_fluke(self, source):
+        self._add_stream(source['name'], source['mode'], 1 / source['period'], source['calibration'])
+        self._open_recording(source['name'], [source['mode']],
+                             {'source': 'fluke3000', 'port': source['port'], 'mode': source['mode'],
+                              'calibration': source['calibration'], 'sample_period': source['period']})
+        if self.rings is not None:
+            self._add_source(source['name'], None, None)
+            return
+        from .readings import FlukeReader, open_fluke3000
+        # One serial connection (and lock) per port, modules sharing a port take turns on it
+        if source['port'] not in self._connections:
+            self._connections[source['port']] = (open_fluke3000(source['port'], source['baud'], simulate=self.simulate,
+                                                                metrics=self.metrics), threading.Lock())
+        mult, lock = self._connections[source['port']]
+        reader = FlukeReader(mult, source['mode'], source=source['name'], lock=lock, metrics=self.metrics)
+        self._add_source(source['name'], reader.read_block, source['period'])
+
+    def _add_mcc128(self):
+        settings = self.config['mcc128']
+        channels = int_list(settings.get('channels'))
+        scan_rate = settings.getfloat('scan_rate')
+        calibrations = name_values(settings.get('calibrations'), str)
+        names = [f'CH{channel}' for channel in channels]
+        for channel, name in zip(channels, names):
+            # One filter per channel, each carries its own state
+            self._add_stream('mcc128', name, scan_rate, calibrations.get(str(channel), DEFAULT_CALIBRATION),
+                             make_filter(optional(settings.get('filter')), scan_rate, settings.getfloat('output_rate'),
+                                         despike=settings.getint('despike')))
+        metadata = {'source': 'mcc128', 'channels': channels, 'scan_rate': scan_rate, 'calibrations': calibrations}
+        if self.rings is not None:
+            self._open_recording('mcc128', names, metadata)
+            self._add_source('mcc128', None, None)
+            return
+
+        if self.simulate:
+            from .simulated import mcc128, OptionFlags, HatIDs, AnalogInputMode, AnalogInputRange, select_hat_device
+        else:
+            from daqhats import mcc128, OptionFlags, HatIDs, AnalogInputMode, AnalogInputRange
+            from .mcc128_reader import select_hat_device
+        from .mcc128_reader import AdaptiveHatReader
+
+        address = select_hat_device(HatIDs.MCC_128)
+        hat = mcc128(address)
+        hat.a_in_mode_write(AnalogInputMode.SE)
+        hat.a_in_range_write(AnalogInputRange.BIP_10V)
+
+        reader = AdaptiveHatReader(hat, channels, scan_rate, OptionFlags.CONTINUOUS,
+                                   buffer_seconds=settings.getfloat('buffer_seconds'),
+                                   max_restarts=optional(settings.get('max_restarts'), int), metrics=self.metrics)
+        reader.start()
+        self._hat_readers.append(reader)
+        self._open_recording('mcc128', names, {**metadata, 'address': address})
+        self._add_source('mcc128', reader.read_block, lambda: reader.period)
+
+    # =========================
+    # Outputs
+    # =========================
+    def _open_csv(self):
+        settings = self.config['csv']
+        if not settings.getboolean('enable'):
+            return
+        from .csv_writer import BufferedCsvWriter
+        self.csv_writer = BufferedCsvWriter(settings.get('prefix'), directory=settings.get('directory'),
+                                            header=('Time', 'Source', 'Channel', 'Voltage'),
+                                            flush_rows=settings.getint('flush_rows'),
+                                            flush_interval=settings.getfloat('flush_interval'),
+                                            rotate_bytes=optional(settings.get('rotate_bytes'), int),
+                                            rotate_daily=settings.getboolean('rotate_daily'),
+                                            compress=settings.getboolean('compress'), epoch_times=True,
+                                            time_decimals=settings.getint('time_decimals'))
+
+    def _open_recording(self, source, channels, metadata):
+        settings = self.config['recording']
+        if not settings.getboolean('enable'):
+            return
+        from .recording import RecordingWriter
+        os.makedirs(settings.get('directory'), exist_ok=True)
+        path = os.path.join(settings.get('directory'), f"{settings.get('prefix')}-{source}-{self.started}.flk")
+        self.recording_writers[source] = RecordingWriter(path, channels=channels, metadata=metadata)
+
+    def _open_publishers(self):
+        settings = self.config['prometheus']
+        if not settings.getboolean('enable'):
+            return
+        from .prometheus_publisher import PrometheusPublisher, RegistryPusher
+        if self.metrics is not None and not self.streams:
+            # The acquisition process of --processes has no streams, its read, jitter and loss metrics
+            # are pushed as their own group
+            self.metrics_pusher = RegistryPusher(gateway=settings.get('pushgateway'),
+                                                 interval=settings.getfloat('interval'),
+                                                 registry=self.metrics.registry,
+                                                 grouping_key={'process': 'acquisition'})
+            self.metrics_pusher.start()
+        for index, stream in enumerate(self.streams.values()):
+            # Each stream is pushed as its own group (gauge=<source>/<channel>), the pipeline metrics with the first
+            stream.publisher = PrometheusPublisher(gateway=settings.get('pushgateway'),
+                                                   interval=settings.getfloat('interval'),
+                                                   max_queue=settings.getint('queue_size'),
+                                                   rolling_averages=stream.rolling_averages,
+                                                   grouping_key={'gauge': stream.name},
+                                                   registry=self.metrics.registry if self.metrics and not index
+                                                   else None)
+            stream.publisher.start()
+
+    def _open_metrics(self):
+        if self.metrics is not None or not (self.config['prometheus'].getboolean('enable')
+                and self.config['instrumentation'].getboolean('pipeline_metrics')):
+            return
+        from .instrumentation import PipelineMetrics
+        self.metrics = PipelineMetrics()
+
+    def _open_alarms(self):
+        rules = alarm_rules(self.config)
+        if not rules:
+            return
+        from .alarms import AlarmEngine, WebhookAction, log_action
+        webhook = optional(self.config['alarms'].get('webhook'))
+        self.alarms = AlarmEngine(rules, [log_action] + ([WebhookAction(webhook)] if webhook else []))
+
+    # =========================
+    # Blocks
+    # =========================
+    def _checked(self, read_block):
+        # Alarms and the consumer run in the source's own thread, before the block waits in the merge
+        if not self.alarms and self.consumer is None:
+            return read_block
+        def read_and_check():
+            sample_block = read_block()
+            if sample_block is not None and len(sample_block.timestamps):
+                if self.alarms:
+                    with stage_timer(self.metrics, 'alarms'):
+                        pressures = np.array([get_pressure(sample_block.values[row] * 1000, unit='Torr',
+                                                           calibration=self.calibrations[sample_block.source, channel])
+                                              for row, channel in enumerate(sample_block.channels)]
+                                             ) if self.alarms.needs_pressure else None
+                        self.alarms.check(sample_block, pressures)
+                if self.consumer is not None:
+                    self.consumer(sample_block)
+            return sample_block
+        return read_and_check
+
+    def _handle_block(self, sample_block):
+        # Called by the scheduler's merge thread, blocks arrive ordered by timestamp
+        timestamps = sample_block.timestamps
+        with stage_timer(self.metrics, 'streams'):
+            for row, channel in enumerate(sample_block.channels):
+                self.streams[sample_block.source, channel].update(timestamps, sample_block.values[row])
+        if self.csv_writer:
+            with stage_timer(self.metrics, 'csv'):
+                times = timestamps.tolist()
+                self.csv_writer.write_rows([t, sample_block.source, channel, str(value)]
+                                           for row, channel in enumerate(sample_block.channels)
+                                           for t, value in zip(times, sample_block.values[row].tolist()))
+        if sample_block.source in self.recording_writers:
+            with stage_timer(self.metrics, 'recording'):
+                self.recording_writers[sample_block.source].append(timestamps, sample_block.values)
@@ -0,0 +1,234 @@
+# MCC 128 scan block helpers
+#
+# a_in_scan_read() returns every channel interleaved in one flat list
+# (ch0, ch1, ch2, ch3, ch0, ch1, ...). These helpers turn that into one NumPy
+# array per channel without touching the samples one by one, and rebuild the
+# time of every sample from the scan clock instead of the time of the read.
+
+import time
+import numpy as np
+from .readings import mcc128_block
+from .timestamps import monotonic, monotonic_to_epoch
+
+
+READ_ALL_AVAILABLE = -1
+
+
+def deinterleave(data, num_channels):
+    # Returns a (num_channels, samples_per_channel) float64 array, each row is a view
+    samples = np.asarray(data, dtype=np.float64)
+    samples_per_channel = samples.size // num_channels
+    samples = samples[:samples_per_channel * num_channels]
+    return samples.reshape(samples_per_channel, num_channels).T
+
+def select_hat_device(filter_by_id):
+    # Address of the first HAT of that type, what daqhats_utils (shipped with the daqhats examples, not the library) does
+    from daqhats import hat_list, HatError
+    hats = hat_list(filter_by_id=filter_by_id)
+    if not hats:
+        raise HatError(0, 'No HAT devices found')
+    if len(hats) > 1:
+        print(f"[mcc128] {len(hats)} HATs found, using address {hats[0].address}")
+    return hats[0].address
+
+def read_block(hat, num_channels, read_request_size=READ_ALL_AVAILABLE, timeout=5.0):
+    # Reads everything buffered so far, returns (read_result, block)
+    read_result = hat.a_in_scan_read(read_request_size, timeout)
+    return read_result, deinterleave(read_result.data, num_channels)
+
+
+# =========================
+# Sample Timing
+# =========================
+class ScanClock:
+    """Per-sample monotonic times of a continuous scan: start time plus sample index over the scan rate.
+
+    The HAT's oscillator and the host clock drift apart slowly. Every read gives
+    one bound: the newest sample cannot be later than the read. Once per window
+    the smallest gap between read time and stamped time is steered to zero by
+    adjusting the sample period (proportional for the offset, integral for the
+    drift), re-anchored at the last stamped sample so times stay continuous.
+    """
+
+    def __init__(self, scan_rate, start=None, window=10.0, gain=0.5, drift_gain=0.1, max_correction=1e-3):
+        self.scan_rate = float(scan_rate)
+        self.window = window                    # Seconds of reads per correction step
+        self.gain = gain
+        self.drift_gain = drift_gain
+        self.max_correction = max_correction    # Largest relative change of the sample period (1e-3 = 1000 ppm)
+        self.samples = 0                        # Samples per channel stamped so far
+        self.drift = 0.0                        # Estimated relative error of the nominal sample period
+        self.offset = None                      # Last window's smallest read-minus-sample gap, seconds
+        self._nominal_period = 1.0 / self.scan_rate
+        self._period = self._nominal_period
+        self._anchor_index = 0
+        self._anchor_time = monotonic() if start is None else start
+        self._window_start = self._anchor_time
+        self._window_min = None
+
+    def stamp(self, count, read_time=None):
+        # Monotonic times of the next `count` samples per channel; read_time is when their read completed.
+        # Kept off the wall clock so a system time step does not get steered in over hours.
+        index = np.arange(self.samples, self.samples + count)
+        times = self._anchor_time + (index - self._anchor_index) * self._period
+        self.samples += count
+        if count:
+            read_time = monotonic() if read_time is None else read_time
+            gap = read_time - times[-1]
+            self._window_min = gap if self._window_min is None else min(self._window_min, gap)
+            if read_time - self._window_start >= self.window:
+                self._correct(times[-1], read_time)
+        return times
+
+    def time_of(self, index):
+        return self._anchor_time + (np.asarray(index) - self._anchor_index) * self._period
+
+    def _correct(self, last_time, read_time):
+        elapsed = read_time - self._window_start
+        self.offset = self._window_min
+        # A positive gap means the samples were stamped too early: lengthen the period
+        error = self.offset / elapsed
+        self.drift = float(np.clip(self.drift + self.drift_gain * error, -self.max_correction, self.max_correction))
+        correction = np.clip(self.drift + self.gain * error, -self.max_correction, self.max_correction)
+        self._period = self._nominal_period * (1 + correction)
+        self._anchor_index = self.samples - 1
+        self._anchor_time = last_time
+        self._window_start = read_time
+        self._window_min = None
+
+
+# =========================
+# Scheduler Source
+# =========================
+class Mcc128Reader:
+    """Reads the blocks of a running continuous scan as SampleBlocks, for use as a scheduler source."""
+
+    def __init__(self, hat, channels, scan_rate, read_request_size=READ_ALL_AVAILABLE, timeout=5.0, source='mcc128',
+                 start=None, metrics=None):
+        # Create it right after a_in_scan_start, or pass the timestamps.monotonic() the scan started at as start
+        self.hat = hat
+        self.channels = list(channels)
+        self.clock = ScanClock(hat.a_in_scan_actual_rate(len(self.channels), scan_rate), start)
+        self.read_request_size = read_request_size
+        self.timeout = timeout
+        self.source = source
+        self.metrics = metrics  # Optional instrumentation.PipelineMetrics
+
+    def _read(self, read_request_size):
+        if not self.metrics:
+            return read_block(self.hat, len(self.channels), read_request_size, self.timeout)
+        start = time.perf_counter()
+        read_result, block = read_block(self.hat, len(self.channels), read_request_size, self.timeout)
+        self.metrics.read_seconds.labels(source=self.source).observe(time.perf_counter() - start)
+        self.metrics.read_samples.labels(source=self.source).observe(block.shape[1])
+        if read_result.hardware_overrun or read_result.buffer_overrun:
+            self.metrics.overruns.labels(source=self.source).inc()
+        return read_result, block
+
+    def read_block(self):
+        # None on a scan overrun, the scan has stopped and the source is finished
+        read_result, block = self._read(self.read_request_size)
+        if read_result.hardware_overrun or read_result.buffer_overrun:
+            kind = 'Hardware' if read_result.hardware_overrun else 'Buffer'
+            print(f"[{self.source}] {kind} overrun, scan stopped")
+            return None
+        times = self.clock.stamp(block.shape[1], monotonic())
+        return mcc128_block(block, monotonic_to_epoch(times), self.channels, self.source, monotonic=times)
+
+
+# =========================
+# Adaptive Reader
+# =========================
+DEFAULT_SCAN_BUFFER = 10000     # Samples per channel the driver allocates at least for a continuous scan
+
+class AdaptiveHatReader(Mcc128Reader):
+    """Owns a continuous scan: sizes its buffer and read period, and restarts the scan after an overrun.
+
+    The buffer holds `buffer_seconds` of samples and reads are spaced so that a
+    read normally finds it `target_fill` full. A read that finds it fuller halves
+    the period, an emptier one lets it grow again. After an overrun the buffer
+    is doubled, the scan restarted and the lost stretch recorded in `gaps`.
+    """
+
+    def __init__(self, hat, channels, scan_rate, options, buffer_seconds=2.0, max_buffer_seconds=30.0,
+                 target_fill=0.25, min_period=0.005, max_period=1.0, max_restarts=None, timeout=5.0,
+                 source='mcc128', metrics=None):
+        super().__init__(hat, channels, scan_rate, READ_ALL_AVAILABLE, timeout, source, metrics=metrics)
+        self.scan_rate = self.clock.scan_rate
+        self.options = options
+        self.channel_mask = sum(1 << channel for channel in self.channels)
+        self.buffer_seconds = buffer_seconds
+        self.max_buffer_seconds = max_buffer_seconds
+        self.target_fill = target_fill
+        self.min_period = min_period
+        self.max_period = max_period
+        self.max_restarts = max_restarts
+        self.period = self.nominal_period()     # Seconds between reads
+        self.samples_per_channel = 0
+        self.reads = 0
+        self.overruns = 0
+        self.restarts = 0
+        self.lost_samples = 0   # Estimated samples per channel missed while the scan was down
+        self.gaps = []          # (last sample before, first sample after) epoch times of each restart
+
+    def nominal_period(self):
+        # Read period that finds the buffer target_fill full, the adaptive period never exceeds it
+        return min(max(self.buffer_seconds * self.target_fill, self.min_period), self.max_period)
+
+    def start(self):
+        self.samples_per_channel = max(int(self.scan_rate * self.buffer_seconds), DEFAULT_SCAN_BUFFER)
+        self.hat.a_in_scan_start(self.channel_mask, self.samples_per_channel, self.scan_rate, self.options)
+        self.clock = ScanClock(self.scan_rate, start=monotonic())
+
+    def stop(self):
+        self.hat.a_in_scan_stop()
+        self.hat.a_in_scan_cleanup()
+
+    def restart(self):
+        self.stop()
+        self.start()
+        self.restarts += 1
+
+    def read_block(self):
+        read_result, block = self._read(READ_ALL_AVAILABLE)
+        self.reads += 1
+        # Samples returned with an overrun are still valid, they are stamped before the restart
+        times = self.clock.stamp(block.shape[1], monotonic())
+        if read_result.hardware_overrun or read_result.buffer_overrun:
+            if not self._recover('Hardware' if read_result.hardware_overrun else 'Buffer'):
+                return None
+        else:
+            self._adapt(block.shape[1])
+        return mcc128_block(block, monotonic_to_epoch(times), self.channels, self.source, monotonic=times)
+
+    def _adapt(self, samples):
+        fill = samples / self.samples_per_channel
+        if fill > 2 * self.target_fill:
+            self.period = max(self.period / 2, self.min_period)
+        elif fill < self.target_fill / 2:
+            self.period = min(self.period * 1.25, self.nominal_period())
+
+    def _recover(self, kind):
+        # Returns False when the restart limit is reached and the source is finished
+        self.overruns += 1
+        if self.max_restarts is not None and self.restarts >= self.max_restarts:
+            print(f"[{self.source}] {kind} overrun, restart limit reached, scan stopped")
+            return False
+        last = self.clock.time_of(self.clock.samples - 1) if self.clock.samples else self.clock.time_of(0)
+        self.buffer_seconds = min(self.buffer_seconds * 2, self.max_buffer_seconds)
+        self.period = max(self.period / 2, self.min_period)
+        self.restart()
+        first = self.clock.time_of(0)
+        self.gaps.append((float(monotonic_to_epoch(last)), float(monotonic_to_epoch(first))))
+        lost = max(int((first - last) * self.scan_rate) - 1, 0)
+        self.lost_samples += lost
+        if self.metrics:
+            self.metrics.dropped_samples.labels(source=self.source).inc(lost)
+        print(f"[{self.source}] {kind} overrun, scan restarted with a {self.samples_per_channel} sample buffer, "
+              f"{first - last:.3f} s gap")
+        return True
+
+    def stats(self):
+        return {'reads': self.reads, 'overruns': self.overruns, 'restarts': self.restarts,
+                'lost_samples': self.lost_samples, 'period': self.period, 'buffer_seconds': self.buffer_seconds,
+                'drift_ppm': self.clock.drift * 1e6}
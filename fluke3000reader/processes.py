@@ -0,0 +1,184 @@
+# Multi-process mode
+#
+# Acquisition runs alone in its own process and only writes each source's
+# blocks into a shared-memory ring (shared_ring.py). The recorder (CSV and
+# recordings), the metrics exporter (Prometheus) and the Dash server are
+# separate processes that attach to the rings, so figure serialization, file
+# writes and pushes never compete with the sampler for the GIL, and a slow
+# reader only loses its own oldest samples.
+#
+#   fluke3000reader run -c logger.ini --processes
+
+import configparser
+import io
+import multiprocessing
+import os
+import signal
+import threading
+from collections import namedtuple
+from .config import fluke_sources, int_list
+from .readings import FLUKE_MODE_UNITS
+from .rolling_stats import samples_for
+
+
+# One shared ring per source
+RingSpec = namedtuple('RingSpec', ['source', 'channels', 'unit', 'capacity', 'name'])
+
+# What the Dash app reads from a Logger, here straight from the rings
+RingStream = namedtuple('RingStream', ['name', 'live_data'])
+RingStreams = namedtuple('RingStreams', ['streams', 'lock'])
+
+
+def ring_specs(config, prefix):
+    # Every process derives the same layout from the config
+    seconds = config['acquisition'].getfloat('history_seconds')
+    plot_window = config['dash'].getint('plot_window')
+    specs = []
+    for source in fluke_sources(config):
+        specs.append(RingSpec(source['name'], [source['mode']], FLUKE_MODE_UNITS[source['mode']][0],
+                              max(samples_for(seconds, 1 / source['period']), plot_window),
+                              f"{prefix}_{len(specs)}"))
+    if config['mcc128'].getboolean('enable'):
+        settings = config['mcc128']
+        specs.append(RingSpec('mcc128', [f'CH{channel}' for channel in int_list(settings.get('channels'))], 'V',
+                              max(samples_for(seconds, settings.getfloat('scan_rate')), plot_window),
+                              f"{prefix}_{len(specs)}"))
+    return specs
+
+def role_config(config, role):
+    # Copy of the config with only the outputs of one process switched on
+    copy = load_config_text(config_text(config))
+    # Prometheus in the acquisition process pushes only its own pipeline metrics, the pressures come from `metrics`
+    outputs = {'acquisition': ('prometheus',), 'recorder': ('csv', 'recording'), 'metrics': ('prometheus',),
+               'dash': ('dash',)}
+    for section in ('csv', 'recording', 'prometheus', 'dash'):
+        copy[section]['enable'] = str(section in outputs[role] and config[section].getboolean('enable')).lower()
+    if role != 'acquisition':
+        # Alarms stay next to the hardware, where they are fastest
+        for section in copy.sections():
+            if section.startswith('alarm:'):
+                copy.remove_section(section)
+    return copy
+
+def config_text(config):
+    text = io.StringIO()
+    config.write(text)
+    return text.getvalue()
+
+def load_config_text(text):
+    # config_text() writes every section in full, no defaults to merge
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_string(text)
+    return config
+
+def attach(specs):
+    from .shared_ring import SharedRing
+    return {spec.source: SharedRing(spec.name) for spec in specs}
+
+
+# =========================
+# Processes
+# =========================
+def _ignore_interrupt():
+    # Ctrl-C reaches the whole process group, the supervisor decides when children stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def acquisition_main(text, specs, stop_event):
+    _ignore_interrupt()
+    from .logger import Logger
+    rings = attach(specs)
+    logger = Logger(role_config(load_config_text(text), 'acquisition'),
+                    consumer=lambda block: rings[block.source].extend(block.timestamps, block.values))
+    logger.start()
+    while logger.is_alive() and not stop_event.wait(0.5):
+        pass
+    logger.stop()
+    for ring in rings.values():
+        ring.close_writer()
+        ring.close()
+
+def reader_main(role, text, specs, stop_event):
+    _ignore_interrupt()
+    from .logger import Logger
+    from .shared_ring import RingTail
+    rings = attach(specs)
+    tails = {spec.source: RingTail(rings[spec.source], spec.source, spec.channels, spec.unit) for spec in specs}
+    logger = Logger(role_config(load_config_text(text), role), rings=tails)
+    logger.start()
+    # Runs until the acquisition process has closed the rings and everything is read
+    while logger.is_alive():
+        logger.join(0.5)
+    logger.stop()
+    lost = {source: tail.lost for source, tail in tails.items() if tail.lost}
+    print(f"[{role}] Stopped. {f'Samples lost: {lost}' if lost else ''}")
+    for ring in rings.values():
+        ring.close()
+
+def dash_main(text, specs):
+    _ignore_interrupt()
+    from .dashboard import create_app
+    config = load_config_text(text)
+    rings = attach(specs)
+    streams = {(spec.source, channel): RingStream(f'{spec.source}/{channel}', rings[spec.source].channel(row))
+               for spec in specs for row, channel in enumerate(spec.channels)}
+    settings = config['dash']
+    app = create_app(RingStreams(streams, threading.Lock()), refresh=settings.getfloat('refresh'),
+                     plot_window=settings.getint('plot_window'),
+                     archive_directory=settings.get('archive').strip() or None, stream=settings.getboolean('stream'))
+    app.run(host=settings.get('host'), port=settings.getint('port'), debug=False)
+
+
+# =========================
+# Supervisor
+# =========================
+def run_processes(config):
+    from .shared_ring import SharedRing
+    context = multiprocessing.get_context('spawn')
+    specs = ring_specs(config, f"fkr{os.getpid()}")
+    rings = {spec.source: SharedRing(spec.name, spec.capacity, len(spec.channels), create=True) for spec in specs}
+    text = config_text(config)
+    stop_event = context.Event()
+
+    acquisition = context.Process(target=acquisition_main, args=(text, specs, stop_event), name='acquisition')
+    readers = []
+    if config['csv'].getboolean('enable') or config['recording'].getboolean('enable'):
+        readers.append(context.Process(target=reader_main, args=('recorder', text, specs, stop_event), name='recorder'))
+    if config['prometheus'].getboolean('enable'):
+        readers.append(context.Process(target=reader_main, args=('metrics', text, specs, stop_event), name='metrics'))
+    # Daemonic, so that it goes with the supervisor whichever way that exits
+    dash_process = context.Process(target=dash_main, args=(text, specs), name='dash', daemon=True) \
+        if config['dash'].getboolean('enable') else None
+
+    started = []
+    try:
+        # Readers attach first so they see the rings from the first sample on
+        for process in readers + ([dash_process] if dash_process else []) + [acquisition]:
+            process.start()
+            started.append(process)
+        acquisition.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        if acquisition in started:
+            _finish(acquisition)
+        # Closed rings let the readers drain what is left and exit
+        for ring in rings.values():
+            ring.close_writer()
+        for process in started:
+            if process is dash_process:
+                process.terminate()
+            _finish(process)
+        for ring in rings.values():
+            ring.close()
+    print("Data acquisition stopped.")
+
+def _finish(process):
+    # Waits for a child to exit, another Ctrl-C meanwhile terminates it instead of leaving it behind
+    try:
+        process.join()
+    except KeyboardInterrupt:
+        pass
+    if process.is_alive():
+        process.terminate()
+        process.join()
@@ -0,0 +1,111 @@
+# Profiler hooks
+#
+# Two ways to see where a running logger spends its time, without a debugger:
+#
+#   SamplingProfiler   looks at the stack of every thread every few ms and
+#                      counts them; next to no overhead, fine to leave on.
+#                      Writes collapsed stacks ("thread;file:func;... count"),
+#                      the input of flamegraph.pl and speedscope.
+#   CallProfiler       cProfile around every call of one function, e.g. the
+#                      sampler's acquire(); exact call counts and times, pstats
+#                      file readable with `python -m pstats`.
+#
+# Both write their file on stop(), and on SIGUSR1 while running where the
+# platform has it.
+
+import cProfile
+import os
+import signal
+import sys
+import threading
+from collections import Counter
+
+
+class SamplingProfiler(threading.Thread):
+    """Counts the stacks of all other threads every `interval` seconds."""
+
+    def __init__(self, path, interval=0.005):
+        super().__init__(name='sampling-profiler', daemon=True)
+        self.path = path
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(';'.join([names.get(ident, str(ident))] + calls[::-1]))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def write(self):
+        with self._lock:
+            lines = [f"{stack} {count}\n" for stack, count in self._stacks.most_common()]
+        with open(self.path, 'w') as f:
+            f.writelines(lines)
+        print(f"[profiler] {self.samples} samples written to {self.path}")
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.write()
+
+
+class CallProfiler:
+    """Wraps `func` so that every call runs under one accumulating cProfile.Profile."""
+
+    def __init__(self, func, path):
+        self.func = func
+        self.path = path
+        self.calls = 0
+        self._profile = cProfile.Profile()
+        self._lock = threading.Lock()   # A Profile can only be enabled in one thread at a time
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self._profile.enable()
+            try:
+                return self.func(*args, **kwargs)
+            finally:
+                self._profile.disable()
+
+    def start(self):
+        pass
+
+    def write(self):
+        with self._lock:
+            self._profile.dump_stats(self.path)
+        print(f"[profiler] {self.calls} calls written to {self.path}")
+
+    def stop(self, timeout=None):
+        self.write()
+
+
+def make_profiler(kind, path, func=None, interval=0.005):
+    # 'sampling' profiles every thread, 'cprofile' wraps func; None when profiling is off
+    if not kind:
+        return None
+    if kind == 'sampling':
+        return SamplingProfiler(path, interval)
+    if kind == 'cprofile':
+        return CallProfiler(func, path)
+    raise ValueError(f"Unknown profiler {kind!r}, expected 'sampling' or 'cprofile'")
+
+def write_on_signal(profiler, signum=getattr(signal, 'SIGUSR1', None)):
+    # `kill -USR1 <pid>` writes the profile so far; signal handlers can only be set from the main thread
+    if signum is not None and threading.current_thread() is threading.main_thread():
+        signal.signal(signum, lambda *args: profiler.write())
@@ -0,0 +1,145 @@
+# Background Prometheus publishing
+#
+# Acquisition only drops pressure blocks into a bounded queue. A separate thread
+# folds them into the metrics and pushes to the Pushgateway (with retry and
+# backoff), or serves them for scraping when a pull port is configured. When
+# the backend is slow or down the oldest blocks are dropped, sampling never waits.
+# RegistryPusher is the pushing part alone, for a registry that holds no
+# pressures (the acquisition process of --processes).
+
+from collections import deque
+import threading
+import time
+import numpy as np
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, push_to_gateway, start_http_server
+
+
+# Ion pump range, half-decade buckets from 1e-11 to 1e-3 Torr
+PRESSURE_BUCKETS = tuple(float(f'{b:.3g}') for b in np.logspace(-11, -3, 17))
+
+
+class RegistryPusher(threading.Thread):
+    """Pushes a registry every `interval` seconds, or serves it for scraping, with retry and backoff."""
+
+    def __init__(self, gateway=None, job='voltmeter', http_port=None, interval=15, max_backoff=300, registry=None,
+                 grouping_key=None, name='prometheus-pusher'):
+        super().__init__(name=name, daemon=True)
+        if gateway is None and http_port is None:
+            raise ValueError("Give a Pushgateway address, an HTTP port for pull mode, or both")
+        self.gateway = gateway
+        self.job = job
+        self.grouping_key = grouping_key or {}     # Extra Pushgateway grouping labels, e.g. one group per gauge
+        self.http_port = http_port
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.registry = registry if registry is not None else CollectorRegistry()
+        self.counter_push_failures = Counter('publisher_push_failures', 'Failed Pushgateway pushes', registry=self.registry)
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._backoff = 0
+        self._next_push = 0
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self._wakeup.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        if self.http_port is not None:
+            start_http_server(self.http_port, registry=self.registry)
+            print(f"[Prometheus] Serving metrics on port {self.http_port}")
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.interval)
+            self.publish()
+        self.publish()  # Last values on shutdown
+
+    def publish(self):
+        # Pushes unless backing off, True when the registry went out or is only scraped
+        if self.gateway is None:
+            return True
+        if time.monotonic() < self._next_push:
+            return False
+        return self._push()
+
+    def _push(self):
+        try:
+            push_to_gateway(self.gateway, job=self.job, registry=self.registry, grouping_key=self.grouping_key,
+                            timeout=10)
+            self._backoff = 0
+            return True
+        except Exception as e:
+            # Metrics keep accumulating in the registry, the next successful push carries them
+            self.counter_push_failures.inc()
+            self._backoff = min(max(2 * self._backoff, self.interval), self.max_backoff)
+            self._next_push = time.monotonic() + self._backoff
+            print(f"[Prometheus] Push to {self.gateway} failed ({e!r}), retrying in {self._backoff:.0f} s")
+            return False
+
+
+class PrometheusPublisher(RegistryPusher):
+    """Publishes pressure readings every `interval` seconds without blocking the caller."""
+
+    def __init__(self, gateway=None, job='voltmeter', http_port=None, interval=15, max_queue=1000,
+                 max_backoff=300, registry=None, rolling_averages=None, grouping_key=None):
+        super().__init__(gateway, job, http_port, interval, max_backoff, registry, grouping_key,
+                         name='prometheus-publisher')
+        self.rolling_averages = rolling_averages    # Optional callable returning {window: value}
+
+        self.gauge_avg = Gauge('pressure_list', 'Average Reading from Voltmeter', registry=self.registry)
+        self.gauge_measurement_rate = Gauge('measurement_rate', 'Measurement Rate from Fluke Meter', registry=self.registry)
+        self.gauge_last_reading = Gauge('last_reading_timestamp_seconds', 'Epoch time of the newest published reading',
+                                        registry=self.registry)
+        self.gauge_rolling_avg = Gauge('pressure_rolling_avg', 'Rolling Average Pressure', ['window'], registry=self.registry)
+        self.histogram_pressure = Histogram('pressure', 'Distribution of pressure readings', buckets=PRESSURE_BUCKETS,
+                                            registry=self.registry)
+        self.counter_dropped = Counter('publisher_dropped_blocks', 'Pressure blocks dropped because the publish queue was full',
+                                       registry=self.registry)
+
+        self._queue = deque(maxlen=max_queue)
+        self._last_publish = time.monotonic()
+
+    # =========================
+    # Acquisition Side
+    # =========================
+    def submit(self, pressures, timestamp=None):
+        # O(1) and never blocks, a full queue silently drops its oldest block.
+        # timestamp is the epoch stamp of the newest reading in the block.
+        if len(self._queue) == self._queue.maxlen:
+            self.counter_dropped.inc()
+        self._queue.append((np.array(pressures, dtype=np.float64).ravel(), timestamp))
+
+    # =========================
+    # Publisher Thread
+    # =========================
+    def publish(self):
+        blocks = []
+        newest = None
+        while self._queue:
+            pressures, timestamp = self._queue.popleft()
+            blocks.append(pressures)
+            if timestamp is not None:
+                newest = timestamp if newest is None else max(newest, timestamp)
+        now = time.monotonic()
+        elapsed = now - self._last_publish
+        self._last_publish = now
+
+        readings = np.concatenate(blocks) if blocks else np.empty(0)
+        readings = readings[np.isfinite(readings)]     # Without the NaN gap markers
+        if newest is not None:
+            self.gauge_last_reading.set(newest)
+        if readings.size:
+            self.gauge_avg.set(float(readings.mean()))
+            for value in readings.tolist():
+                self.histogram_pressure.observe(value)
+        # Rate over the time that actually passed, not the nominal interval
+        measurement_rate = readings.size / elapsed if elapsed > 0 else 0.0
+        self.gauge_measurement_rate.set(measurement_rate)
+        if self.rolling_averages is not None:
+            for window, value in self.rolling_averages().items():
+                self.gauge_rolling_avg.labels(window=window).set(value)
+
+        sent = super().publish()
+        if sent and readings.size:
+            print(f"[Prometheus] Data Sent: Avg = {readings.mean():.2e} Torr | Total Readings = {readings.size} "
+                  f"| Measurement Rate = {measurement_rate:.2f} Hz")
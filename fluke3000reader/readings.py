@@ -0,0 +1,103 @@
+# Typed readings shared by every source
+#
+# Both the Fluke3000 and the MCC128 produce SampleBlock records: timestamps and
+# one row of SI float values per channel. Fluke readings are taken straight
+# from the quantity InstrumentKit returns, nothing goes through str() or regex.
+
+from collections import namedtuple
+import time
+import numpy as np
+from .timestamps import now_pair, epoch_to_monotonic
+
+
+# values has shape (len(channels), len(timestamps)), in `unit`. timestamps are epoch
+# seconds, monotonic the raw monotonic seconds of the same instants (None when unknown).
+SampleBlock = namedtuple('SampleBlock', ['source', 'channels', 'unit', 'timestamps', 'values', 'monotonic'],
+                         defaults=(None,))
+
+# Fluke3000.Mode name -> (SI unit, offset added to the magnitude).
+# InstrumentKit already applies the metric prefix, so magnitudes are in V, A, Hz,
+# ohm, F or degC; only temperature needs an offset to get to kelvin.
+FLUKE_MODE_UNITS = {
+    'voltage_ac': ('V', 0.0),
+    'voltage_dc': ('V', 0.0),
+    'current_ac': ('A', 0.0),
+    'current_dc': ('A', 0.0),
+    'frequency': ('Hz', 0.0),
+    'temperature': ('K', 273.15),
+    'resistance': ('Ohm', 0.0),
+    'capacitance': ('F', 0.0),
+}
+
+
+def single_sample(source, channel, unit, timestamp, value, monotonic=None):
+    return SampleBlock(source, [channel], unit, np.array([timestamp]), np.array([[value]]),
+                       None if monotonic is None else np.array([monotonic]))
+
+
+# =========================
+# Fluke3000
+# =========================
+def open_fluke3000(port, baud, simulate=False, reconnect=True, metrics=None):
+    # The meter through InstrumentKit, or simulated.SimulatedFluke3000 when no hardware is attached.
+    # With reconnect it is wrapped in a FlukeSession that reopens the port when reads keep failing.
+    from .fluke_session import FlukeSession, fluke3000_class
+    if reconnect:
+        return FlukeSession(port, baud, simulate=simulate, metrics=metrics)
+    return fluke3000_class(simulate).open_serial(port, baud)
+
+class FlukeReader:
+    """Reads one Fluke3000 mode and returns SI floats, works for every Fluke3000.Mode."""
+
+    def __init__(self, mult, mode='voltage_dc', source='fluke3000', lock=None, metrics=None):
+        self.mult = mult
+        self.mode = mult.Mode[mode] if isinstance(mode, str) else mode
+        if self.mode.name not in FLUKE_MODE_UNITS:
+            raise ValueError(f"Unsupported Fluke3000 mode {self.mode.name}")
+        self.unit, self._offset = FLUKE_MODE_UNITS[self.mode.name]
+        self.source = source
+        self.lock = lock    # Shared by readers of modules behind the same serial port
+        self.metrics = metrics
+        self._gaps_seen = len(getattr(mult, 'gaps', ()))     # Outages of a FlukeSession already marked
+
+    def read(self):
+        if self.lock is not None:
+            with self.lock:
+                quantity = self._measure()
+        else:
+            quantity = self._measure()
+        # .magnitude exists on both `quantities` and `pint` quantities; + 0.0 turns -0.0 into 0.0
+        return float(getattr(quantity, 'magnitude', quantity)) + self._offset + 0.0
+
+    def _measure(self):
+        if not self.metrics:
+            return self.mult.measure(self.mode)
+        # Time on the serial line only, not spent waiting for the port lock
+        start = time.perf_counter()
+        quantity = self.mult.measure(self.mode)
+        self.metrics.read_seconds.labels(source=self.source).observe(time.perf_counter() - start)
+        return quantity
+
+    def read_block(self):
+        # Timestamp taken when the reading has arrived, not when it was requested
+        value = self.read()
+        timestamp, monotonic = now_pair()
+        gaps = getattr(self.mult, 'gaps', ())
+        if len(gaps) > self._gaps_seen:
+            # The port was reopened since the last reading: a NaN at the start of each
+            # outage breaks the line in the graphs and shows up as a 'nan' row in the CSV
+            starts = [start for start, end in gaps[self._gaps_seen:]]
+            self._gaps_seen = len(gaps)
+            return SampleBlock(self.source, [self.mode.name], self.unit, np.array(starts + [timestamp]),
+                               np.array([[np.nan] * len(starts) + [value]]),
+                               np.append(epoch_to_monotonic(starts), monotonic))
+        return single_sample(self.source, self.mode.name, self.unit, timestamp, value, monotonic)
+
+
+# =========================
+# MCC128
+# =========================
+def mcc128_block(block, timestamps, channels, source='mcc128', monotonic=None):
+    # (channels, samples) voltage block from mcc128_reader.deinterleave -> SampleBlock
+    return SampleBlock(source, [f'CH{channel}' for channel in channels], 'V', np.asarray(timestamps), block,
+                       None if monotonic is None else np.asarray(monotonic))
@@ -0,0 +1,202 @@
+# Binary recording format
+#
+# A recording is a small JSON header followed by fixed-size records, one per
+# sample: a float64 epoch timestamp and one float32 value per channel. Writers
+# append whole blocks of records, readers memory-map the file and get NumPy
+# views of the timestamps and channels without loading or copying anything.
+#
+#   8 bytes   magic b'FLKREC01'
+#   4 bytes   header length, little-endian uint32
+#   n bytes   UTF-8 JSON header, space padded so records start on a 64 byte boundary
+#   ...       records, dtype [('time', '<f8'), ('values', '<f4', (channels,))]
+
+import atexit
+import csv
+import datetime
+import json
+import os
+import struct
+import threading
+import numpy as np
+from .timestamps import parse_local_times, format_local_times
+
+
+MAGIC = b'FLKREC01'
+FORMAT_VERSION = 1
+DATA_ALIGNMENT = 64
+
+
+def record_dtype(num_channels):
+    return np.dtype([('time', '<f8'), ('values', '<f4', (num_channels,))])
+
+
+# =========================
+# Writer
+# =========================
+class RecordingWriter:
+    """Append-only writer, samples are collected into chunks and written one chunk at a time."""
+
+    def __init__(self, path, channels=('Voltage',), chunk_samples=4096, metadata=None):
+        self.path = path
+        self.channels = list(channels)
+        self.num_channels = len(self.channels)
+        self.dtype = record_dtype(self.num_channels)
+        self.samples_written = 0
+        self._chunk = np.empty(chunk_samples, dtype=self.dtype)
+        self._fill = 0
+        self._lock = threading.Lock()
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # Continue an existing recording, its channel layout has to match
+            existing = Recording(path)
+            if existing.channels != self.channels:
+                raise ValueError(f"{path} records channels {existing.channels}, not {self.channels}")
+            data_offset = existing.data_offset
+            count = len(existing)
+            existing.close()
+            self._file = open(path, 'r+b')
+            self._file.truncate(data_offset + count * self.dtype.itemsize)  # Drop a partial last record
+            self._file.seek(0, os.SEEK_END)
+            self.samples_written = count
+        else:
+            header = {
+                'version': FORMAT_VERSION,
+                'channels': self.channels,
+                'created': datetime.datetime.now().astimezone().isoformat(),
+                'metadata': metadata or {},
+            }
+            self._file = open(path, 'wb')
+            self._file.write(_encode_header(header))
+        atexit.register(self.close)
+
+    def append(self, timestamps, values):
+        # timestamps (samples,), values (num_channels, samples) or (samples,) for one channel
+        timestamps = np.atleast_1d(np.asarray(timestamps, dtype=np.float64))
+        values = np.asarray(values, dtype=np.float32).reshape(self.num_channels, -1)
+        with self._lock:
+            start = 0
+            while start < len(timestamps):
+                take = min(len(timestamps) - start, len(self._chunk) - self._fill)
+                chunk = self._chunk[self._fill:self._fill + take]
+                chunk['time'] = timestamps[start:start + take]
+                chunk['values'] = values[:, start:start + take].T
+                self._fill += take
+                start += take
+                if self._fill == len(self._chunk):
+                    self._write_chunk()
+
+    def flush(self):
+        with self._lock:
+            self._write_chunk()
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write_chunk()
+            self._file.close()
+        atexit.unregister(self.close)
+
+    def _write_chunk(self):
+        if self._fill:
+            self._file.write(self._chunk[:self._fill].tobytes())
+            self.samples_written += self._fill
+            self._fill = 0
+
+
+def _encode_header(header):
+    text = json.dumps(header).encode('utf-8')
+    prefix = len(MAGIC) + 4
+    padded = -(-(prefix + len(text)) // DATA_ALIGNMENT) * DATA_ALIGNMENT - prefix
+    text = text.ljust(padded, b' ')
+    return MAGIC + struct.pack('<I', len(text)) + text
+
+
+# =========================
+# Reader
+# =========================
+class Recording:
+    """Memory-mapped read access, `times`, `values` and `channel()` are views into the file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a recording file")
+            header_length, = struct.unpack('<I', f.read(4))
+            self.header = json.loads(f.read(header_length).decode('utf-8'))
+        self.channels = list(self.header['channels'])
+        self.metadata = self.header.get('metadata', {})
+        self.data_offset = len(MAGIC) + 4 + header_length
+        self.dtype = record_dtype(len(self.channels))
+
+        # A record still being written by another process is left out
+        count = (os.path.getsize(path) - self.data_offset) // self.dtype.itemsize
+        if count > 0:
+            self._records = np.memmap(path, dtype=self.dtype, mode='r', offset=self.data_offset, shape=(count,))
+        else:
+            self._records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def times(self):
+        return self._records['time']
+
+    @property
+    def values(self):
+        # Shape (samples, channels)
+        return self._records['values']
+
+    def channel(self, channel):
+        if not isinstance(channel, int):
+            channel = self.channels.index(channel)
+        return self._records['values'][:, channel]
+
+    def between(self, start, end):
+        # Index slice of the samples with start <= time < end, timestamps are in acquisition order
+        times = self.times
+        return slice(int(np.searchsorted(times, start, 'left')), int(np.searchsorted(times, end, 'left')))
+
+    def close(self):
+        # The map is freed once the views handed out are gone too, closing it under them would crash their readers
+        self._records = np.empty(0, dtype=self.dtype)
+
+
+# =========================
+# CSV Conversion
+# =========================
+def csv_to_recording(csv_path, recording_path, chunk_rows=100000, metadata=None):
+    # Time,<channel>[,<channel>...] CSV (CsvWriteData layout) -> recording, parsed chunk by chunk
+    with open(csv_path, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        writer = RecordingWriter(recording_path, channels=header[1:], metadata=metadata)
+        try:
+            while True:
+                rows = [row for _, row in zip(range(chunk_rows), reader) if row]
+                if not rows:
+                    break
+                columns = np.array(rows, dtype=str).T
+                values = np.where(columns[1:] == '', 'nan', columns[1:]).astype(np.float32)
+                writer.append(parse_local_times(columns[0]), values)
+        finally:
+            writer.close()
+    return recording_path
+
+def recording_to_csv(recording_path, csv_path, chunk_rows=100000):
+    # Recording -> Time,<channel>... CSV in the CsvWriteData layout
+    recording = Recording(recording_path)
+    try:
+        with open(csv_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Time'] + recording.channels)
+            for start in range(0, len(recording), chunk_rows):
+                times = format_local_times(recording.times[start:start + chunk_rows])
+                values = recording.values[start:start + chunk_rows]
+                writer.writerows([t] + [f'{v:g}' for v in row] for t, row in zip(times, values.tolist()))
+    finally:
+        recording.close()
+    return csv_path
@@ -0,0 +1,92 @@
+# Fixed-capacity storage for the live series
+#
+# Every sample is written twice, capacity apart, so the newest N samples are
+# always one contiguous slice and can be handed out as NumPy views without
+# copying. Memory is allocated once and never grows.
+
+import numpy as np
+
+
+class RingBuffer:
+    """Timestamps plus one value row per channel, keeping the last `capacity` samples."""
+
+    def __init__(self, capacity, num_channels=1, dtype=np.float64):
+        if capacity <= 0:
+            raise ValueError("RingBuffer capacity must be positive")
+        self.capacity = int(capacity)
+        self.num_channels = int(num_channels)
+        self._times = np.zeros(2 * self.capacity, dtype=np.float64)
+        self._values = np.zeros((self.num_channels, 2 * self.capacity), dtype=dtype)
+        self._head = 0      # Next write position in [0, capacity)
+        self._count = 0     # Valid samples currently held
+        self.total = 0      # Samples appended since creation (or the last clear)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, values):
+        # values is a scalar for one channel or a sequence with one entry per channel
+        head = self._head
+        self._times[head] = self._times[head + self.capacity] = timestamp
+        self._values[:, head] = self._values[:, head + self.capacity] = values
+        self._head = (head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self.total += 1
+
+    def extend(self, timestamps, values):
+        # timestamps has shape (samples,), values has shape (num_channels, samples)
+        # or (samples,) for a single channel buffer
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values).reshape(self.num_channels, -1)
+        samples = timestamps.shape[0]
+        if values.shape[1] != samples:
+            raise ValueError("timestamps and values must hold the same number of samples")
+        if samples == 0:
+            return
+
+        # Anything older than one full buffer would be overwritten anyway
+        skipped = max(samples - self.capacity, 0)
+        if skipped:
+            timestamps = timestamps[skipped:]
+            values = values[:, skipped:]
+
+        index = (self._head + skipped + np.arange(timestamps.shape[0])) % self.capacity
+        self._times[index] = self._times[index + self.capacity] = timestamps
+        self._values[:, index] = self._values[:, index + self.capacity] = values
+        self._head = (self._head + samples) % self.capacity
+        self._count = min(self._count + samples, self.capacity)
+        self.total += samples
+
+    def latest(self, n=None):
+        # Views of the newest n samples in chronological order, valid until the next write
+        n = self._count if n is None else max(min(int(n), self._count), 0)
+        end = self._head + self.capacity
+        return self._times[end - n:end], self._values[:, end - n:end]
+
+    def latest_with_total(self, n=None):
+        # latest(n) and the total its newest sample ends at, the same call as on a SharedRing
+        times, values = self.latest(n)
+        return times, values, self.total
+
+    def latest_indices(self, n=None):
+        # Running sample numbers of the samples returned by latest(n)
+        n = self._count if n is None else max(min(int(n), self._count), 0)
+        return np.arange(self.total - n, self.total)
+
+    def snapshot(self, n=None):
+        # Copies of latest(n), safe to keep while acquisition continues
+        times, values = self.latest(n)
+        return times.copy(), values.copy()
+
+    @property
+    def first_index(self):
+        return self.total - self._count
+
+    @property
+    def last_time(self):
+        return self._times[self._head + self.capacity - 1] if self._count else None
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        self.total = 0
@@ -0,0 +1,228 @@
+# Streaming statistics over sample blocks
+#
+# Rolling windows keep running sums (mean/std) and monotonic queues (min/max),
+# so each new sample costs O(1) no matter how long the window is. A whole block
+# of samples, e.g. one MCC128 read, is folded in with a few NumPy calls.
+
+from collections import deque
+import numpy as np
+
+
+def samples_for(seconds, sample_rate):
+    # Window length in samples for a duration at a given sample rate
+    return max(int(round(seconds * sample_rate)), 1)
+
+def _as_block(values, num_channels):
+    # Accepts a scalar, a (samples,) array for one channel or a (channels, samples) block
+    return np.asarray(values, dtype=np.float64).reshape(num_channels, -1)
+
+
+# =========================
+# Rolling Window
+# =========================
+class RollingWindow:
+    """Mean, standard deviation, min and max of the last `length` samples per channel."""
+
+    def __init__(self, length, num_channels=1):
+        if length <= 0:
+            raise ValueError("RollingWindow length must be positive")
+        self.length = int(length)
+        self.num_channels = int(num_channels)
+        self._window = np.zeros((self.num_channels, self.length))
+        self._pos = 0
+        self._count = 0
+        self.total = 0
+        # Sums are taken around a per-channel reference value so the sum of
+        # squares does not lose precision on small signals with a large offset
+        self._shift = None
+        self._sum = np.zeros(self.num_channels)
+        self._sumsq = np.zeros(self.num_channels)
+        self._since_resync = 0
+        self._max_queues = [deque() for _ in range(self.num_channels)]
+        self._min_queues = [deque() for _ in range(self.num_channels)]
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def full(self):
+        return self._count == self.length
+
+    def update(self, values):
+        block = _as_block(values, self.num_channels)
+        samples = block.shape[1]
+        if samples == 0:
+            return
+        if self._shift is None:
+            self._shift = block[:, 0].copy()
+
+        self._update_extremes(block)
+
+        # Only the newest `length` samples of a long block can end up in the window
+        if samples >= self.length:
+            self._window[:] = block[:, -self.length:]
+            self._pos = 0
+            self._count = self.length
+            self._resync()
+        else:
+            evicted = max(self._count + samples - self.length, 0)
+            if evicted:
+                old = self._window[:, (self._pos - self._count + np.arange(evicted)) % self.length]
+                old = old - self._shift[:, None]
+                self._sum -= old.sum(axis=1)
+                self._sumsq -= (old * old).sum(axis=1)
+            index = (self._pos + np.arange(samples)) % self.length
+            self._window[:, index] = block
+            new = block - self._shift[:, None]
+            self._sum += new.sum(axis=1)
+            self._sumsq += (new * new).sum(axis=1)
+            self._pos = (self._pos + samples) % self.length
+            self._count = min(self._count + samples, self.length)
+
+            # Rebuild the sums from the window once per window length to cancel rounding drift
+            self._since_resync += samples
+            if self._since_resync >= self.length:
+                self._resync()
+        self.total += samples
+
+    def _resync(self):
+        valid = self._window if self.full else self._window[:, (self._pos - self._count + np.arange(self._count)) % self.length]
+        self._shift = valid.mean(axis=1)
+        centered = valid - self._shift[:, None]
+        self._sum = centered.sum(axis=1)
+        self._sumsq = (centered * centered).sum(axis=1)
+        self._since_resync = 0
+
+    def _update_extremes(self, block):
+        first = self.total
+        samples = block.shape[1]
+        oldest = first + samples - self.length   # Lowest sample number still in the window
+        for channel in range(self.num_channels):
+            row = block[channel]
+            _push_extremes(self._max_queues[channel], row, first, oldest)
+            _push_extremes(self._min_queues[channel], -row, first, oldest)
+
+    @property
+    def mean(self):
+        if not self._count:
+            return np.full(self.num_channels, np.nan)
+        return self._shift + self._sum / self._count
+
+    @property
+    def var(self):
+        if not self._count:
+            return np.full(self.num_channels, np.nan)
+        mean = self._sum / self._count
+        return np.maximum(self._sumsq / self._count - mean * mean, 0.0)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def max(self):
+        return np.array([queue[0][1] if queue else np.nan for queue in self._max_queues])
+
+    @property
+    def min(self):
+        return np.array([-queue[0][1] if queue else np.nan for queue in self._min_queues])
+
+
+def _push_extremes(queue, row, first, oldest):
+    # Monotonic queue of (sample number, value) with decreasing values, front is the max.
+    # Within a block only samples larger than everything after them can ever be the max,
+    # so they are picked out with one reversed running maximum.
+    later_max = np.maximum.accumulate(row[::-1])[::-1]
+    candidates = np.flatnonzero(row[:-1] > later_max[1:])
+    candidates = np.append(candidates, len(row) - 1)
+    candidates = candidates[candidates + first >= oldest]
+
+    block_max = later_max[candidates[0]]
+    while queue and queue[-1][1] <= block_max:
+        queue.pop()
+    queue.extend(zip((candidates + first).tolist(), row[candidates].tolist()))
+    while queue[0][0] < oldest:
+        queue.popleft()
+
+
+# =========================
+# Exponential Moving Average
+# =========================
+class ExponentialAverage:
+    """Exponential moving average per channel, set by `alpha` or an equivalent `span` in samples."""
+
+    def __init__(self, alpha=None, span=None, num_channels=1):
+        if (alpha is None) == (span is None):
+            raise ValueError("Give exactly one of alpha or span")
+        self.alpha = float(alpha) if alpha is not None else 2.0 / (span + 1.0)
+        if not 0.0 < self.alpha <= 1.0:
+            raise ValueError("alpha must be in (0, 1]")
+        self.num_channels = int(num_channels)
+        self.value = None
+        self.total = 0
+
+    def update(self, values):
+        block = _as_block(values, self.num_channels)
+        samples = block.shape[1]
+        if samples == 0:
+            return
+        if self.value is None:
+            self.value = block[:, 0].copy()
+            block = block[:, 1:]
+            samples -= 1
+            self.total += 1
+        if samples:
+            # value_n = (1-a)^n * value_0 + sum_i a * (1-a)^(n-1-i) * x_i
+            decay = 1.0 - self.alpha
+            weights = self.alpha * decay ** np.arange(samples - 1, -1, -1, dtype=np.float64)
+            self.value = decay ** samples * self.value + block @ weights
+            self.total += samples
+
+    @property
+    def mean(self):
+        return self.value if self.value is not None else np.full(self.num_channels, np.nan)
+
+
+# =========================
+# Combined Statistics
+# =========================
+class StreamStats:
+    """Several named rolling windows and EMAs fed from the same stream of blocks."""
+
+    def __init__(self, num_channels=1, windows=None, emas=None):
+        self.num_channels = int(num_channels)
+        self.windows = {name: RollingWindow(length, self.num_channels)
+                        for name, length in (windows or {}).items()}
+        self.emas = {name: ExponentialAverage(span=span, num_channels=self.num_channels)
+                     for name, span in (emas or {}).items()}
+
+    def update(self, values):
+        block = _as_block(values, self.num_channels)
+        finite = np.isfinite(block).all(axis=0)
+        if not finite.all():
+            block = block[:, finite]    # Gap markers (NaN) are not readings
+        for window in self.windows.values():
+            window.update(block)
+        for ema in self.emas.values():
+            ema.update(block)
+
+    def means(self):
+        means = {name: window.mean for name, window in self.windows.items()}
+        means.update((name, ema.mean) for name, ema in self.emas.items())
+        return means
+
+    def __getitem__(self, name):
+        if name in self.windows:
+            return self.windows[name]
+        return self.emas[name]
+
+
+def extend_rolling_mean(rolling, history, times, window, channel=0):
+    # Appends to the `rolling` RingBuffer the mean of the last `window` samples of the `history`
+    # RingBuffer at each of its newest len(times) samples, once the window is full
+    if not len(times) or len(history) < window:
+        return
+    values = history.latest(len(times) + window - 1)[1][channel]
+    cumsum = np.concatenate(([0.0], np.cumsum(values)))
+    means = (cumsum[window:] - cumsum[:-window]) / window
+    rolling.extend(times[-len(means):], means)
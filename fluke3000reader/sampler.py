@@ -0,0 +1,65 @@
+# Background acquisition worker
+#
+# The meter is read on its own fixed schedule, so the sample rate no longer
+# depends on how many browser tabs are polling or how long a page takes to
+# render. Consumers only read from the shared buffers.
+
+import threading
+import time
+
+
+class Sampler(threading.Thread):
+    """Calls `acquire()` every `period` seconds until stopped or until it returns False.
+
+    `period` may also be a callable, asked for the next interval after every call.
+    """
+
+    def __init__(self, acquire, period, name='sampler', metrics=None):
+        super().__init__(name=name, daemon=True)
+        self.acquire = acquire
+        self.period = period if callable(period) else float(period)
+        self.metrics = metrics  # Optional instrumentation.PipelineMetrics
+        self.samples = 0        # Successful acquire() calls
+        self.errors = 0         # acquire() calls that raised
+        self.late = 0           # Schedule slots missed because acquire() ran too long
+        self._stop_event = threading.Event()
+
+    def run(self):
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            if self.metrics:
+                self.metrics.loop_jitter.labels(loop=self.name).observe(max(time.monotonic() - next_time, 0.0))
+            try:
+                keep_going = self.acquire()
+                self.samples += 1
+            except Exception as e:
+                # A failed read must not kill the worker, the next slot tries again
+                self.errors += 1
+                if self.metrics:
+                    self.metrics.errors.labels(loop=self.name).inc()
+                keep_going = True
+                print(f"[{self.name}] Acquisition error: {e!r}")
+            if keep_going is False:
+                break
+
+            # Fixed-rate schedule, missed slots are dropped instead of bunched up
+            period = self.period() if callable(self.period) else self.period
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                missed = int(-delay // period) + 1
+                self.late += missed
+                if self.metrics:
+                    self.metrics.late_slots.labels(loop=self.name).inc(missed)
+                next_time = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set() or not self.is_alive()
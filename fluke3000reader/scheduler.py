@@ -0,0 +1,124 @@
+# Multi-source acquisition
+#
+# Every source (a Fluke3000 on its serial port, the MCC128 scan, ...) gets its
+# own Sampler thread and period, so a slow serial read never holds up a HAT
+# block read. Their SampleBlocks are merged into one stream ordered by their
+# monotonic stamps, which a wall clock step does not reorder, and handed to a
+# single consumer from a merge thread.
+
+import heapq
+import itertools
+import threading
+import time
+from .sampler import Sampler
+from .timestamps import monotonic, epoch_to_monotonic
+
+
+def _monotonic_times(block):
+    # Blocks from sources that only stamp epoch times are mapped through the current anchor
+    return block.monotonic if block.monotonic is not None else epoch_to_monotonic(block.timestamps)
+
+
+class AcquisitionScheduler:
+    """Polls sources concurrently and calls `consumer(block)` with their SampleBlocks in time order."""
+
+    def __init__(self, consumer, max_lateness=2.0, merge_interval=0.1, metrics=None):
+        self.consumer = consumer
+        self.metrics = metrics                  # Optional instrumentation.PipelineMetrics, passed on to the samplers
+        self.max_lateness = max_lateness        # Seconds a block may wait for slower sources
+        self.merge_interval = merge_interval
+        self.samplers = {}
+        self.out_of_order = 0                   # Blocks emitted after a newer block had already gone out
+        self.consumer_errors = 0
+        self._heap = []
+        self._seq = itertools.count()           # Tie breaker, blocks themselves are not comparable
+        self._frontier = {}                     # Source name -> newest monotonic stamp it has produced
+        self._emitted_until = float('-inf')
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._merger = threading.Thread(target=self._merge_loop, name='scheduler-merge', daemon=True)
+
+    # =========================
+    # Sources
+    # =========================
+    def add_source(self, name, read_block, period):
+        # read_block() returns a SampleBlock, or None once the source is finished
+        if name in self.samplers:
+            raise ValueError(f"Source {name} is already scheduled")
+        # The frontier and the lateness bound use the clock of the blocks' monotonic stamps
+        self._frontier[name] = monotonic()
+        self.samplers[name] = Sampler(lambda: self._acquire(name, read_block), period, name=f'{name}-sampler',
+                                      metrics=self.metrics)
+
+    def _acquire(self, name, read_block):
+        block = read_block()
+        if block is None:
+            with self._lock:
+                del self._frontier[name]    # A finished source no longer holds the others back
+            return False
+        if len(block.timestamps):
+            times = _monotonic_times(block)
+            with self._lock:
+                heapq.heappush(self._heap, (times[0], next(self._seq), block))
+                self._frontier[name] = max(self._frontier[name], times[-1])
+        return True
+
+    # =========================
+    # Merging
+    # =========================
+    def _merge_loop(self):
+        while not self._stop_event.wait(self.merge_interval):
+            self._emit(self._watermark())
+        self._emit(float('inf'))    # Whatever is left once the samplers have stopped
+
+    def _watermark(self):
+        # Each source stamps its blocks in increasing order, so nothing older than the
+        # slowest source's newest sample can still arrive. A source that is silent for
+        # more than max_lateness stops holding the stream back.
+        with self._lock:
+            slowest = min(self._frontier.values(), default=float('inf'))
+        return max(slowest, monotonic() - self.max_lateness)
+
+    def _emit(self, watermark):
+        ready = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= watermark:
+                ready.append(heapq.heappop(self._heap))
+        for first, _, block in ready:
+            if first < self._emitted_until:
+                self.out_of_order += 1
+                if self.metrics:
+                    self.metrics.late_blocks.labels(source=block.source).inc()
+            self._emitted_until = max(self._emitted_until, first)
+            try:
+                self.consumer(block)
+            except Exception as e:
+                self.consumer_errors += 1
+                print(f"[scheduler] Error handling {block.source} block: {e!r}")
+
+    # =========================
+    # Control
+    # =========================
+    def start(self):
+        for sampler in self.samplers.values():
+            sampler.start()
+        self._merger.start()
+
+    def stop(self, timeout=None):
+        for sampler in self.samplers.values():
+            sampler.stop(timeout)
+        self._stop_event.set()
+        if self._merger.is_alive():
+            self._merger.join(timeout)
+
+    def is_alive(self):
+        return any(sampler.is_alive() for sampler in self.samplers.values())
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for sampler in self.samplers.values():
+            sampler.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def stats(self):
+        return {name: {'samples': s.samples, 'errors': s.errors, 'late': s.late}
+                for name, s in self.samplers.items()}
@@ -0,0 +1,168 @@
+# Shared-memory sample ring
+#
+# The RingBuffer layout (every sample written twice, capacity apart, so the
+# newest N are one contiguous slice) in a multiprocessing.shared_memory block,
+# so one acquisition process can feed any number of reader processes. There is
+# a single writer and no lock: the writer announces how far it is about to
+# write, writes, then publishes the new total. Readers copy what they need and
+# drop whatever the writer may have overwritten while they were copying, so a
+# slow reader never holds up the sampler, it only loses its oldest samples.
+#
+#   header  int64[8]   capacity, channels, total, writing, closed, ...
+#   times   float64[2 * capacity]
+#   values  float64[channels, 2 * capacity]
+
+from multiprocessing import shared_memory
+import numpy as np
+from .readings import SampleBlock
+
+
+HEADER_FIELDS = 8
+CAPACITY, CHANNELS, TOTAL, WRITING, CLOSED = range(5)
+
+
+class SharedRing:
+    """Timestamps plus one value row per channel in shared memory, one writer, many readers."""
+
+    def __init__(self, name, capacity=None, num_channels=1, create=False):
+        if create:
+            if not capacity or capacity <= 0:
+                raise ValueError("SharedRing capacity must be positive")
+            size = 8 * (HEADER_FIELDS + 2 * capacity * (1 + num_channels))
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            header = np.ndarray(HEADER_FIELDS, dtype=np.int64, buffer=self._shm.buf)
+            header[:] = 0
+            header[CAPACITY] = capacity
+            header[CHANNELS] = num_channels
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = name
+        self.owner = create
+        self._header = np.ndarray(HEADER_FIELDS, dtype=np.int64, buffer=self._shm.buf)
+        self.capacity = int(self._header[CAPACITY])
+        self.num_channels = int(self._header[CHANNELS])
+        offset = 8 * HEADER_FIELDS
+        self._times = np.ndarray(2 * self.capacity, dtype=np.float64, buffer=self._shm.buf, offset=offset)
+        offset += 8 * 2 * self.capacity
+        self._values = np.ndarray((self.num_channels, 2 * self.capacity), dtype=np.float64, buffer=self._shm.buf,
+                                  offset=offset)
+
+    @property
+    def total(self):
+        # Samples written since creation
+        return int(self._header[TOTAL])
+
+    @property
+    def closed(self):
+        return bool(self._header[CLOSED])
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    # =========================
+    # Writer
+    # =========================
+    def extend(self, timestamps, values):
+        # timestamps (samples,), values (num_channels, samples) or (samples,) for one channel
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(self.num_channels, -1)
+        samples = timestamps.shape[0]
+        if values.shape[1] != samples:
+            raise ValueError("timestamps and values must hold the same number of samples")
+        if samples == 0:
+            return
+        skipped = max(samples - self.capacity, 0)
+        total = int(self._header[TOTAL])
+        # Readers treat everything this write can reach as gone
+        self._header[WRITING] = total + samples
+        index = (total + skipped + np.arange(samples - skipped)) % self.capacity
+        self._times[index] = self._times[index + self.capacity] = timestamps[skipped:]
+        self._values[:, index] = self._values[:, index + self.capacity] = values[:, skipped:]
+        self._header[TOTAL] = total + samples
+
+    def close_writer(self):
+        # Tells readers no more samples are coming
+        self._header[CLOSED] = 1
+
+    # =========================
+    # Readers
+    # =========================
+    def latest(self, n=None):
+        # Copies of the newest n samples in chronological order
+        return self._copy(self.total, n)[:2]
+
+    def latest_with_total(self, n=None):
+        # latest(n) and the total the copy ends at, read once so a write in between cannot shift the two apart
+        total = self.total
+        times, values, _ = self._copy(total, n)
+        return times, values, total
+
+    def since(self, last_total):
+        # Samples written after last_total: (times, values, new total, samples lost to the writer lapping us)
+        total = self.total
+        times, values, lost = self._copy(total, total - last_total)
+        return times, values, total, lost + max(total - last_total - self.capacity, 0)
+
+    def _copy(self, total, n=None):
+        held = min(total, self.capacity)
+        n = held if n is None else max(min(int(n), held), 0)
+        end = total % self.capacity + self.capacity
+        times = self._times[end - n:end].copy()
+        values = self._values[:, end - n:end].copy()
+        # Samples at the front may have been overwritten by a write that started meanwhile
+        overwritten = min(max(int(self._header[WRITING]) - self.capacity - (total - n), 0), n)
+        return times[overwritten:], values[:, overwritten:], overwritten
+
+    def channel(self, row):
+        return RingChannel(self, row)
+
+    def close(self):
+        self._times = self._values = self._header = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+class RingChannel:
+    """One row of a SharedRing with the RingBuffer read interface the live_plot helpers use."""
+
+    def __init__(self, ring, row):
+        self.ring = ring
+        self.row = row
+
+    @property
+    def total(self):
+        return self.ring.total
+
+    def __len__(self):
+        return len(self.ring)
+
+    def latest(self, n=None):
+        times, values = self.ring.latest(n)
+        return times, values[self.row:self.row + 1]
+
+    def latest_with_total(self, n=None):
+        times, values, total = self.ring.latest_with_total(n)
+        return times, values[self.row:self.row + 1], total
+
+
+class RingTail:
+    """Reads a SharedRing as a scheduler source: each read_block() returns what was written since the last one."""
+
+    def __init__(self, ring, source, channels, unit='V', start=0):
+        self.ring = ring
+        self.source = source
+        self.channels = list(channels)
+        self.unit = unit
+        self.last_total = start     # From the oldest sample still held by default
+        self.lost = 0
+
+    def read_block(self):
+        closed = self.ring.closed
+        times, values, self.last_total, lost = self.ring.since(self.last_total)
+        self.lost += lost
+        if lost:
+            print(f"[{self.source}] Reader fell behind, {lost} samples lost")
+        if closed and not len(times):
+            return None     # The writer is done and everything has been read
+        return SampleBlock(self.source, self.channels, self.unit, times, values)
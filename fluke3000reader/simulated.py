@@ -0,0 +1,299 @@
+# Simulated hardware
+#
+# Drop-in stand-ins for the Fluke3000 (as returned by open_serial) and the
+# daqhats mcc128, so the scripts, the pipeline and the benchmarks run on any
+# machine. Waveforms, read latency and jitter, scan overruns and signal
+# dropouts are configurable, and the HAT can be driven at any scan rate.
+
+from collections import namedtuple
+from enum import Enum, IntEnum
+import threading
+import time
+import numpy as np
+
+
+# =========================
+# Waveforms
+# =========================
+class Waveform:
+    """Voltage as a function of time, vectorized over a NumPy array of seconds."""
+
+    KINDS = ('constant', 'sine', 'square', 'ramp', 'pump')
+
+    def __init__(self, kind='pump', level=0.5, amplitude=0.02, period=60.0, noise=0.001, spike_rate=0.0,
+                 spike_height=0.5, seed=None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown waveform {kind}, use one of {self.KINDS}")
+        self.kind = kind
+        self.level = level
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+        self.spike_rate = spike_rate        # Pressure bursts per second, 'pump' only
+        self.spike_height = spike_height
+        self._rng = np.random.default_rng(seed)
+
+    def __call__(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        phase = 2 * np.pi * t / self.period
+        if self.kind == 'constant':
+            v = np.full(t.shape, self.level)
+        elif self.kind == 'sine':
+            v = self.level + self.amplitude * np.sin(phase)
+        elif self.kind == 'square':
+            v = self.level + self.amplitude * np.sign(np.sin(phase))
+        elif self.kind == 'ramp':
+            v = self.level + self.amplitude * (2 * ((t / self.period) % 1) - 1)
+        else:
+            # Slow drift of an ion pump supply plus the occasional decaying burst
+            v = self.level + self.amplitude * np.sin(phase)
+            if self.spike_rate and t.size:
+                dt = (t[-1] - t[0]) / max(t.size - 1, 1) if t.size > 1 else 1.0
+                starts = self._rng.random(t.size) < self.spike_rate * dt
+                if starts.any():
+                    kernel = np.exp(-np.arange(min(t.size, 50)) / 10.0)
+                    v = v + self.spike_height * np.convolve(starts.astype(float), kernel)[:t.size]
+        if self.noise:
+            v = v + self._rng.normal(0.0, self.noise, t.shape)
+        return v
+
+
+def _jittered_sleep(rng, latency, jitter):
+    delay = latency + (rng.uniform(-jitter, jitter) if jitter else 0.0)
+    if delay > 0:
+        time.sleep(delay)
+
+
+# =========================
+# Fluke3000
+# =========================
+class Quantity:
+    """Just enough of an InstrumentKit quantity: .magnitude, .units and the 'value unit' string."""
+
+    def __init__(self, magnitude, units):
+        self.magnitude = magnitude
+        self.units = units
+
+    def __str__(self):
+        return f"{self.magnitude} {self.units}"
+
+    def __float__(self):
+        return float(self.magnitude)
+
+
+class SimulatedFluke3000:
+    """Answers measure() like a Fluke3000 on a serial port, with latency, jitter, dropouts and outages.
+
+    An outage takes the whole port down for `outage_seconds`: reads time out and
+    reopening it fails module discovery, like the real dongle after a hiccup.
+    """
+
+    class Mode(Enum):
+        voltage_ac = '01'
+        voltage_dc = '02'
+        current_ac = '03'
+        current_dc = '04'
+        frequency = '05'
+        temperature = '07'
+        resistance = '0B'
+        capacitance = '0F'
+
+    UNITS = {'voltage_ac': 'V', 'voltage_dc': 'V', 'current_ac': 'A', 'current_dc': 'A', 'frequency': 'Hz',
+             'temperature': 'degC', 'resistance': 'ohm', 'capacitance': 'F'}
+
+    _down_until = {}    # Port -> monotonic time its outage ends, shared by every connection to it
+
+    def __init__(self, waveform=None, latency=0.05, jitter=0.02, dropout=0.0, outage=0.0, outage_seconds=3.0,
+                 discovery=0.2, port=None, seed=None):
+        self.waveform = waveform if waveform is not None else Waveform(seed=seed)
+        self.latency = latency      # Seconds per measure() round trip
+        self.jitter = jitter        # +- seconds added to the latency
+        self.dropout = dropout      # Probability that a read times out
+        self.outage = outage        # Probability that a read takes the port down
+        self.outage_seconds = outage_seconds
+        self.discovery = discovery  # Seconds connect() spends scanning for modules
+        self.port = port
+        self.measurements = 0
+        self._rng = np.random.default_rng(seed)
+        self._start = time.monotonic()
+        self._lock = threading.Lock()   # One request on the "serial port" at a time
+        self.positions = {}
+        self.connect()
+
+    @classmethod
+    def open_serial(cls, port=None, baud=115200, **kwargs):
+        return cls(port=port, **kwargs)
+
+    def _down(self):
+        return time.monotonic() < self._down_until.get(self.port, 0.0)
+
+    def connect(self):
+        # Module discovery, what InstrumentKit runs on every open_serial()
+        with self._lock:
+            time.sleep(self.discovery)
+            if self._down():
+                raise NotImplementedError("Module ID 64 not implemented")
+            self.positions = {'m3004': 1}
+
+    def measure(self, mode):
+        mode = self.Mode[mode] if isinstance(mode, str) else mode
+        with self._lock:
+            _jittered_sleep(self._rng, self.latency, self.jitter)
+            if not self._down() and self.outage and self._rng.random() < self.outage:
+                self._down_until[self.port] = time.monotonic() + self.outage_seconds
+            if self._down() or self.dropout and self._rng.random() < self.dropout:
+                raise OSError("Simulated Fluke3000 read timed out")
+            value = float(self.waveform(time.monotonic() - self._start))
+            self.measurements += 1
+        return Quantity(value, self.UNITS[mode.name])
+
+    def reset(self):
+        pass
+
+    def flush(self):
+        pass
+
+
+# =========================
+# MCC128 (daqhats names)
+# =========================
+class HatIDs(IntEnum):
+    MCC_128 = 326
+
+class OptionFlags(IntEnum):
+    DEFAULT = 0x0000
+    CONTINUOUS = 0x0004
+
+class AnalogInputMode(IntEnum):
+    SE = 0
+    DIFF = 1
+
+class AnalogInputRange(IntEnum):
+    BIP_10V = 0
+    BIP_5V = 1
+    BIP_2V = 2
+    BIP_1V = 3
+
+RANGE_VOLTS = {AnalogInputRange.BIP_10V: 10.0, AnalogInputRange.BIP_5V: 5.0,
+               AnalogInputRange.BIP_2V: 2.0, AnalogInputRange.BIP_1V: 1.0}
+
+class HatError(Exception):
+    pass
+
+# Same fields as daqhats' a_in_scan_read() result
+ScanReadResult = namedtuple('ScanReadResult',
+                            ['running', 'hardware_overrun', 'buffer_overrun', 'triggered', 'timeout', 'data'])
+
+
+def select_hat_device(filter_by_id=None):
+    return 0
+
+def chan_list_to_mask(chan_list):
+    mask = 0
+    for channel in chan_list:
+        mask |= 1 << channel
+    return mask
+
+
+class mcc128:
+    """Continuous scan generated from the wall clock, read back like the daqhats mcc128 class."""
+
+    def __init__(self, address=0, waveforms=None, read_latency=0.0, jitter=0.0, overrun=0.0, dropout=0.0,
+                 clock_error_ppm=0.0, seed=None):
+        self.address = address
+        self.waveforms = waveforms      # One Waveform per channel, or one shared by all, None for defaults
+        self.read_latency = read_latency
+        self.jitter = jitter
+        self.overrun = overrun          # Probability that a read reports a hardware overrun
+        self.dropout = dropout          # Probability that a read has one channel disconnected (0 V)
+        self.clock_error_ppm = clock_error_ppm  # Scan clock running fast (+) or slow (-) against the host
+        self.input_mode = AnalogInputMode.SE
+        self.input_range = AnalogInputRange.BIP_10V
+        self._rng = np.random.default_rng(seed)
+        self._seed = seed
+        self._running = False
+        self._overrun = None    # Result repeated on every read once the scan has overrun
+
+    def a_in_mode_write(self, input_mode):
+        self.input_mode = input_mode
+
+    def a_in_range_write(self, input_range):
+        self.input_range = input_range
+
+    def a_in_scan_actual_rate(self, channel_count, sample_rate_per_channel):
+        return sample_rate_per_channel
+
+    def a_in_scan_start(self, channel_mask, samples_per_channel, sample_rate_per_channel, options):
+        if self._running:
+            raise HatError("A scan is already active")
+        self.channels = [channel for channel in range(8) if channel_mask & (1 << channel)]
+        self.scan_rate = float(sample_rate_per_channel)
+        self.continuous = bool(options & OptionFlags.CONTINUOUS)
+        self.samples_per_channel = samples_per_channel
+        # daqhats allocates at least 10000 samples per channel for continuous scans
+        self.buffer_size = max(samples_per_channel, 10000 if self.continuous else samples_per_channel)
+        if isinstance(self.waveforms, Waveform):
+            self._waves = [self.waveforms] * len(self.channels)
+        elif self.waveforms:
+            self._waves = list(self.waveforms)
+        else:
+            seed = self._seed
+            self._waves = [Waveform(level=0.2 + 0.1 * i, seed=None if seed is None else seed + i)
+                           for i in range(len(self.channels))]
+        self._generated = 0
+        self._start = time.monotonic()
+        self._running = True
+        self._overrun = None
+
+    def a_in_scan_buffer_size(self):
+        return self.buffer_size * len(self.channels)
+
+    def a_in_scan_read(self, samples_per_channel, timeout):
+        if not hasattr(self, 'channels'):
+            raise HatError("No scan has been started")
+        _jittered_sleep(self._rng, self.read_latency, self.jitter)
+        if self._running and self.overrun and self._rng.random() < self.overrun:
+            self._overrun = ScanReadResult(False, True, False, True, False, [])
+        if self._overrun:
+            self._running = False
+            return self._overrun
+
+        available = self._available()
+        if samples_per_channel > 0 and available < samples_per_channel and self._running:
+            # Blocks until the requested samples are there or the timeout passes
+            wait = (samples_per_channel - available) / self.scan_rate
+            if timeout >= 0:
+                wait = min(wait, timeout)
+            time.sleep(max(wait, 0))
+            available = self._available()
+        if available > self.buffer_size:
+            # Not read out fast enough, the driver stops the scan
+            self._overrun = ScanReadResult(False, False, True, True, False, [])
+            self._running = False
+            return self._overrun
+
+        count = available if samples_per_channel < 0 else min(available, samples_per_channel)
+        t = (self._generated + np.arange(count)) / self.scan_rate
+        full_scale = RANGE_VOLTS[AnalogInputRange(self.input_range)]
+        block = np.clip(np.array([wave(t) for wave in self._waves]), -full_scale, full_scale)
+        if self.dropout and count and self._rng.random() < self.dropout:
+            block[self._rng.integers(len(self._waves))] = 0.0
+        self._generated += count
+        timed_out = samples_per_channel > 0 and count < samples_per_channel
+        # Interleaved ch0, ch1, ... like the real driver (a NumPy array instead of a list)
+        return ScanReadResult(self._running, False, False, True, timed_out, block.T.ravel())
+
+    def _available(self):
+        produced = int((time.monotonic() - self._start) * self.scan_rate * (1 + self.clock_error_ppm * 1e-6))
+        if not self.continuous:
+            produced = min(produced, self.samples_per_channel)
+            if produced == self.samples_per_channel:
+                self._running = False
+        return produced - self._generated
+
+    def a_in_scan_stop(self):
+        self._running = False
+
+    def a_in_scan_cleanup(self):
+        self._running = False
+        del self.channels
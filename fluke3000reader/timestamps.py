@@ -0,0 +1,131 @@
+# Timestamps
+#
+# Every reading is stamped once, when its read has completed, with two clocks:
+# float64 epoch seconds, used by the chart, CSV, recordings and Prometheus, and
+# the raw monotonic seconds it was derived from, used to order and space
+# samples. The epoch is the monotonic clock anchored to the wall clock, so
+# stamps keep nanosecond clock resolution. When the system time is stepped
+# (NTP syncing after a headless boot) the anchor is moved to the new wall
+# clock and the step is logged; the monotonic stamps run on unaffected.
+# Strings are only made for display and export.
+
+import datetime
+import threading
+import time
+import numpy as np
+
+
+REANCHOR_THRESHOLD = 0.5    # Seconds the wall clock may drift from the anchored clock before re-anchoring
+REANCHOR_CHECK = 1.0        # Seconds between comparisons with the wall clock
+
+# (epoch ns, monotonic ns) read back to back, the pair every stamp is derived from.
+# Replaced as a whole so readers never see half of a new anchor.
+_anchor = (time.time_ns(), time.monotonic_ns())
+_next_check_ns = _anchor[1] + int(REANCHOR_CHECK * 1e9)
+_anchor_lock = threading.Lock()
+reanchors = 0       # Wall clock steps followed so far
+
+
+def _check_anchor(monotonic_ns):
+    global _anchor, _next_check_ns, reanchors
+    with _anchor_lock:
+        if monotonic_ns < _next_check_ns:
+            return
+        wall_ns, now_monotonic_ns = time.time_ns(), time.monotonic_ns()
+        _next_check_ns = now_monotonic_ns + int(REANCHOR_CHECK * 1e9)
+        step = (wall_ns - (_anchor[0] + now_monotonic_ns - _anchor[1])) / 1e9
+        if abs(step) <= REANCHOR_THRESHOLD:
+            return
+        _anchor = (wall_ns, now_monotonic_ns)
+        reanchors += 1
+    print(f"[timestamps] Wall clock stepped by {step:+.3f} s, epoch stamps re-anchored")
+
+def now_pair_ns():
+    # (epoch ns, monotonic ns) of one clock read
+    monotonic_ns = time.monotonic_ns()
+    if monotonic_ns >= _next_check_ns:
+        _check_anchor(monotonic_ns)
+    epoch_ns, anchor_monotonic_ns = _anchor
+    return epoch_ns + (monotonic_ns - anchor_monotonic_ns), monotonic_ns
+
+def now_pair():
+    # (float64 epoch seconds, float64 monotonic seconds) of one clock read
+    epoch_ns, monotonic_ns = now_pair_ns()
+    return epoch_ns / 1e9, monotonic_ns / 1e9
+
+def now_ns():
+    # int64 nanoseconds since the epoch, monotonic between wall clock steps
+    return now_pair_ns()[0]
+
+def now():
+    # float64 epoch seconds (sub-microsecond resolution for the next centuries)
+    return now_ns() / 1e9
+
+def monotonic():
+    # float64 seconds of the raw monotonic clock, never stepped
+    return time.monotonic_ns() / 1e9
+
+def monotonic_to_epoch(monotonic_seconds):
+    # Through the current anchor, so stamps made before a re-anchor map onto the corrected wall clock
+    _check_anchor(time.monotonic_ns())
+    epoch_ns, monotonic_ns = _anchor
+    return np.asarray(monotonic_seconds, dtype=np.float64) + (epoch_ns - monotonic_ns) / 1e9
+
+def epoch_to_monotonic(epoch):
+    epoch_ns, monotonic_ns = _anchor
+    return np.asarray(epoch, dtype=np.float64) - (epoch_ns - monotonic_ns) / 1e9
+
+
+# =========================
+# Formatting
+# =========================
+def local_offset(epoch):
+    # Seconds east of UTC of the local timezone at that instant
+    return datetime.datetime.fromtimestamp(epoch).astimezone().utcoffset().total_seconds()
+
+def format_time(epoch, decimals=2, date=True):
+    # One epoch -> 'YYYY-MM-DD HH:MM:SS.ff' (or 'HH:MM:SS.ff') local time
+    text = datetime.datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S.%f" if date else "%H:%M:%S.%f")
+    return text[:decimals - 6] if decimals else text[:-7]
+
+def parse_local_times(strings):
+    # 'YYYY-MM-DD HH:MM:SS.ff' local time strings (CsvWriteData layout) -> float64 epoch seconds
+    naive = np.asarray(strings, dtype='datetime64[us]').astype(np.int64) / 1e6
+    if naive.size == 0:
+        return naive
+    first, last = (local_offset(naive[0] - local_offset(naive[0])),
+                   local_offset(naive[-1] - local_offset(naive[-1])))
+    if first == last:
+        return naive - first
+    # The block spans a daylight saving change, fall back to one lookup per sample
+    return np.array([t - local_offset(t - local_offset(t)) for t in naive])
+
+def format_local_times(epochs, decimals=2):
+    # float64 epoch seconds -> 'YYYY-MM-DD HH:MM:SS.ff' local time strings
+    epochs = np.asarray(epochs, dtype=np.float64)
+    if epochs.size == 0:
+        return np.array([], dtype=str)
+    first, last = local_offset(epochs[0]), local_offset(epochs[-1])
+    if first == last:
+        offsets = first
+    else:
+        offsets = np.array([local_offset(t) for t in epochs])
+    local = ((epochs + offsets) * 1e6).round().astype('datetime64[us]')
+    text = np.datetime_as_string(local, unit='us')
+    text = np.char.replace(text, 'T', ' ')
+    return text.astype(f'U{20 + decimals}') if decimals else text.astype('U19')
+
+def local_milliseconds(epochs):
+    # Epoch seconds -> local wall time in ms, the numbers a Plotly date axis shows as local time
+    epochs = np.asarray(epochs, dtype=np.float64)
+    if epochs.size == 0:
+        return epochs
+    return (epochs + local_offset(epochs[-1])) * 1000.0
+
+def from_local_milliseconds(ms):
+    # Inverse of local_milliseconds, for ranges coming back from the browser
+    naive = np.asarray(ms, dtype=np.float64) / 1000.0
+    if naive.size == 0:
+        return naive
+    guess = float(np.ravel(naive)[0])
+    return naive - local_offset(guess - local_offset(guess))
@@ -3,213 +3,309 @@
 
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
-from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
-import plotly.graph_objs as go
+from dash.dependencies import Input, Output, State
+from fluke3000reader.prometheus_publisher import PrometheusPublisher
+from fluke3000reader.timestamps import format_time
 import datetime
-import csv
-import instruments as ik
-import re
-from itertools import count
-import numpy as np
-from scipy.interpolate import interp1d
-import time
+from fluke3000reader.csv_writer import BufferedCsvWriter
+from fluke3000reader.recording import RecordingWriter
+from fluke3000reader.readings import FlukeReader, open_fluke3000
+from fluke3000reader.calibration import get_pressure, load_calibration_dir, DEFAULT_CALIBRATION
+from fluke3000reader.ringbuffer import RingBuffer
+from fluke3000reader.rolling_stats import RollingWindow, StreamStats, samples_for
+from fluke3000reader.live_plot import buffer_series, range_series, live_figure, extend_all, is_xaxis_change, relayout_range
+from fluke3000reader.live_stream import LiveStream, CLIENT_SCRIPT_URL, live_stream_layout
+from fluke3000reader.history import HistoryArchive, history_layout, register_history_callbacks
+import threading
+from fluke3000reader.sampler import Sampler
+from fluke3000reader.instrumentation import PipelineMetrics, stage_timer, render_timer
+from fluke3000reader.profiling import make_profiler, write_on_signal
+from fluke3000reader.alarms import AlarmEngine, WebhookAction, log_action
 
 
 ENABLE_DASH = True           # Enable/Disable Dash app
 ENABLE_PROMETHEUS = True     # Enable/Disable Prometheus publishing
+LIVE_STREAM = True           # Push new samples to every open page (Server-Sent Events) instead of each page polling every DELAY
+SIMULATE = False             # Read a simulated meter (simulated.py) instead of the serial port
 
 # Serial Port Settings
 BAUD = 115200
 PORT = "\\.\\COM6" # Check in Device Managers where the FLUKE usb bluetooth received is installed
+FLUKE_MODE = 'voltage_dc'  # Fluke3000.Mode name, readings are converted to SI (V, A, Hz, Ohm, K, F)
 
 # Prometheus Settings
-PUSHGATEWAY_ADDRESS = 'localhost:9091'
-registry = CollectorRegistry()
-gauge_avg = Gauge('pressure_list', 'Average Reading from Voltmeter', registry=registry)
-gauge_individual = Gauge('pressure_value', 'Individual Readings from Voltmeter', ['index'], registry=registry)
-gauge_measurement_rate = Gauge('measurement_rate', 'Measurement Rate from Fluke Meter', registry=registry)  # New gauge for measurement rate
+PUSHGATEWAY_ADDRESS = 'localhost:9091'   # None to disable pushing
+PROMETHEUS_HTTP_PORT = None              # Port for an in-process /metrics endpoint (pull mode), None to disable
+PUBLISH_QUEUE_SIZE = 1000                # Blocks held while the Pushgateway is unreachable, oldest are dropped
 
 # Data Acquisition Settings
 INTERVAL = 100
 DELAY = 1
 ROLLING_AVG_MEASURE = 10
+PRESSURE_AVG_WINDOWS = {'1min': 60, '1h': 3600}   # Extra rolling pressure averages, window length in seconds
+PRESSURE_EMA_WINDOWS = {'ema_1min': 60}           # Exponential pressure averages, span in seconds
 PUBLISH_INTERVAL = 15  # Prometheus publishing rate (15 seconds)
+HISTORY_LENGTH = 24 * 3600  # Samples kept in memory (one day at 1 Hz), older ones are overwritten
+PLOT_WINDOW = 3600     # Most recent samples shown when a page is opened or the zoom is reset
+
+# Alarm Settings, rules are checked on every reading before it is stored or published
+ALARM_RULES = []        # e.g. [ThresholdRule('pressure_high', above=1e-6, clear=5e-7)] from fluke3000reader.alarms
+ALARM_WEBHOOK = None    # URL every raise and clear is POSTed to as JSON, None to disable
+
+# Instrumentation Settings
+PIPELINE_METRICS = True         # Read latency, loop jitter, stage and callback times, reconnects, with the Prometheus metrics
+PROFILER = None                 # 'sampling' (every thread, collapsed stacks) or 'cprofile' (every acquisition), None to disable
+PROFILE_FILE = "profile.txt"    # Written on exit, and on SIGUSR1 while running
+
+# Calibration Settings
+CALIBRATION = DEFAULT_CALIBRATION  # Name of the ion pump calibration curve used for pressure
+CALIBRATION_DIR = None             # Optional directory of voltage_mV,pressure_Torr CSV tables, one per gauge
 
 CsvWrite = False
-FILENAME = f"voltage_data-{datetime.datetime.now().strftime('%Y-%m-%d_%H_%M_%S')}.csv"
+FILENAME_PREFIX = "voltage_data"        # Files are named <prefix>-<start time>.csv
+CSV_FLUSH_ROWS = 1000                   # Rows buffered in memory before they are written
+CSV_FLUSH_INTERVAL = 5                  # Seconds, upper bound on how far the file lags behind
+CSV_ROTATE_BYTES = 100 * 1024 * 1024    # Start a new file past this size, None to disable
+CSV_ROTATE_DAILY = True                 # Start a new file every day
+CSV_COMPRESS = False                    # gzip files once they are closed
+ARCHIVE_DIRECTORY = None                # Directory of earlier CSV files browsed below the live graphs, None to disable
+
+RecordWrite = False     # Binary recording on/off, compact float32 samples that can be memory-mapped for replay
+RECORDING_FILENAME = f"voltage_data-{datetime.datetime.now().strftime('%Y-%m-%d_%H_%M_%S')}.flk"
 
 # =========================
 # Data Structures
 # =========================
-xval = []
-yval = []
-yval_rolling = []
-timeval = []
-timesec = count()
-pressure_list = []
-last_publish_time = time.time()
-measurement_count = 0  # Counter for measurements
+# The sampler thread writes these, Dash callbacks only read snapshots, always under data_lock
+data_lock = threading.Lock()
+live_data = RingBuffer(HISTORY_LENGTH)          # Timestamps and voltages
+rolling_data = RingBuffer(HISTORY_LENGTH)       # Timestamps and rolling averages
+voltage_avg = RollingWindow(ROLLING_AVG_MEASURE)  # Rolling voltage average shown in graph 2
+pressure_stats = StreamStats(
+    windows={f'{ROLLING_AVG_MEASURE}_samples': ROLLING_AVG_MEASURE,
+             **{name: samples_for(seconds, 1 / DELAY) for name, seconds in PRESSURE_AVG_WINDOWS.items()}},
+    emas={name: samples_for(seconds, 1 / DELAY) for name, seconds in PRESSURE_EMA_WINDOWS.items()})
+
+# Pipeline health metrics, published with the pressure metrics
+pipeline_metrics = PipelineMetrics() if ENABLE_PROMETHEUS and PIPELINE_METRICS else None
 
-# Multimeter Initialization
-mult = ik.fluke.Fluke3000.open_serial(PORT, BAUD)
+# The multimeter (mult, fluke) is opened under __main__, importing this module leaves the port alone
 
 # =========================
-# CSV Writing Function
+# CSV Writing
 # =========================
-def CsvWriteData(name, data, time):
-    with open(name, 'a', newline='') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        if csvfile.tell() == 0:
-            csvwriter.writerow(['Time', 'Voltage'])
-        now = datetime.datetime.now()
-        dateStamp = now.strftime('%Y-%m-%d') + " " + time
-        csvwriter.writerow([dateStamp, data])
+# One writer for the whole run, rows are batched and files rotated by BufferedCsvWriter
+csv_writer = BufferedCsvWriter(FILENAME_PREFIX, flush_rows=CSV_FLUSH_ROWS, flush_interval=CSV_FLUSH_INTERVAL,
+                               rotate_bytes=CSV_ROTATE_BYTES, rotate_daily=CSV_ROTATE_DAILY,
+                               compress=CSV_COMPRESS, epoch_times=True) if CsvWrite else None
+recording_writer = RecordingWriter(RECORDING_FILENAME, channels=['Voltage'],
+                                   metadata={'source': 'fluke3000', 'port': PORT, 'calibration': CALIBRATION,
+                                             'sample_period': DELAY}) if RecordWrite else None
 
 # =========================
-# Prometheus Publishing Function
+# Prometheus Publishing
 # =========================
-def publish_to_prometheus(voltage_list, measurement_rate):
-    if not voltage_list:
-        return
-
-    avg_voltage = sum(voltage_list) / len(voltage_list)
-    gauge_avg.set(avg_voltage)
+def rolling_averages():
+    with data_lock:
+        return {name: float(mean[0]) for name, mean in pressure_stats.means().items()}
 
-    for idx, value in enumerate(voltage_list):
-        gauge_individual.labels(index=idx).set(value)
-
-    gauge_measurement_rate.set(measurement_rate)  # Publish measurement rate
-
-    push_to_gateway(PUSHGATEWAY_ADDRESS, job='voltmeter', registry=registry)
-    print(f"[Prometheus] Data Sent: Avg = {avg_voltage:.2f} V | Total Readings = {len(voltage_list)} | Measurement Rate = {measurement_rate:.2f} Hz")
+# Pushes (or serves) metrics from its own thread, acquisition only queues readings
+publisher = PrometheusPublisher(gateway=PUSHGATEWAY_ADDRESS, http_port=PROMETHEUS_HTTP_PORT,
+                                interval=PUBLISH_INTERVAL, max_queue=PUBLISH_QUEUE_SIZE,
+                                rolling_averages=rolling_averages,
+                                registry=pipeline_metrics.registry if pipeline_metrics else None
+                                ) if ENABLE_PROMETHEUS else None
 
 # =========================
-# Dash App Setup
+# Alarms
 # =========================
-app = dash.Dash(__name__)
-app.layout = html.Div([
-    dcc.Graph(id='live-update-graph-1'),
-    dcc.Graph(id='live-update-graph-2'),
-    dcc.Interval(id='interval-component', interval=DELAY * 1000, n_intervals=0)
-])
+alarms = AlarmEngine(ALARM_RULES, [log_action] + ([WebhookAction(ALARM_WEBHOOK)] if ALARM_WEBHOOK else [])
+                     ) if ALARM_RULES else None
 
-def create_interpolator():
-    # Provided by VARIAN Ion Pump controller 921-0062
-    voltage_mV = np.array([5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0, 50.0,
-                           55.0, 60.0, 65.0, 70.0, 75.0, 80.0, 85.0, 90.0, 95.0])
-    pressure_Torr = np.array([1e-8, 1.5e-8, 2.4e-8,
-                              3.7e-8, 6.0e-8, 1.0e-7,
-                              1.7e-7, 3.0e-7, 5.5e-7,
-                              1.0e-6, 1.6e-6, 2.8e-6,
-                              5.0e-6, 8.0e-6, 1.5e-5,
-                              2.6e-5, 4.0e-5, 6.0e-5,
-                              1.0e-4])
+load_calibration_dir(CALIBRATION_DIR)
 
-    # Interpolation with extrapolation for values below 5 mV
-    interpolator = interp1d(voltage_mV, pressure_Torr, kind='cubic', fill_value='extrapolate')
-
-    return interpolator
-
-def get_pressure(voltage_mV, unit='Torr'):
+# =========================
+# Acquisition
+# =========================
+def acquire():
+    # Acquire voltage data, read straight from the returned quantity and stamped once the read completed
+    sample = fluke.read_block()
+    now = sample.timestamps[-1]
+    volt = sample.values[0, -1]
+
+    # One pressure per sample, after a reconnect the block also holds the NaN gap markers
+    with stage_timer(pipeline_metrics, 'pressure'):
+        pressures = get_pressure(sample.values * 1000, unit='Torr', calibration=CALIBRATION)
+    pressure = pressures[0, -1]
+    # Alarms first, an excursion is acted on before the reading is stored or published
+    if alarms:
+        with stage_timer(pipeline_metrics, 'alarms'):
+            alarms.check(sample, pressures)
+    print(f"{format_time(now)} Measured Voltage: {volt} V")
+
+    if len(sample.timestamps) > 1:
+        # First reading after a reconnect, the NaN at the start of the outage breaks the line and shows in the CSV
+        with data_lock:
+            live_data.extend(sample.timestamps[:-1], sample.values[0, :-1])
+        if CsvWrite:
+            csv_writer.write_rows([t, 'nan'] for t in sample.timestamps[:-1].tolist())
+
+    with data_lock, stage_timer(pipeline_metrics, 'buffers'):
+        live_data.append(now, volt)
+        pressure_stats.update(pressure)
+
+        # Rolling Average Calculation
+        voltage_avg.update(volt)
+        if voltage_avg.full:
+            rolling_data.append(now, voltage_avg.mean[0])
 
-    interpolator = create_interpolator()
-    pressure_Torr = interpolator(voltage_mV)
+    # CSV Writing
+    if CsvWrite:
+        with stage_timer(pipeline_metrics, 'csv'):
+            csv_writer.write_row([now, str(volt)])
+    if RecordWrite:
+        with stage_timer(pipeline_metrics, 'recording'):
+            recording_writer.append(now, volt)
 
-    if unit == 'mbar':
-        return pressure_Torr * 1.33322  # Conversion factor from Torr to mbar
-    return pressure_Torr
+    # Prometheus, handed off to the publisher thread
+    if publisher:
+        publisher.submit(pressure, now)
 
+# =========================
+# Dash App Setup
+# =========================
+# Earlier CSV files, indexed by their own thread and drawn from min/max summaries
+archive = HistoryArchive(ARCHIVE_DIRECTORY) if ARCHIVE_DIRECTORY else None
+
+def voltage_figure(x_range=None):
+    # Graph 1: Raw Voltage Readings, x is the sample time
+    with data_lock:
+        if x_range is None:
+            xval, yval = buffer_series(live_data, n=PLOT_WINDOW)
+        else:
+            xval, yval = range_series(live_data, *x_range)
+    return live_figure(xval, yval, 'Fluke3000 FC Readings', 'Time', 'Voltage (V)', x_range)
+
+def rolling_figure(x_range=None):
+    # Graph 2: Rolling Average, each average is stamped with the time of its newest sample
+    with data_lock:
+        if x_range is None:
+            xval, yval = buffer_series(rolling_data, n=PLOT_WINDOW)
+        else:
+            xval, yval = range_series(rolling_data, *x_range)
+    return live_figure(xval, yval, f'Rolling Average of Last {ROLLING_AVG_MEASURE} Measurements',
+                       'Time', 'Average Voltage (V)', x_range)
+
+def serve_layout():
+    # Built on every page load so a new tab starts from the current buffer contents
+    with render_timer(pipeline_metrics, 'serve_layout'):
+        with data_lock:
+            last_sent = [live_data.total, rolling_data.total]
+        return html.Div([
+            dcc.Graph(id='live-update-graph-1', figure=voltage_figure()),
+            dcc.Graph(id='live-update-graph-2', figure=rolling_figure())
+        ] + ([live_stream_layout(last_sent)] if LIVE_STREAM else [
+            dcc.Interval(id='interval-component', interval=DELAY * 1000, n_intervals=0),
+            dcc.Store(id='last-sent', data=last_sent)
+        ]) + ([history_layout(archive)] if archive else []))
+
+app = dash.Dash(__name__, external_scripts=[CLIENT_SCRIPT_URL] if LIVE_STREAM else [])
+app.layout = serve_layout
+if archive:
+    register_history_callbacks(app, archive)
 
 # =========================
-# Dash Callback for Updating Graphs
+# Dash Callbacks for Updating Graphs
 # =========================
+if LIVE_STREAM:
+    # One reader of the buffers every DELAY, whatever the number of open pages
+    live_stream = LiveStream(data_lock, interval=DELAY, metrics=pipeline_metrics)
+    live_stream.add('live-update-graph-1', live_data)
+    live_stream.add('live-update-graph-2', rolling_data)
+    live_stream.register(app.server)
+else:
+    live_stream = None
+
+    @app.callback(
+        [Output('live-update-graph-1', 'extendData'),
+         Output('live-update-graph-2', 'extendData'),
+         Output('last-sent', 'data')],
+        [Input('interval-component', 'n_intervals')],
+        [State('last-sent', 'data')]
+    )
+    def update_graph(n, last_sent):
+        with render_timer(pipeline_metrics, 'update_graph'), data_lock:
+            extends, sent = extend_all([(live_data, 0), (rolling_data, 0)], last_sent)
+        return extends[0] or dash.no_update, extends[1] or dash.no_update, sent
+
 @app.callback(
-    [Output('live-update-graph-1', 'figure'),
-     Output('live-update-graph-2', 'figure')],
-    [Input('interval-component', 'n_intervals')]
+    Output('live-update-graph-1', 'figure'),
+    [Input('live-update-graph-1', 'relayoutData')],
+    prevent_initial_call=True
 )
-def update_graph(n):
-    global pressure_list, last_publish_time, measurement_count
-
-    # Acquire voltage data
-    volt = ''
-    xval.append(next(timesec))
-    current_time = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-4]
-    timeval.append(current_time)
-
-    data = mult.measure(mult.Mode.voltage_dc)
-
-    # Process the data
-    if str(data) != '0.0 V':
-        value = re.findall(r'-?\d+\.\d+', str(data))
-        volt = float(value[0])
-    else:
-        volt = 0
-
-    yval.append(volt)
-    pressure_list.append(get_pressure(volt * 1000, unit='Torr'))
-    measurement_count += 1  # Increment measurement count
-    print(f"Measured Voltage: {volt} V")
-
-    # Rolling Average Calculation
-    if len(yval) >= ROLLING_AVG_MEASURE:
-        temp_avg = np.mean(yval[-ROLLING_AVG_MEASURE:])
-        yval_rolling.append(temp_avg)
+def zoom_graph_1(relayout_data):
+    if not is_xaxis_change(relayout_data):
+        return dash.no_update
+    with render_timer(pipeline_metrics, 'zoom_graph'):
+        return voltage_figure(relayout_range(relayout_data))
 
-    # CSV Writing
-    if CsvWrite:
-        CsvWriteData(FILENAME, str(volt), current_time)
-
-    # Prometheus Publishing Every 15 Seconds
-    if ENABLE_PROMETHEUS and (time.time() - last_publish_time >= PUBLISH_INTERVAL):
-        measurement_rate = measurement_count / PUBLISH_INTERVAL  # Calculate measurement rate
-        publish_to_prometheus(pressure_list, measurement_rate)
-        pressure_list = []  # Clear the list after publishing
-        measurement_count = 0  # Reset measurement count
-        last_publish_time = time.time()
-
-    # Graph 1: Raw Voltage Readings
-    figure1 = {
-        'data': [go.Scatter(x=xval, y=yval, mode='lines+markers')],
-        'layout': go.Layout(
-            title='Fluke3000 FC Readings',
-            xaxis=dict(title='Time (s)'),
-            yaxis=dict(title='Voltage (V)'),
-            xaxis_rangeslider=dict(visible=False)
-        )
-    }
-
-    # Graph 2: Rolling Average
-    figure2 = {
-        'data': [go.Scatter(x=xval[:len(yval_rolling)], y=yval_rolling, mode='lines+markers')],
-        'layout': go.Layout(
-            title=f'Rolling Average of Last {ROLLING_AVG_MEASURE} Measurements',
-            xaxis=dict(title='Time (s)'),
-            yaxis=dict(title='Average Voltage (V)'),
-            xaxis_rangeslider=dict(visible=False)
-        )
-    }
-
-    return figure1, figure2
+@app.callback(
+    Output('live-update-graph-2', 'figure'),
+    [Input('live-update-graph-2', 'relayoutData')],
+    prevent_initial_call=True
+)
+def zoom_graph_2(relayout_data):
+    if not is_xaxis_change(relayout_data):
+        return dash.no_update
+    with render_timer(pipeline_metrics, 'zoom_graph'):
+        return rolling_figure(relayout_range(relayout_data))
 
 # =========================
 # Run the Dash App
 # =========================
 if __name__ == '__main__':
-    if ENABLE_DASH:
-        app.run_server(debug=True, use_reloader=False)
-    else:
-        # If Dash is disabled, continuously acquire data and publish to Prometheus
-        try:
-            while True:
-                update_graph(0)
-                time.sleep(DELAY)
-        except KeyboardInterrupt:
-            print("Data acquisition stopped.")
-
-# =========================
-# Cleanup
-# =========================
-mult.reset()
-mult.flush()
+    # Multimeter Initialization
+    mult = open_fluke3000(PORT, BAUD, simulate=SIMULATE, metrics=pipeline_metrics)   # Reopens itself after timeouts
+    fluke = FlukeReader(mult, FLUKE_MODE, metrics=pipeline_metrics)
+
+    # The meter is sampled every DELAY seconds by its own thread, whether or not anyone is watching
+    profiler = make_profiler(PROFILER, PROFILE_FILE, func=acquire)
+    sampler = Sampler(profiler if PROFILER == 'cprofile' else acquire, DELAY, name='fluke-sampler',
+                      metrics=pipeline_metrics)
+    if profiler:
+        profiler.start()
+        write_on_signal(profiler)
+    if publisher:
+        publisher.start()
+    sampler.start()
+    if archive:
+        archive.start()
+    try:
+        if ENABLE_DASH:
+            if live_stream:
+                live_stream.start()
+            app.run(debug=True, use_reloader=False)
+        else:
+            # If Dash is disabled, continuously acquire data and publish to Prometheus
+            while sampler.is_alive():
+                sampler.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.stop(timeout=5)
+        if publisher:
+            publisher.stop(timeout=15)
+        if csv_writer:
+            csv_writer.close()
+        if recording_writer:
+            recording_writer.close()
+        if archive:
+            archive.stop(timeout=5)
+        if live_stream:
+            live_stream.stop(timeout=5)
+        if profiler:
+            profiler.stop(timeout=5)
+        # Leave the meter idle, also when Dash or the sampler ended with an error
+        mult.reset()
+        mult.flush()
+        print("Data acquisition stopped.")
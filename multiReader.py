@@ -0,0 +1,130 @@
+# Authors: Christian Komo, Niels Bidault
+# Several ion pumps at once: any number of Fluke3000 meters plus the MCC128 channels,
+# each polled at its own rate and merged into one time ordered stream.
+#
+# The settings below are turned into a logger config and run by the same pipeline as
+# `fluke3000reader run` (logger.py), see `fluke3000reader config` for every other key.
+
+from fluke3000reader.calibration import DEFAULT_CALIBRATION
+from fluke3000reader.config import load_config, fluke_sections
+from fluke3000reader.cli import run_config
+
+
+ENABLE_DASH = True           # Enable/Disable Dash app
+ENABLE_PROMETHEUS = True     # Enable/Disable Prometheus publishing
+LIVE_STREAM = True           # Push new samples to every open page (Server-Sent Events) instead of each page polling every DELAY
+SIMULATE = False             # Simulated meters and HAT (simulated.py) instead of the hardware
+PROCESSES = False            # Acquisition, recorder, metrics and Dash in separate processes sharing memory
+
+# Fluke3000 Sources, one entry per meter. Meters on different ports are read in parallel,
+# modules sharing a port take turns on it.
+BAUD = 115200
+FLUKE_SOURCES = [
+    {'name': 'ion_pump_1', 'port': "\\.\\COM6", 'mode': 'voltage_dc', 'period': 1, 'calibration': DEFAULT_CALIBRATION},
+]
+
+# MCC128 Source, every listed channel is kept
+MCC128_ENABLE = True
+MCC128_CHANNELS = [0, 1, 2, 3]
+MCC128_SCAN_RATE = 1000.0       # Samples per second per channel
+MCC128_BUFFER_SECONDS = 2.0     # Initial scan buffer, the read period adapts to it and it doubles after an overrun
+MCC128_MAX_RESTARTS = None      # Overruns survived by restarting the scan, None for no limit
+MCC128_CALIBRATIONS = {}        # Channel -> calibration name, DEFAULT_CALIBRATION for the others
+MCC128_FILTER = None            # 'boxcar', 'cic' or 'fir' ahead of the pressure and its averages, None for every raw sample
+MCC128_OUTPUT_RATE = 10         # Rate of the filtered series in Hz
+MCC128_DESPIKE = 0              # Running median window in samples that replaces single-sample glitches, 0 to disable
+
+# Merging
+MAX_LATENESS = 2.0      # Seconds a block may wait for slower sources before it is passed on
+
+# Prometheus Settings, each stream is pushed as its own group (gauge=<source>/<channel>)
+PUSHGATEWAY_ADDRESS = 'localhost:9091'
+PUBLISH_QUEUE_SIZE = 1000
+PUBLISH_INTERVAL = 15
+PIPELINE_METRICS = True     # Read latency, loop jitter, stage and callback times, with the first stream's metrics
+
+# Data Acquisition Settings
+DELAY = 1                # Dash refresh period
+ROLLING_AVG_MEASURE = 10
+PRESSURE_AVG_WINDOWS = {'1min': 60, '1h': 3600}
+PRESSURE_EMA_WINDOWS = {'ema_1min': 60}
+HISTORY_SECONDS = 600    # Seconds of every stream kept in memory
+PLOT_WINDOW = 5000       # Most recent samples shown when a page is opened or the zoom is reset
+ARCHIVE_DIRECTORY = None # Directory of earlier CSV files browsed below the live graphs, None to disable
+
+# Alarm Settings, rules are checked on every block before it is stored or published
+ALARM_RULES = {}        # Name -> [alarm:<name>] keys, e.g. {'pressure_high': {'above': 1e-6, 'clear': 5e-7, 'channels': 'CH0'}}
+ALARM_WEBHOOK = None    # URL every raise and clear is POSTed to as JSON, None to disable
+
+# Calibration Settings
+CALIBRATION_DIR = None
+
+CsvWrite = False
+FILENAME_PREFIX = "multi_voltage_data"  # One long format file: Time,Source,Channel,Voltage
+CSV_FLUSH_ROWS = 1000
+CSV_FLUSH_INTERVAL = 5
+CSV_ROTATE_BYTES = 100 * 1024 * 1024
+CSV_ROTATE_DAILY = True
+CSV_COMPRESS = False
+CSV_TIME_DECIMALS = 4   # Sub-second digits of the Time column
+
+RecordWrite = False     # One binary recording per source, named <prefix>-<source>-<start time>.flk
+RECORDING_PREFIX = "voltage_data"
+
+# =========================
+# Config
+# =========================
+def setting(value):
+    # Module constants -> INI values, None is an empty ("off") setting
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, dict):
+        return ', '.join(f'{name}:{item}' for name, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return ', '.join(str(item) for item in value)
+    return str(value)
+
+def build_config():
+    config = load_config()
+    for section in fluke_sections(config):
+        config.remove_section(section)
+    settings = {
+        'acquisition': {'simulate': SIMULATE, 'processes': PROCESSES, 'max_lateness': MAX_LATENESS,
+                        'history_seconds': HISTORY_SECONDS, 'rolling_average': ROLLING_AVG_MEASURE,
+                        'pressure_windows': PRESSURE_AVG_WINDOWS, 'pressure_emas': PRESSURE_EMA_WINDOWS},
+        'calibration': {'directory': CALIBRATION_DIR},
+        'mcc128': {'enable': MCC128_ENABLE, 'channels': MCC128_CHANNELS, 'scan_rate': MCC128_SCAN_RATE,
+                   'buffer_seconds': MCC128_BUFFER_SECONDS, 'max_restarts': MCC128_MAX_RESTARTS,
+                   'calibrations': MCC128_CALIBRATIONS, 'filter': MCC128_FILTER,
+                   'output_rate': MCC128_OUTPUT_RATE, 'despike': MCC128_DESPIKE},
+        'csv': {'enable': CsvWrite, 'prefix': FILENAME_PREFIX, 'flush_rows': CSV_FLUSH_ROWS,
+                'flush_interval': CSV_FLUSH_INTERVAL, 'rotate_bytes': CSV_ROTATE_BYTES,
+                'rotate_daily': CSV_ROTATE_DAILY, 'compress': CSV_COMPRESS, 'time_decimals': CSV_TIME_DECIMALS},
+        'recording': {'enable': RecordWrite, 'prefix': RECORDING_PREFIX},
+        'prometheus': {'enable': ENABLE_PROMETHEUS, 'pushgateway': PUSHGATEWAY_ADDRESS,
+                       'interval': PUBLISH_INTERVAL, 'queue_size': PUBLISH_QUEUE_SIZE},
+        'dash': {'enable': ENABLE_DASH, 'refresh': DELAY, 'plot_window': PLOT_WINDOW, 'stream': LIVE_STREAM,
+                 'archive': ARCHIVE_DIRECTORY},
+        'instrumentation': {'pipeline_metrics': PIPELINE_METRICS},
+        'alarms': {'webhook': ALARM_WEBHOOK},
+    }
+    for source in FLUKE_SOURCES:
+        settings[f"fluke:{source['name']}"] = {'port': source['port'], 'baud': source.get('baud', BAUD),
+                                               'mode': source['mode'], 'period': source['period'],
+                                               'calibration': source.get('calibration', DEFAULT_CALIBRATION)}
+    for name, rule in ALARM_RULES.items():
+        settings[f'alarm:{name}'] = rule
+    for section, values in settings.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config[section][key] = setting(value)
+    return config
+
+# =========================
+# Run
+# =========================
+if __name__ == '__main__':
+    run_config(build_config())
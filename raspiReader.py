@@ -4,96 +4,139 @@
 from __future__ import print_function
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
-from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
-import plotly.graph_objs as go
+from dash.dependencies import Input, Output, State
+from fluke3000reader.prometheus_publisher import PrometheusPublisher
 import datetime
-import csv
-#import instruments as ik
-import re
-from itertools import count
+from fluke3000reader.timestamps import format_time
+from fluke3000reader.csv_writer import BufferedCsvWriter
+from fluke3000reader.recording import RecordingWriter
 import numpy as np
-from scipy.interpolate import interp1d
-import time
-
-
-from sys import stdout
-from time import sleep
-from daqhats import mcc128, OptionFlags, HatIDs, HatError, AnalogInputMode, \
-    AnalogInputRange
-from daqhats_utils import select_hat_device, enum_mask_to_string, \
-    chan_list_to_mask, input_mode_to_string, input_range_to_string
-
+from fluke3000reader.calibration import get_pressure, load_calibration_dir, DEFAULT_CALIBRATION
+from fluke3000reader.mcc128_reader import AdaptiveHatReader
+from fluke3000reader.readings import FlukeReader, open_fluke3000
+from fluke3000reader.ringbuffer import RingBuffer
+from fluke3000reader.rolling_stats import StreamStats, samples_for, extend_rolling_mean
+from fluke3000reader.filters import make_filter
+from fluke3000reader.live_plot import buffer_series, range_series, live_figure, extend_all, is_xaxis_change, relayout_range
+from fluke3000reader.live_stream import LiveStream, CLIENT_SCRIPT_URL, live_stream_layout
+from fluke3000reader.history import HistoryArchive, history_layout, register_history_callbacks
+import threading
+from fluke3000reader.sampler import Sampler
+from fluke3000reader.instrumentation import PipelineMetrics, stage_timer, render_timer
+from fluke3000reader.profiling import make_profiler, write_on_signal
+from fluke3000reader.alarms import AlarmEngine, WebhookAction, log_action
 
 
 ENABLE_DASH = False           # Enable/Disable Dash app
 ENABLE_PROMETHEUS = True     # Enable/Disable Prometheus publishing
+LIVE_STREAM = True           # Push new samples to every open page (Server-Sent Events) instead of each page polling every DELAY
 mcc128_source = True         # Source from MCC128
+SIMULATE = False             # Simulated meter and HAT (simulated.py) instead of the hardware
+
+if SIMULATE:
+    from fluke3000reader.simulated import mcc128, OptionFlags, HatIDs, AnalogInputMode, AnalogInputRange, \
+        select_hat_device, chan_list_to_mask
+else:
+    from daqhats import mcc128, OptionFlags, HatIDs, AnalogInputMode, AnalogInputRange
+    from daqhats_utils import select_hat_device, chan_list_to_mask
 
 # Serial Port Settings
 BAUD = 115200
 PORT = "\\.\\COM6" # Check in Device Managers where the FLUKE usb bluetooth received is installed
+FLUKE_MODE = 'voltage_dc'  # Fluke3000.Mode name, readings are converted to SI (V, A, Hz, Ohm, K, F)
 
 # Prometheus Settings
-PUSHGATEWAY_ADDRESS = 'localhost:9091'
-registry = CollectorRegistry()
-gauge_avg = Gauge('pressure_list', 'Average Reading from Voltmeter', registry=registry)
-gauge_individual = Gauge('pressure_value', 'Individual Readings from Voltmeter', ['index'], registry=registry)
-gauge_measurement_rate = Gauge('measurement_rate', 'Measurement Rate from Fluke Meter', registry=registry)  # New gauge for measurement rate
+PUSHGATEWAY_ADDRESS = 'localhost:9091'   # None to disable pushing
+PROMETHEUS_HTTP_PORT = None              # Port for an in-process /metrics endpoint (pull mode), None to disable
+PUBLISH_QUEUE_SIZE = 1000                # Blocks held while the Pushgateway is unreachable, oldest are dropped
 
 # Data Acquisition Settings
 INTERVAL = 100
 DELAY = 1
 ROLLING_AVG_MEASURE = 10
+PRESSURE_AVG_WINDOWS = {'1min': 60, '1h': 3600}   # Extra rolling pressure averages, window length in seconds
+PRESSURE_EMA_WINDOWS = {'ema_1min': 60}           # Exponential pressure averages, span in seconds
 PUBLISH_INTERVAL = 15  # Prometheus publishing rate (15 seconds)
+HISTORY_LENGTH = 600000  # Samples per channel kept in memory (10 min at 1 kHz), older ones are overwritten
+PLOT_WINDOW = 5000       # Most recent samples shown when a page is opened or the zoom is reset
+SCAN_BUFFER_SECONDS = 2.0       # Initial MCC128 scan buffer, doubled after every overrun
+MAX_SCAN_BUFFER_SECONDS = 30.0
+MAX_SCAN_RESTARTS = None        # Overruns survived by restarting the scan, None for no limit
+
+# Filter Settings, MCC128 only: the pressure, alarms, rolling averages and Prometheus use the filtered series,
+# the graph, CSV and recording still get every raw sample
+FILTER = None               # 'boxcar', 'cic' or 'fir' before decimating (see filters.py), None for every raw sample
+FILTER_OUTPUT_RATE = 10.0   # Hz, rate of the filtered series, set independently of the scan rate
+DESPIKE_WINDOW = 0          # Running median window in samples that replaces single-sample glitches, 0 to disable
+
+# Alarm Settings, rules are checked on every reading before it is stored or published
+ALARM_RULES = []        # e.g. [ThresholdRule('pressure_high', above=1e-6, clear=5e-7)] from fluke3000reader.alarms
+ALARM_WEBHOOK = None    # URL every raise and clear is POSTed to as JSON, None to disable
+
+# Instrumentation Settings
+PIPELINE_METRICS = True         # Read latency, loop jitter, stage and callback times and drop counters, with the Prometheus metrics
+PROFILER = None                 # 'sampling' (every thread, collapsed stacks) or 'cprofile' (every acquisition), None to disable
+PROFILE_FILE = "profile.txt"    # Written on exit, and on SIGUSR1 while running
+
+# Calibration Settings
+CALIBRATION = DEFAULT_CALIBRATION  # Name of the ion pump calibration curve used for pressure
+CALIBRATION_DIR = None             # Optional directory of voltage_mV,pressure_Torr CSV tables, one per gauge
 
 CsvWrite = False
-FILENAME = f"voltage_data-{datetime.datetime.now().strftime('%Y-%m-%d_%H_%M_%S')}.csv"
+FILENAME_PREFIX = "voltage_data"        # Files are named <prefix>-<start time>.csv
+CSV_FLUSH_ROWS = 1000                   # Rows buffered in memory before they are written
+CSV_FLUSH_INTERVAL = 5                  # Seconds, upper bound on how far the file lags behind
+CSV_ROTATE_BYTES = 100 * 1024 * 1024    # Start a new file past this size, None to disable
+CSV_ROTATE_DAILY = True                 # Start a new file every day
+CSV_COMPRESS = False                    # gzip files once they are closed
+CSV_TIME_DECIMALS = 4                   # Sub-second digits of the Time column, scan samples are 1 ms apart
+ARCHIVE_DIRECTORY = None                # Directory of earlier CSV files browsed below the live graphs, None to disable
+
+RecordWrite = False     # Binary recording on/off, compact float32 samples that can be memory-mapped for replay
+RECORDING_FILENAME = f"voltage_data-{datetime.datetime.now().strftime('%Y-%m-%d_%H_%M_%S')}.flk"
 
 # =========================
 # Data Structures
 # =========================
-xval = []
-yval = []
-yval_rolling = []
-timeval = []
-timesec = count()
-pressure_list = []
-last_publish_time = time.time()
-measurement_count = 0  # Counter for measurements
-
-# Multimeter Initialization
-##mult = ik.fluke.Fluke3000.open_serial(PORT, BAUD)
+# The sampler thread writes these, Dash callbacks only read snapshots, always under data_lock
+data_lock = threading.Lock()
+
+# Pipeline health, published in the same registry as the pressure metrics
+pipeline_metrics = PipelineMetrics() if ENABLE_PROMETHEUS and PIPELINE_METRICS else None
+
+# Multimeter Initialization, only when it is the selected source
+if not mcc128_source:
+    mult = open_fluke3000(PORT, BAUD, simulate=SIMULATE, metrics=pipeline_metrics)   # Reopens itself after timeouts
+    fluke = FlukeReader(mult, FLUKE_MODE, metrics=pipeline_metrics)
 
 # =========================
-# CSV Writing Function
+# CSV Writing
 # =========================
-def CsvWriteData(name, data, time):
-    with open(name, 'a', newline='') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        if csvfile.tell() == 0:
-            csvwriter.writerow(['Time', 'Voltage'])
-        now = datetime.datetime.now()
-        dateStamp = now.strftime('%Y-%m-%d') + " " + time
-        csvwriter.writerow([dateStamp, data])
+# One writer for the whole run, rows are batched and files rotated by BufferedCsvWriter
+csv_writer = BufferedCsvWriter(FILENAME_PREFIX, flush_rows=CSV_FLUSH_ROWS, flush_interval=CSV_FLUSH_INTERVAL,
+                               rotate_bytes=CSV_ROTATE_BYTES, rotate_daily=CSV_ROTATE_DAILY,
+                               compress=CSV_COMPRESS, epoch_times=True,
+                               time_decimals=CSV_TIME_DECIMALS) if CsvWrite else None
 
 # =========================
-# Prometheus Publishing Function
+# Prometheus Publishing
 # =========================
-def publish_to_prometheus(voltage_list, measurement_rate):
-    if not voltage_list:
-        return
-
-    avg_voltage = sum(voltage_list) / len(voltage_list)
-    gauge_avg.set(avg_voltage)
+def rolling_averages():
+    with data_lock:
+        return {name: float(mean[0]) for name, mean in pressure_stats.means().items()}
 
-    for idx, value in enumerate(voltage_list):
-        gauge_individual.labels(index=idx).set(value)
+# Pushes (or serves) metrics from its own thread, acquisition only queues readings
+publisher = PrometheusPublisher(gateway=PUSHGATEWAY_ADDRESS, http_port=PROMETHEUS_HTTP_PORT,
+                                interval=PUBLISH_INTERVAL, max_queue=PUBLISH_QUEUE_SIZE,
+                                rolling_averages=rolling_averages,
+                                registry=pipeline_metrics.registry if pipeline_metrics else None
+                                ) if ENABLE_PROMETHEUS else None
 
-    gauge_measurement_rate.set(measurement_rate)  # Publish measurement rate
-
-    push_to_gateway(PUSHGATEWAY_ADDRESS, job='voltmeter', registry=registry)
-    print(f"[Prometheus] Data Sent: Avg = {avg_voltage:.2f} V | Total Readings = {len(voltage_list)} | Measurement Rate = {measurement_rate:.2f} Hz")
+# =========================
+# Alarms
+# =========================
+alarms = AlarmEngine(ALARM_RULES, [log_action] + ([WebhookAction(ALARM_WEBHOOK)] if ALARM_WEBHOOK else [])
+                     ) if ALARM_RULES else None
 
 # =========================
 # mcc128 publishing
@@ -109,11 +152,27 @@ num_channels = len(channels)
 input_mode = AnalogInputMode.SE
 input_range = AnalogInputRange.BIP_10V
          
-samples_per_channel = 0
 options = OptionFlags.CONTINUOUS
          
 scan_rate = 1000.0
 
+# Live series storage, one row per scanned channel (a single row for the Fluke)
+live_data = RingBuffer(HISTORY_LENGTH, num_channels if mcc128_source else 1)
+rolling_data = RingBuffer(HISTORY_LENGTH)
+
+# Filtered series, state is carried from one scan read to the next
+filter_chain = make_filter(FILTER, scan_rate, FILTER_OUTPUT_RATE, despike=DESPIKE_WINDOW,
+                           num_channels=num_channels) if mcc128_source else None
+filtered_data = RingBuffer(samples_for(HISTORY_LENGTH / scan_rate, filter_chain.output_rate), num_channels
+                           ) if filter_chain else live_data
+
+# Rolling pressure statistics of the displayed channel, fed a whole block at a time
+sample_rate = filter_chain.output_rate if filter_chain else scan_rate if mcc128_source else 1 / DELAY
+pressure_stats = StreamStats(
+    windows={f'{ROLLING_AVG_MEASURE}_samples': ROLLING_AVG_MEASURE,
+             **{name: samples_for(seconds, sample_rate) for name, seconds in PRESSURE_AVG_WINDOWS.items()}},
+    emas={name: samples_for(seconds, sample_rate) for name, seconds in PRESSURE_EMA_WINDOWS.items()})
+
             
 # Select an MCC 128 HAT device to use.
 address = select_hat_device(HatIDs.MCC_128)
@@ -123,160 +182,229 @@ hat.a_in_range_write(input_range)
 
 
 # Configure and start the scan.
-# Since the continuous option is being used, the samples_per_channel
-# parameter is ignored if the value is less than the default internal
-# buffer size (10000 * num_channels in this case). If a larger internal
-# buffer size is desired, set the value of this parameter accordingly.
-hat.a_in_scan_start(channel_mask, samples_per_channel, scan_rate,
-                            options)
-         
-read_request_size = READ_ALL_AVAILABLE
-timeout = 5.0
-
+# The reader sizes the scan buffer (samples_per_channel) and its read period from the
+# scan rate, stamps samples from the scan clock and restarts the scan after an overrun.
+hat_reader = AdaptiveHatReader(hat, channels, scan_rate, options, buffer_seconds=SCAN_BUFFER_SECONDS,
+                               max_buffer_seconds=MAX_SCAN_BUFFER_SECONDS, max_restarts=MAX_SCAN_RESTARTS,
+                               metrics=pipeline_metrics)
+if mcc128_source:
+    hat_reader.start()
+
+# Binary recording of every scanned channel
+if mcc128_source:
+    recording_metadata = {'source': 'mcc128', 'address': address, 'channels': channels,
+                          'scan_rate': scan_rate, 'calibration': CALIBRATION}
+else:
+    recording_metadata = {'source': 'fluke3000', 'port': PORT, 'calibration': CALIBRATION, 'sample_period': DELAY}
+recording_writer = RecordingWriter(RECORDING_FILENAME,
+                                   channels=[f'CH{channel}' for channel in channels] if mcc128_source else ['Voltage'],
+                                   metadata=recording_metadata) if RecordWrite else None
+
+load_calibration_dir(CALIBRATION_DIR)
 
 # =========================
-# Dash App Setup
+# Block Processing
 # =========================
-app = dash.Dash(__name__)
-app.layout = html.Div([
-    dcc.Graph(id='live-update-graph-1'),
-    dcc.Graph(id='live-update-graph-2'),
-    dcc.Interval(id='interval-component', interval=DELAY * 1000, n_intervals=0)
-])
-
-def create_interpolator():
-    # Provided by VARIAN Ion Pump controller 921-0062
-    voltage_mV = np.array([5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, 40.0, 45.0, 50.0,
-                           55.0, 60.0, 65.0, 70.0, 75.0, 80.0, 85.0, 90.0, 95.0])
-    pressure_Torr = np.array([1e-8, 1.5e-8, 2.4e-8,
-                              3.7e-8, 6.0e-8, 1.0e-7,
-                              1.7e-7, 3.0e-7, 5.5e-7,
-                              1.0e-6, 1.6e-6, 2.8e-6,
-                              5.0e-6, 8.0e-6, 1.5e-5,
-                              2.6e-5, 4.0e-5, 6.0e-5,
-                              1.0e-4])
+def process_block(sample_block, display_channel):
+    # SampleBlock values hold one row per channel, every downstream stage works on whole rows
+    block = sample_block.values
+    timestamps = sample_block.timestamps
+    volts = block[display_channel]
+    samples = len(volts)
+
+    # Pressure and everything derived from it come from the filtered series
+    with stage_timer(pipeline_metrics, 'filter'):
+        filtered = filter_chain.process(sample_block) if filter_chain else sample_block
+    filtered_samples = len(filtered.timestamps)
+
+    # Pressure of all channels in one interpolation call
+    with stage_timer(pipeline_metrics, 'pressure'):
+        pressures = get_pressure(filtered.values * 1000, unit='Torr', calibration=CALIBRATION)
+    # Alarms first, an excursion is acted on before the block is stored or published
+    if alarms:
+        with stage_timer(pipeline_metrics, 'alarms'):
+            alarms.check(filtered, pressures)
+    print(f"{format_time(timestamps[-1])} Measured Voltage: {volts[-1]:.5f} V ({samples} samples/channel, block mean {np.mean(volts):.5f} V)")
+
+    with data_lock, stage_timer(pipeline_metrics, 'buffers'):
+        live_data.extend(timestamps, block)
+        if filter_chain:
+            filtered_data.extend(filtered.timestamps, filtered.values)
+        pressure_stats.update(pressures[display_channel])
+
+        # Rolling Average Calculation, one value per new sample once the window is full
+        extend_rolling_mean(rolling_data, filtered_data, filtered.timestamps, ROLLING_AVG_MEASURE, display_channel)
 
-    # Interpolation with extrapolation for values below 5 mV
-    interpolator = interp1d(voltage_mV, pressure_Torr, kind='cubic', fill_value='extrapolate')
-
-    return interpolator
-
-def get_pressure(voltage_mV, unit='Torr'):
+    # CSV Writing
+    if CsvWrite:
+        with stage_timer(pipeline_metrics, 'csv'):
+            csv_writer.write_rows([t, str(value)] for t, value in zip(timestamps.tolist(), volts.tolist()))
+    if RecordWrite:
+        with stage_timer(pipeline_metrics, 'recording'):
+            recording_writer.append(timestamps, block)
 
-    interpolator = create_interpolator()
-    pressure_Torr = interpolator(voltage_mV)
+    # Prometheus, handed off to the publisher thread
+    if publisher and filtered_samples:
+        publisher.submit(pressures[display_channel], filtered.timestamps[-1])
 
-    if unit == 'mbar':
-        return pressure_Torr * 1.33322  # Conversion factor from Torr to mbar
-    return pressure_Torr
+# =========================
+# Acquisition
+# =========================
+def acquire(mcc128_measurements):
+    # Acquire voltage data as a SampleBlock of (channels, samples) values
+    display_channel = 0
+    if mcc128_measurements:
+        # Every sample of every channel; overruns are recovered by the reader,
+        # None only once its restart limit is reached
+        sample_block = hat_reader.read_block()
+        if sample_block is None:
+            return False
+        display_channel = CHANNEL
+    else:
+        sample_block = fluke.read_block()
 
+    if sample_block.values.shape[1] > 0:
+        process_block(sample_block, display_channel)
+    return True
 
 # =========================
-# Dash Callback for Updating Graphs
+# Dash App Setup
 # =========================
-@app.callback(
-    [Output('live-update-graph-1', 'figure'),
-     Output('live-update-graph-2', 'figure')],
-    [Input('interval-component', 'n_intervals')]
-)
-def update_graph(n, mcc128_measurements):
-    global pressure_list, last_publish_time, measurement_count
-    # Acquire voltage data
-    volt = ''
-    xval.append(next(timesec))
-    current_time = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-4]
-    timeval.append(current_time)
-    data = None
-    if mcc128_measurements:
-        read_result = hat.a_in_scan_read(read_request_size, timeout)
+DISPLAY_CHANNEL = CHANNEL if mcc128_source else 0
 
-        # Check for an overrun error
-        if read_result.hardware_overrun:
-            print('\n\nHardware overrun\n')
-            return False
-        elif read_result.buffer_overrun:
-            print('\n\nBuffer overrun\n')
-            return False
+# Earlier CSV files, indexed by their own thread and drawn from min/max summaries
+archive = HistoryArchive(ARCHIVE_DIRECTORY) if ARCHIVE_DIRECTORY else None
 
-        samples_read_per_channel = int(len(read_result.data) / num_channels)
-        if samples_read_per_channel > 0:
-            index = samples_read_per_channel * num_channels - num_channels
-            data = '{:10.5f}'.format(read_result.data[index + CHANNEL]) + ' V'
+def voltage_figure(x_range=None):
+    # Graph 1: Raw Voltage Readings, x is the sample time
+    with data_lock:
+        if x_range is None:
+            xval, yval = buffer_series(live_data, DISPLAY_CHANNEL, n=PLOT_WINDOW)
         else:
-            data = '0.0 V'
-    else:
-        data = mult.measure(mult.Mode.voltage_dc)
-    # Process the data
-    if str(data) != '0.0 V':
-        value = re.findall(r'-?\d+\.\d+', str(data))
-        volt = float(value[0])
-    else:
-        volt = 0
+            xval, yval = range_series(live_data, *x_range, channel=DISPLAY_CHANNEL)
+    return live_figure(xval, yval, 'Fluke3000 FC Readings', 'Time', 'Voltage (V)', x_range)
+
+def rolling_figure(x_range=None):
+    # Graph 2: Rolling Average, each average is stamped with the time of its newest sample
+    with data_lock:
+        if x_range is None:
+            xval, yval = buffer_series(rolling_data, n=PLOT_WINDOW)
+        else:
+            xval, yval = range_series(rolling_data, *x_range)
+    return live_figure(xval, yval, f'Rolling Average of Last {ROLLING_AVG_MEASURE} Measurements',
+                       'Time', 'Average Voltage (V)', x_range)
+
+def serve_layout():
+    # Built on every page load so a new tab starts from the current buffer contents
+    with render_timer(pipeline_metrics, 'serve_layout'):
+        with data_lock:
+            last_sent = [live_data.total, rolling_data.total]
+        return html.Div([
+            dcc.Graph(id='live-update-graph-1', figure=voltage_figure()),
+            dcc.Graph(id='live-update-graph-2', figure=rolling_figure())
+        ] + ([live_stream_layout(last_sent)] if LIVE_STREAM else [
+            dcc.Interval(id='interval-component', interval=DELAY * 1000, n_intervals=0),
+            dcc.Store(id='last-sent', data=last_sent)
+        ]) + ([history_layout(archive)] if archive else []))
+
+app = dash.Dash(__name__, external_scripts=[CLIENT_SCRIPT_URL] if LIVE_STREAM else [])
+app.layout = serve_layout
+if archive:
+    register_history_callbacks(app, archive)
 
-    yval.append(volt)
-    pressure_list.append(get_pressure(volt * 1000, unit='Torr'))
-    measurement_count += 1  # Increment measurement count
-    print(f"Measured Voltage: {volt} V")
+# =========================
+# Dash Callbacks for Updating Graphs
+# =========================
+if LIVE_STREAM:
+    # One reader of the buffers every DELAY, whatever the number of open pages
+    live_stream = LiveStream(data_lock, interval=DELAY, metrics=pipeline_metrics)
+    live_stream.add('live-update-graph-1', live_data, DISPLAY_CHANNEL)
+    live_stream.add('live-update-graph-2', rolling_data)
+    live_stream.register(app.server)
+else:
+    live_stream = None
+
+    @app.callback(
+        [Output('live-update-graph-1', 'extendData'),
+         Output('live-update-graph-2', 'extendData'),
+         Output('last-sent', 'data')],
+        [Input('interval-component', 'n_intervals')],
+        [State('last-sent', 'data')]
+    )
+    def update_graph(n, last_sent):
+        with render_timer(pipeline_metrics, 'update_graph'), data_lock:
+            extends, sent = extend_all([(live_data, DISPLAY_CHANNEL), (rolling_data, 0)], last_sent)
+        return extends[0] or dash.no_update, extends[1] or dash.no_update, sent
 
-    # Rolling Average Calculation
-    if len(yval) >= ROLLING_AVG_MEASURE:
-        temp_avg = np.mean(yval[-ROLLING_AVG_MEASURE:])
-        yval_rolling.append(temp_avg)
+@app.callback(
+    Output('live-update-graph-1', 'figure'),
+    [Input('live-update-graph-1', 'relayoutData')],
+    prevent_initial_call=True
+)
+def zoom_graph_1(relayout_data):
+    if not is_xaxis_change(relayout_data):
+        return dash.no_update
+    with render_timer(pipeline_metrics, 'zoom_graph'):
+        return voltage_figure(relayout_range(relayout_data))
 
-    # CSV Writing
-    if CsvWrite:
-        CsvWriteData(FILENAME, str(volt), current_time)
-
-    # Prometheus Publishing Every 15 Seconds
-    if ENABLE_PROMETHEUS and (time.time() - last_publish_time >= PUBLISH_INTERVAL):
-        measurement_rate = measurement_count / PUBLISH_INTERVAL  # Calculate measurement rate
-        publish_to_prometheus(pressure_list, measurement_rate)
-        pressure_list = []  # Clear the list after publishing
-        measurement_count = 0  # Reset measurement count
-        last_publish_time = time.time()
-
-    # Graph 1: Raw Voltage Readings
-    figure1 = {
-        'data': [go.Scatter(x=xval, y=yval, mode='lines+markers')],
-        'layout': go.Layout(
-            title='Fluke3000 FC Readings',
-            xaxis=dict(title='Time (s)'),
-            yaxis=dict(title='Voltage (V)'),
-            xaxis_rangeslider=dict(visible=False)
-        )
-    }
-
-    # Graph 2: Rolling Average
-    figure2 = {
-        'data': [go.Scatter(x=xval[:len(yval_rolling)], y=yval_rolling, mode='lines+markers')],
-        'layout': go.Layout(
-            title=f'Rolling Average of Last {ROLLING_AVG_MEASURE} Measurements',
-            xaxis=dict(title='Time (s)'),
-            yaxis=dict(title='Average Voltage (V)'),
-            xaxis_rangeslider=dict(visible=False)
-        )
-    }
-    return True
-    # return figure1, figure2
+@app.callback(
+    Output('live-update-graph-2', 'figure'),
+    [Input('live-update-graph-2', 'relayoutData')],
+    prevent_initial_call=True
+)
+def zoom_graph_2(relayout_data):
+    if not is_xaxis_change(relayout_data):
+        return dash.no_update
+    with render_timer(pipeline_metrics, 'zoom_graph'):
+        return rolling_figure(relayout_range(relayout_data))
 
 # =========================
 # Run the Dash App
 # =========================
 if __name__ == '__main__':
-    if ENABLE_DASH:
-        app.run(debug=True, use_reloader=False)
-    else:
-        # If Dash is disabled, continuously acquire data and publish to Prometheus   
-        mcc128NoBug = True
-        try:
-            while mcc128NoBug:
-                mcc128NoBug = update_graph(0, mcc128_source)
-                time.sleep(DELAY)
-        except KeyboardInterrupt:
-            print("Data acquisition stopped.")
-
-# =========================
-# Cleanup
-# =========================
-#mult.reset()
-#mult.flush()
+    # The source is read by its own thread, whether or not anyone is watching: the Fluke every DELAY
+    # seconds, the HAT at the period its reader adapts. acquire() returning False stops the sampler.
+    period = (lambda: hat_reader.period) if mcc128_source else DELAY
+    profiler = make_profiler(PROFILER, PROFILE_FILE, func=lambda: acquire(mcc128_source))
+    sampler = Sampler(profiler if PROFILER == 'cprofile' else lambda: acquire(mcc128_source), period,
+                      name='mcc128-sampler' if mcc128_source else 'fluke-sampler', metrics=pipeline_metrics)
+    if profiler:
+        profiler.start()
+        write_on_signal(profiler)
+    if publisher:
+        publisher.start()
+    sampler.start()
+    if archive:
+        archive.start()
+    try:
+        if ENABLE_DASH:
+            if live_stream:
+                live_stream.start()
+            app.run(debug=True, use_reloader=False)
+        else:
+            # If Dash is disabled, continuously acquire data and publish to Prometheus
+            while sampler.is_alive():
+                sampler.join(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.stop(timeout=5)
+        if publisher:
+            publisher.stop(timeout=15)
+        if csv_writer:
+            csv_writer.close()
+        if recording_writer:
+            recording_writer.close()
+        if archive:
+            archive.stop(timeout=5)
+        if live_stream:
+            live_stream.stop(timeout=5)
+        if profiler:
+            profiler.stop(timeout=5)
+        # Leave the hardware idle, also when Dash or the sampler ended with an error
+        if mcc128_source:
+            hat_reader.stop()
+        else:
+            mult.reset()
+            mult.flush()
+        print("Data acquisition stopped.")